@@ -1,9 +1,10 @@
 from django.contrib import admin
 
-from api.models import AnnotatedLine, Author, Book, Manuscript, TextField
+from api.models import AnnotatedLine, Author, Book, Job, Manuscript, TextField
 
 admin.site.register(Author)
 admin.site.register(Book)
 admin.site.register(Manuscript)
 admin.site.register(TextField)
-admin.site.register(AnnotatedLine)
\ No newline at end of file
+admin.site.register(AnnotatedLine)
+admin.site.register(Job)
@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        from .search import restore_triggers
+        post_migrate.connect(restore_triggers, sender=self)
+        # connects the receivers that queue collations and number lines
+        from . import jobs, lines  # noqa: F401
@@ -0,0 +1,74 @@
+''' Normalization of Arabic-script text for search and comparison.
+The same word is written with or without harakat and tatweel, and
+with several forms of alif, hamza, ya and ha; all of these are mapped
+onto one form, by a single translation table. Presentation forms and
+Persian letters are mapped onto the basic Arabic letters as well.
+The normalized text is computed whenever annotations are written, and kept
+in their normalized_text (see models.py).
+'''
+import unicodedata
+
+REMOVED = [
+    (0x0610, 0x061A),  # honorifics and Quranic annotation signs
+    (0x064B, 0x065F),  # harakat: tanwin, fatha, damma, kasra, shadda, sukun, ...
+    (0x0670, 0x0670),  # superscript alif
+    (0x06D6, 0x06ED),  # Quranic annotation signs
+    (0x0640, 0x0640),  # tatweel
+    (0x200B, 0x200F),  # zero-width spaces and joiners, direction marks
+    (0x202A, 0x202E),  # direction embeddings
+    (0xFEFF, 0xFEFF),  # zero-width no-break space
+]
+
+REPLACED = {
+    'آ': 'ا', 'أ': 'ا', 'إ': 'ا', 'ٱ': 'ا', 'ٲ': 'ا', 'ٳ': 'ا',
+    'ؤ': 'و',
+    'ئ': 'ي', 'ى': 'ي', 'ی': 'ي', 'ې': 'ي', 'ۍ': 'ي',
+    'ة': 'ه', 'ۀ': 'ه', 'ہ': 'ه', 'ە': 'ه',
+    'ک': 'ك', 'ڪ': 'ك',
+    '٠': '0', '١': '1', '٢': '2', '٣': '3', '٤': '4',
+    '٥': '5', '٦': '6', '٧': '7', '٨': '8', '٩': '9',
+    '۰': '0', '۱': '1', '۲': '2', '۳': '3', '۴': '4',
+    '۵': '5', '۶': '6', '۷': '7', '۸': '8', '۹': '9',
+}
+
+PRESENTATION_FORMS = [(0xFB50, 0xFDFF), (0xFE70, 0xFEFC)]
+
+
+def build_table():
+    table = {}
+    for first, last in REMOVED:
+        for code in range(first, last + 1):
+            table[code] = None
+    for letter, replacement in REPLACED.items():
+        table[ord(letter)] = replacement
+    # ligatures and contextual forms decompose to letters, which are then
+    # mapped like any other; the table is applied once per character
+    for first, last in PRESENTATION_FORMS:
+        for code in range(first, last + 1):
+            decomposed = unicodedata.normalize('NFKC', chr(code))
+            if decomposed != chr(code):
+                table[code] = decomposed.translate(table)
+    return table
+
+
+TABLE = build_table()
+
+
+def normalize(text):
+    ''' The normalized form of a text: without diacritics and tatweel,
+    with one form of each letter, in lower case and with single spaces.
+    '''
+    return ' '.join(text.translate(TABLE).lower().split())
+
+
+def strings(value):
+    ''' The text in a JSON value, such as the hypotext of a line:
+    strings, the items of lists and the 'text' of objects.
+    '''
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, list):
+        for item in value:
+            yield from strings(item)
+    elif isinstance(value, dict):
+        yield from strings(value.get('text'))
@@ -0,0 +1,18 @@
+from .arabic import normalize, strings
+
+
+def test_normalize():
+    # harakat, tatweel and direction marks are removed
+    assert normalize('بِسْمِ اللّٰهِ') == 'بسم الله'
+    assert normalize('كتــــاب‏') == 'كتاب'
+    # letter forms
+    assert normalize('أإآٱ') == 'اااا'
+    assert normalize('مؤمن رئيس على مدرسة') == 'مومن رييس علي مدرسه'
+    assert normalize('کتاب فارسی') == 'كتاب فارسي'
+    # presentation forms, digits, case and spaces
+    assert normalize('ﻻ') == 'لا'
+    assert normalize('١٢٣  Ibn\tKhaldun ') == '123 ibn khaldun'
+
+
+def test_strings():
+    assert list(strings([{'text': 'قال', 'note': 'x'}, 'ثم', None, {'text': ['هو']}])) == ['قال', 'ثم', 'هو']
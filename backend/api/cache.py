@@ -0,0 +1,95 @@
+''' Bounded on-disk caches for derived images.
+Entries are files named after their key. When the total size of a
+cache exceeds its maximum, the least recently used entries are removed.
+The total is counted once and then kept up to date on every put, so that
+the entries are only listed again when some have to be removed.
+'''
+import os
+import tempfile
+import threading
+import time
+
+# the total size of each cache directory and when it was counted, per process
+_totals = {}
+_lock = threading.Lock()
+
+
+class DiskCache:
+    # other processes write to the same directory, so it is counted again
+    # after this many seconds
+    RECOUNT = 300
+    # eviction goes below the maximum, so that it is not needed on every put
+    LOW_WATER = 0.9
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        ''' The path of the entry for key, or None if it is not cached. '''
+        path = self.path(key)
+        try:
+            # the modification time records the last use
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, data):
+        ''' Store data under key, and return the path of the entry. '''
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first, so readers never see partial entries
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(descriptor, 'wb') as output:
+            output.write(data)
+        try:
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(temporary, path)
+        self.grow(len(data) - replaced)
+        return path
+
+    def grow(self, size):
+        ''' Add size to the total, and evict if it no longer fits. '''
+        with _lock:
+            total, counted = _totals.get(self.directory, (None, 0))
+            if total is None or time.monotonic() - counted > self.RECOUNT:
+                total = sum(size for _, size, _ in self.entries())
+                counted = time.monotonic()
+            else:
+                total += size
+            _totals[self.directory] = (total, counted)
+            if total > self.max_bytes:
+                self.evict()
+
+    def entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, os.path.join(root, name)
+
+    def evict(self):
+        ''' Remove the least recently used entries until the cache fits,
+        with room to spare.
+        '''
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes * self.LOW_WATER:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        _totals[self.directory] = (total, time.monotonic())
@@ -0,0 +1,242 @@
+''' Collation of the manuscripts of a book: the transcribed lines of
+all manuscripts are aligned, and the readings of aligned lines compared
+word by word, in normalized form (see arabic.py).
+
+Chapters that correspond across manuscripts (by Chapter.same_as) anchor
+the alignment: the lines from one such chapter to the next form a block,
+which is aligned on its own. Blocks are stored with a digest of their
+lines, so that after an edit, only the blocks that changed are aligned
+again. Blocks are independent, and may be aligned in a process pool.
+
+Within a block, the manuscript with the most lines is the base, and
+each other manuscript is aligned to it: identical lines are matched
+first, and the lines in between by the similarity of their words.
+'''
+from difflib import SequenceMatcher
+from hashlib import sha1
+from itertools import zip_longest
+from multiprocessing import Pool
+import json
+
+from django.db import connections, transaction
+
+from .models import Alignment, AnnotatedLine, Book, Chapter
+
+START = 'start'
+# lines whose words are less similar than this are not aligned
+MIN_SIMILARITY = 0.5
+# larger gaps between identical lines are aligned in order
+MAX_CELLS = 40000
+
+
+def anchors(book_id):
+    ''' The positions of the chapters that correspond to a chapter of
+    another manuscript, by manuscript, each with the key of its group
+    of corresponding chapters (named after the lowest id in the group).
+    Also returns the rank of each group: the lowest number of anchoring
+    chapters that precede it in a manuscript.
+    '''
+    chapters = list(Chapter.objects.filter(annotation__manuscript__book=book_id).values_list(
+        'pk', 'same_as', 'annotation__manuscript', 'annotation__page', 'annotation__min_y'))
+    parent = {pk: pk for pk, *_ in chapters}
+
+    def root(pk):
+        while parent[pk] != pk:
+            parent[pk] = parent[parent[pk]]
+            pk = parent[pk]
+        return pk
+
+    for pk, same_as, *_ in chapters:
+        if same_as in parent:
+            first, second = root(pk), root(same_as)
+            parent[max(first, second)] = min(first, second)
+    manuscripts = {}
+    for pk, _, manuscript, _, _ in chapters:
+        manuscripts.setdefault(root(pk), set()).add(manuscript)
+    found = {}
+    for pk, _, manuscript, page, min_y in chapters:
+        group = root(pk)
+        if len(manuscripts[group]) > 1:
+            found.setdefault(manuscript, []).append(((page, min_y or 0), 'chapter-{}'.format(group)))
+    rank = {}
+    for positions in found.values():
+        positions.sort()
+        for index, (_, key) in enumerate(positions):
+            rank[key] = min(rank.get(key, index), index)
+    return found, rank
+
+
+def blocks(book_id):
+    ''' The lines of a book, in reading order, split into blocks at
+    the anchoring chapters. Returns a dict from the key of each block
+    to its lines by manuscript (as (id, normalized text) pairs),
+    and the keys in the order of the book.
+    '''
+    chapters, rank = anchors(book_id)
+    lines = AnnotatedLine.objects.filter(
+        annotation__manuscript__book=book_id, annotation__sequence__isnull=False,
+    ).order_by('annotation__manuscript', 'annotation__sequence').values_list(
+        'pk', 'annotation__manuscript', 'annotation__page', 'annotation__min_y', 'annotation__normalized_text')
+    found = {}
+    current = None
+    for pk, manuscript, page, min_y, text in lines:
+        if manuscript != current:
+            current, index, key = manuscript, 0, START
+            starts = chapters.get(manuscript, [])
+        while index < len(starts) and starts[index][0] <= (page, min_y or 0):
+            key = starts[index][1]
+            index += 1
+        # JSON keys are strings
+        found.setdefault(key, {}).setdefault(str(manuscript), []).append((pk, text))
+    order = sorted(found, key=lambda key: (rank.get(key, -1), key))
+    return found, order
+
+
+def digest(block):
+    return sha1(json.dumps(block, sort_keys=True).encode()).hexdigest()
+
+
+def similarity(first, second):
+    return SequenceMatcher(None, first.split(), second.split(), autojunk=False).ratio()
+
+
+def align_gap(base, other):
+    ''' Align two short runs of lines by the similarity of their words,
+    maximizing the total similarity of aligned lines (Needleman-Wunsch,
+    where gaps cost nothing and dissimilar lines are not aligned).
+    Returns pairs of indices, where either may be None.
+    '''
+    if not base or not other or len(base) * len(other) > MAX_CELLS:
+        return list(zip_longest(range(len(base)), range(len(other))))
+    score = [[0.0] * (len(other) + 1) for _ in range(len(base) + 1)]
+    aligned = [[False] * (len(other) + 1) for _ in range(len(base) + 1)]
+    for i in range(1, len(base) + 1):
+        for j in range(1, len(other) + 1):
+            score[i][j] = max(score[i - 1][j], score[i][j - 1])
+            gain = similarity(base[i - 1], other[j - 1]) - MIN_SIMILARITY
+            if gain > 0 and score[i - 1][j - 1] + gain > score[i][j]:
+                score[i][j] = score[i - 1][j - 1] + gain
+                aligned[i][j] = True
+    pairs = []
+    i, j = len(base), len(other)
+    while i or j:
+        if i and j and aligned[i][j]:
+            pairs.append((i - 1, j - 1))
+            i, j = i - 1, j - 1
+        elif i and (not j or score[i][j] == score[i - 1][j]):
+            pairs.append((i - 1, None))
+            i -= 1
+        else:
+            pairs.append((None, j - 1))
+            j -= 1
+    pairs.reverse()
+    return pairs
+
+
+def align_pair(base, other):
+    ''' Align the texts of the lines of a manuscript to those of the base.
+    Returns pairs of indices in order, where either may be None.
+    '''
+    pairs = []
+    matcher = SequenceMatcher(None, base, other, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            pairs.extend(zip(range(i1, i2), range(j1, j2)))
+        else:
+            pairs.extend(
+                (i1 + i if i is not None else None, j1 + j if j is not None else None)
+                for i, j in align_gap(base[i1:i2], other[j1:j2])
+            )
+    return pairs
+
+
+def variants(base, reading):
+    ''' The words in which a reading differs from the base,
+    as [operation, base words, words of the reading].
+    '''
+    base, reading = base.split(), reading.split()
+    return [
+        [tag, ' '.join(base[i1:i2]), ' '.join(reading[j1:j2])]
+        for tag, i1, i2, j1, j2 in SequenceMatcher(None, base, reading, autojunk=False).get_opcodes()
+        if tag != 'equal'
+    ]
+
+
+def align_block(block):
+    ''' Align the lines of a block, given by manuscript. Returns rows,
+    each with the line of each manuscript that has one in the row,
+    and the variants of the other manuscripts from the first of them.
+    '''
+    manuscripts = sorted(block, key=lambda manuscript: (-len(block[manuscript]), int(manuscript)))
+    base, others = manuscripts[0], manuscripts[1:]
+    base_texts = [text for _, text in block[base]]
+    matched = {}
+    inserted = {}
+    for manuscript in others:
+        texts = [text for _, text in block[manuscript]]
+        before = 0
+        for i, j in align_pair(base_texts, texts):
+            if i is None:
+                inserted.setdefault((before, manuscript), []).append(j)
+            else:
+                before = i + 1
+                if j is not None:
+                    matched[(i, manuscript)] = j
+    rows = []
+    for i in range(len(base_texts) + 1):
+        # lines that the base lacks, before its line i, side by side
+        extra = [[(manuscript, j) for j in inserted.get((i, manuscript), [])] for manuscript in others]
+        for cells in zip_longest(*extra):
+            rows.append(dict(cell for cell in cells if cell))
+        if i < len(base_texts):
+            row = {base: i}
+            row.update((manuscript, matched[(i, manuscript)]) for manuscript in others if (i, manuscript) in matched)
+            rows.append(row)
+    result = []
+    for row in rows:
+        first = next(manuscript for manuscript in manuscripts if manuscript in row)
+        first_text = block[first][row[first]][1]
+        result.append({
+            'lines': {manuscript: block[manuscript][index][0] for manuscript, index in row.items()},
+            'variants': {
+                manuscript: variants(first_text, block[manuscript][index][1])
+                for manuscript, index in row.items() if manuscript != first
+            },
+        })
+    return result
+
+
+def collate(book_id, processes=1):
+    ''' Align the blocks of a book that changed since they were last
+    aligned, in a pool of processes if more than one. Returns the keys
+    of the blocks that were aligned and stored.
+    '''
+    found, order = blocks(book_id)
+    stored = dict(Alignment.objects.filter(book=book_id).values_list('key', 'digest'))
+    digests = {key: digest(block) for key, block in found.items()}
+    stale = [key for key in order if stored.get(key) != digests[key]]
+    if processes > 1 and len(stale) > 1:
+        # the workers do not use the database
+        connections.close_all()
+        with Pool(processes) as pool:
+            aligned = pool.map(align_block, [found[key] for key in stale])
+    else:
+        aligned = [align_block(found[key]) for key in stale]
+    with transaction.atomic():
+        # collations of the same book wait for each other
+        Book.objects.select_for_update().filter(pk=book_id).exists()
+        # blocks that changed while they were aligned are left to the
+        # collation that the change queued, which may have stored them
+        found, order = blocks(book_id)
+        current = {key: digest(block) for key, block in found.items()}
+        Alignment.objects.filter(book=book_id).exclude(key__in=order).delete()
+        written = []
+        for key, rows in zip(stale, aligned):
+            if current.get(key) == digests[key]:
+                Alignment.objects.update_or_create(book_id=book_id, key=key, defaults={
+                    'digest': digests[key], 'rows': rows, 'position': order.index(key)})
+                written.append(key)
+        for position, key in enumerate(order):
+            if key not in written:
+                Alignment.objects.filter(book=book_id, key=key).exclude(position=position).update(position=position)
+    return written
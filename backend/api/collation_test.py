@@ -0,0 +1,146 @@
+import pytest
+
+from . import collation, jobs
+from .collation import align_block, align_gap, blocks, collate, digest
+from .models import Alignment, Annotation, AnnotatedLine, Chapter, Job, Manuscript
+
+
+def second_manuscript(manuscript):
+    return Manuscript.objects.create(
+        filepath='manuscript_images/other.jpg', editor=manuscript.editor, book=manuscript.book,
+        title='Istanbul', date='1400')
+
+
+def transcribe(manuscript, texts, page=1, top=100):
+    ''' Add lines with the given texts, in order, below top. '''
+    lines = []
+    before = AnnotatedLine.objects.filter(annotation__manuscript=manuscript).count()
+    for number, text in enumerate(texts):
+        annotation = Annotation.objects.create(
+            manuscript=manuscript, page=page, text=text, sequence=(before + number + 1) * 1024,
+            bounding_box={'x': 0, 'y': top + 20 * number, 'width': 100, 'height': 10})
+        lines.append(AnnotatedLine.objects.create(annotation=annotation))
+    return lines
+
+
+def chapter(manuscript, page=1, top=0, same_as=None):
+    annotation = Annotation.objects.create(
+        manuscript=manuscript, page=page, bounding_box={'x': 0, 'y': top, 'width': 100, 'height': 10})
+    return Chapter.objects.create(annotation=annotation, same_as=same_as)
+
+
+def test_align_block():
+    block = {
+        '1': [(1, 'قال ابن خلدون'), (2, 'في المقدمة الاولى'), (3, 'علم التاريخ')],
+        '2': [(11, 'قال ابن خلدون'), (12, 'في الكتاب الاولى'), (13, 'وهو فن عزيز المذهب'), (14, 'علم التاريخ')],
+    }
+    rows = align_block(block)
+    assert [row['lines'] for row in rows] == [
+        {'2': 11, '1': 1}, {'2': 12, '1': 2}, {'2': 13}, {'2': 14, '1': 3},
+    ]
+    # the base has the most lines
+    assert rows[1]['variants'] == {'1': [['replace', 'الكتاب', 'المقدمة']]}
+    assert rows[0]['variants'] == {'1': []}
+
+
+def test_align_gap():
+    # dissimilar lines are not aligned
+    assert align_gap(['a b c', 'x y z'], ['q r s', 'a b d']) == [(None, 0), (0, 1), (1, None)]
+
+
+def test_collate(manuscript):
+    other = second_manuscript(manuscript)
+    first_chapter = chapter(manuscript, top=200)
+    chapter(other, page=2, top=0, same_as=first_chapter)
+    # a chapter that is in one manuscript only does not split the text
+    chapter(manuscript, top=250)
+    transcribe(manuscript, ['مقدمة', 'اول'], top=100)
+    lines = transcribe(manuscript, ['باب الاول', 'في العمران', 'البشري'], top=220)
+    transcribe(other, ['مقدمة'])
+    transcribe(other, ['باب الاول', 'في العمران البشري'], page=2, top=20)
+
+    found, order = blocks(manuscript.book_id)
+    key = 'chapter-{}'.format(first_chapter.pk)
+    assert order == ['start', key]
+    assert [pk for pk, _ in found[key][str(manuscript.pk)]] == [line.pk for line in lines]
+
+    assert collate(manuscript.book_id) == ['start', key]
+    assert list(Alignment.objects.order_by('position').values_list('key', flat=True)) == order
+    assert collate(manuscript.book_id) == []
+
+    # a change of spelling changes nothing, another edit aligns its chapter only
+    annotation = lines[2].annotation
+    annotation.text = 'البشرى'
+    annotation.save()
+    assert collate(manuscript.book_id) == []
+    annotation.text = 'الانساني'
+    annotation.save()
+    assert collate(manuscript.book_id) == [key]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_collate_in_processes(manuscript):
+    other = second_manuscript(manuscript)
+    first_chapter = chapter(manuscript, top=200)
+    chapter(other, page=2, same_as=first_chapter)
+    first = transcribe(manuscript, ['مقدمة'])
+    transcribe(manuscript, ['باب'], top=220)
+    second = transcribe(other, ['مقدمه'])
+    transcribe(other, ['باب'], page=2, top=20)
+    assert len(collate(manuscript.book_id, processes=2)) == 2
+    assert collate(manuscript.book_id, processes=1) == []
+    [row] = Alignment.objects.get(key='start').rows
+    assert row['lines'] == {str(manuscript.pk): first[0].pk, str(other.pk): second[0].pk}
+
+
+def test_edits_queue_collation(client, manuscript, django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks(execute=True):
+        lines = transcribe(manuscript, ['مقدمة', 'اول'])
+    assert list(Job.objects.values_list('kind', 'manuscript')) == [('collate', manuscript.pk)]
+
+    jobs.work(once=True)
+    response = client.get('/api/books/{}/collation/'.format(manuscript.book_id)).json()
+    assert not response['pending']
+    assert [block['key'] for block in response['blocks']] == ['start']
+    assert response['blocks'][0]['rows'][1]['lines'] == {str(manuscript.pk): lines[1].pk}
+
+    with django_capture_on_commit_callbacks(execute=True):
+        client.patch('/api/annotations/{}/'.format(lines[0].pk), {'text': 'المقدمة'}, content_type='application/json')
+    assert client.get('/api/books/{}/collation/'.format(manuscript.book_id)).json()['pending']
+
+
+def test_interleaved_collations(manuscript, django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks(execute=True):
+        lines = transcribe(manuscript, ['مقدمة', 'اول'])
+    first = jobs.claim()
+    # an edit while the book is collated queues another collation,
+    # which waits for the first one
+    annotation = lines[1].annotation
+    annotation.text = 'ثان'
+    with django_capture_on_commit_callbacks(execute=True):
+        annotation.save()
+    assert Job.objects.filter(kind='collate', status='pending').exists()
+    assert jobs.claim() is None
+    jobs.run(first)
+    second = jobs.claim()
+    assert second.kind == 'collate'
+    jobs.run(second)
+    assert Alignment.objects.get(key='start').digest == digest(blocks(manuscript.book_id)[0]['start'])
+
+
+def test_collation_overtaken(manuscript, monkeypatch):
+    lines = transcribe(manuscript, ['مقدمة', 'اول'])
+    align = collation.align_block
+
+    def edit_while_aligning(block):
+        # a later collation stores the edited block first
+        monkeypatch.setattr(collation, 'align_block', align)
+        Annotation.objects.filter(pk=lines[1].pk).update(text='ثان')
+        assert collate(manuscript.book_id) == ['start']
+        return align(block)
+
+    monkeypatch.setattr(collation, 'align_block', edit_while_aligning)
+    assert collate(manuscript.book_id) == []
+    stored = Alignment.objects.get(key='start')
+    assert stored.digest == digest(blocks(manuscript.book_id)[0]['start'])
+    assert collate(manuscript.book_id) == []
@@ -0,0 +1,86 @@
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image
+import pytest
+
+from .models import Annotation, AnnotatedLine, Aside, Author, Book, Chapter, Editor, Manuscript
+
+
+@pytest.fixture(scope='session')
+def django_db_modify_db_settings(django_db_modify_db_settings_parallel_suffix, tmp_path_factory):
+    ''' Test SQLite on a file rather than in memory, where concurrent
+    writers wait for each other, as they do in production.
+    '''
+    database = settings.DATABASES['default']
+    if database['ENGINE'] == 'django.db.backends.sqlite3':
+        database.setdefault('TEST', {})['NAME'] = str(tmp_path_factory.mktemp('db') / 'test.sqlite3')
+
+
+@pytest.fixture
+def book(db):
+    author = Author.objects.create(name='Ibn Khaldun')
+    return Book.objects.create(title='Muqaddimah', author=author)
+
+
+@pytest.fixture
+def manuscript(book):
+    editor = Editor.objects.create(name='Quatremère')
+    return Manuscript.objects.create(
+        filepath='manuscript_images/test.jpg',
+        editor=editor,
+        book=book,
+        title='Paris',
+        date='1858',
+    )
+
+
+@pytest.fixture
+def media(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path / 'media')
+    settings.PAGE_CACHE_DIR = str(tmp_path / 'pages')
+    settings.UPLOAD_DIR = str(tmp_path / 'uploads')
+    return tmp_path
+
+
+def scan_file(width=600, height=400, format='JPEG', pages=1):
+    images = [
+        Image.new('RGB', (width + 10 * page, height), (240, 230, 200))
+        for page in range(pages)
+    ]
+    output = BytesIO()
+    images[0].save(output, format, save_all=pages > 1, append_images=images[1:])
+    return ContentFile(output.getvalue())
+
+
+@pytest.fixture
+def scanned(manuscript, media):
+    ''' A manuscript with a scan of a single page. '''
+    manuscript.filepath.save('scan.jpg', scan_file())
+    return manuscript
+
+
+def add_annotations(manuscript, page=1, lines=3):
+    ''' Add a chapter, an aside and a number of lines
+    to the given page of a manuscript. Returns the lines.
+    '''
+    box = {'x': 0, 'y': 0, 'width': 10, 'height': 10}
+    Chapter.objects.create(annotation=Annotation.objects.create(
+        manuscript=manuscript, page=page, bounding_box=box))
+    Aside.objects.create(annotation=Annotation.objects.create(
+        manuscript=manuscript, page=page, bounding_box=box))
+    return [
+        AnnotatedLine.objects.create(annotation=Annotation.objects.create(
+            manuscript=manuscript, page=page, bounding_box=box))
+        for _ in range(lines)
+    ]
+
+
+def bulk_lines(client, manuscript, count, **extra):
+    return client.post('/api/annotated_lines/bulk/', dict(
+        manuscript=manuscript.pk,
+        page=4,
+        lines=[{'bounding_box': {'x': 0, 'y': 10 * i, 'width': 50, 'height': 10}} for i in range(count)],
+        **extra
+    ), content_type='application/json')
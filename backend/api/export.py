@@ -0,0 +1,233 @@
+''' Bulk exports of annotations.
+Rows are read from the database in chunks and written out as they
+are produced, so memory use does not grow with the size of the export.
+'''
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+import binascii
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from rest_framework.exceptions import ValidationError
+
+from .geometry import extent
+
+CHUNK_SIZE = 2000
+# number of rows per record batch (and row group) in columnar exports
+BATCH_SIZE = 10000
+
+# column name in the export, lookup on Annotation
+CSV_COLUMNS = [
+    ('id', 'id'),
+    ('manuscript', 'manuscript__title'),
+    ('page', 'page'),
+    ('text', 'text'),
+    ('label', 'label'),
+    ('research_note', 'research_note'),
+]
+
+
+# key in the export, lookup on Annotation
+RECORD_FIELDS = [
+    ('id', 'id'),
+    ('manuscript', 'manuscript'),
+    ('manuscript_title', 'manuscript__title'),
+    ('page', 'page'),
+    ('annotation_type', 'annotation_type'),
+    ('text', 'text'),
+    ('label', 'label'),
+    ('research_note', 'research_note'),
+    ('complete', 'complete'),
+    ('created', 'created'),
+    ('modified', 'modified'),
+    ('bounding_box', 'bounding_box'),
+    ('previous_line', 'annotated_line__previous_line'),
+    ('next_line', 'annotated_line__next_line'),
+    ('hypo_text', 'annotated_line__hypo_text'),
+]
+
+ARROW_SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('manuscript', pa.int64()),
+    ('manuscript_title', pa.string()),
+    ('page', pa.int32()),
+    ('annotation_type', pa.string()),
+    ('text', pa.string()),
+    ('label', pa.string()),
+    ('research_note', pa.string()),
+    ('complete', pa.bool_()),
+    ('created', pa.timestamp('us', tz='UTC')),
+    ('modified', pa.timestamp('us', tz='UTC')),
+    ('min_x', pa.float64()),
+    ('min_y', pa.float64()),
+    ('max_x', pa.float64()),
+    ('max_y', pa.float64()),
+    ('previous_line', pa.int64()),
+    ('next_line', pa.int64()),
+    # GeoJSON and hypotext are nested structures, kept as JSON
+    ('bounding_box', pa.string()),
+    ('hypo_text', pa.string()),
+])
+
+
+class Echo:
+    ''' File-like object which returns what is written to it,
+    so that csv.writer can be used to produce rows one by one.
+    '''
+    def write(self, value):
+        return value
+
+
+class ChunkSink:
+    ''' Writable file-like object collecting what is written to it
+    until drained, for writers which need a file rather than a generator.
+    '''
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def encode_cursor(modified, pk):
+    value = '{}|{}'.format(modified.isoformat(), pk)
+    return urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(token):
+    try:
+        modified, pk = urlsafe_b64decode(token.encode()).decode().split('|')
+        modified = parse_datetime(modified)
+        pk = int(pk)
+    except (binascii.Error, UnicodeError, ValueError):
+        modified = None
+    if modified is None:
+        raise ValidationError({'cursor': 'Invalid continuation token.'})
+    return modified, pk
+
+
+def paginate(annotations, cursor=None, limit=None):
+    ''' Order annotations by modification time and restrict them
+    to those after the cursor, up to limit rows.
+    Returns the annotations and the continuation token for the
+    next batch, which is None if there is nothing left.
+    '''
+    annotations = annotations.order_by('modified', 'id')
+    if cursor:
+        modified, pk = decode_cursor(cursor)
+        annotations = annotations.filter(
+            Q(modified__gt=modified) | Q(modified=modified, id__gt=pk))
+    if limit is None:
+        return annotations, None
+    if limit < 1:
+        raise ValidationError({'limit': 'Expected a positive integer.'})
+    keys = list(annotations.values_list('modified', 'id')[limit - 1:limit + 1])
+    if len(keys) < 2:
+        return annotations, None
+    modified, pk = keys[0]
+    annotations = annotations.filter(
+        Q(modified__lt=modified) | Q(modified=modified, id__lte=pk))
+    return annotations, encode_cursor(modified, pk)
+
+
+def csv_rows(annotations):
+    ''' Generate the lines of a CSV export of the given annotations. '''
+    writer = csv.writer(Echo())
+    yield writer.writerow([column for column, _ in CSV_COLUMNS])
+    rows = annotations.values_list(*[lookup for _, lookup in CSV_COLUMNS])
+    for row in rows.iterator(chunk_size=CHUNK_SIZE):
+        yield writer.writerow(row)
+
+
+def records(annotations):
+    ''' Generate the annotations as dictionaries, including
+    the line chain and hypotext of annotated lines, and the
+    extent of the bounding box as min_x, min_y, max_x and max_y.
+    '''
+    rows = annotations.values_list(*[lookup for _, lookup in RECORD_FIELDS])
+    for row in rows.iterator(chunk_size=CHUNK_SIZE):
+        record = dict(zip([key for key, _ in RECORD_FIELDS], row))
+        record['min_x'], record['min_y'], record['max_x'], record['max_y'] = \
+            extent(record['bounding_box'])
+        yield record
+
+
+def jsonl_rows(annotations):
+    ''' Generate a JSON Lines export of the given annotations. '''
+    for record in records(annotations):
+        yield json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def record_batches(annotations):
+    ''' Generate the annotations as Arrow record batches. '''
+    columns = {name: [] for name in ARROW_SCHEMA.names}
+    count = 0
+    for record in records(annotations):
+        record['bounding_box'] = json.dumps(record['bounding_box'], ensure_ascii=False)
+        if record['hypo_text'] is not None:
+            record['hypo_text'] = json.dumps(record['hypo_text'], ensure_ascii=False)
+        for name, values in columns.items():
+            values.append(record[name])
+        count += 1
+        if count == BATCH_SIZE:
+            yield pa.RecordBatch.from_pydict(columns, schema=ARROW_SCHEMA)
+            columns = {name: [] for name in ARROW_SCHEMA.names}
+            count = 0
+    if count:
+        yield pa.RecordBatch.from_pydict(columns, schema=ARROW_SCHEMA)
+
+
+def columnar_rows(annotations, open_writer):
+    sink = ChunkSink()
+    writer = open_writer(sink)
+    for batch in record_batches(annotations):
+        writer.write_batch(batch)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def arrow_rows(annotations):
+    ''' Generate an Arrow IPC stream of the given annotations. '''
+    return columnar_rows(annotations, lambda sink: pa.ipc.new_stream(sink, ARROW_SCHEMA))
+
+
+def parquet_rows(annotations):
+    ''' Generate a Parquet file of the given annotations,
+    with one row group per record batch.
+    '''
+    return columnar_rows(annotations, lambda sink: pq.ParquetWriter(sink, ARROW_SCHEMA))
+
+
+# format: generator of the export, file name
+FORMATS = {
+    'csv': (csv_rows, 'annotations.csv'),
+    'jsonl': (jsonl_rows, 'annotations.jsonl'),
+    'arrow': (arrow_rows, 'annotations.arrow'),
+    'parquet': (parquet_rows, 'annotations.parquet'),
+}
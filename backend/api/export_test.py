@@ -0,0 +1,105 @@
+import csv
+import json
+from io import StringIO
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from . import export
+from .conftest import add_annotations
+from .models import Annotation
+
+
+def read_csv(response):
+    content = b''.join(response.streaming_content).decode()
+    return list(csv.reader(StringIO(content)))
+
+
+def test_download_empty(client, db):
+    response = client.get('/api/annotations/download/')
+    assert response.status_code == 200
+    assert read_csv(response) == [['id', 'manuscript', 'page', 'text', 'label', 'research_note']]
+
+
+def test_download_complete_only(client, manuscript):
+    lines = add_annotations(manuscript, lines=3)
+    Annotation.objects.filter(pk=lines[1].pk).update(complete=True, text='سطر, "ثاني"')
+    rows = read_csv(client.get('/api/annotations/download/'))
+    assert rows[1:] == [[str(lines[1].pk), 'Paris', '1', 'سطر, "ثاني"', '', '']]
+
+
+def test_download_filters(client, manuscript):
+    add_annotations(manuscript, page=1, lines=2)
+    add_annotations(manuscript, page=2, lines=2)
+    add_annotations(manuscript, page=3, lines=2)
+    Annotation.objects.update(complete=True)
+    Annotation.objects.filter(page=2, annotation_type='chapter').update(label='heading')
+
+    rows = read_csv(client.get('/api/annotations/download/', {'page_from': 2, 'page_to': 3}))
+    assert {row[2] for row in rows[1:]} == {'2', '3'}
+    rows = read_csv(client.get('/api/annotations/download/', {'label': 'heading'}))
+    assert len(rows) == 2
+    rows = read_csv(client.get('/api/annotations/download/', {'book': manuscript.book.pk + 1}))
+    assert len(rows) == 1
+    assert client.get('/api/annotations/download/', {'page': 'one'}).status_code == 400
+
+
+def test_download_resumes_from_cursor(client, manuscript):
+    add_annotations(manuscript, lines=3)
+    Annotation.objects.update(complete=True)
+    ids = [str(pk) for pk in Annotation.objects.order_by('modified', 'id').values_list('id', flat=True)]
+
+    exported = []
+    params = {'limit': 2}
+    while True:
+        response = client.get('/api/annotations/download/', params)
+        exported.extend(row[0] for row in read_csv(response)[1:])
+        if 'X-Continuation-Token' not in response:
+            break
+        params['cursor'] = response['X-Continuation-Token']
+    assert exported == ids
+
+    since = Annotation.objects.order_by('modified').last().modified
+    line = Annotation.objects.get(pk=ids[0])
+    line.text = 'edited'
+    line.save()
+    rows = read_csv(client.get('/api/annotations/download/', {'since': since.isoformat()}))
+    assert [row[0] for row in rows[1:]] == [ids[0]]
+
+
+def test_download_jsonl(client, manuscript):
+    lines = add_annotations(manuscript, lines=2)
+    lines[0].next_line = lines[1]
+    lines[0].hypo_text = [{'text': 'قال'}]
+    lines[0].save()
+    Annotation.objects.update(complete=True, bounding_box={'x': 5, 'y': 20, 'width': 100, 'height': -15})
+
+    response = client.get('/api/annotations/download/', {'format': 'jsonl'})
+    assert response['Content-Type'] == 'application/x-ndjson'
+    content = b''.join(response.streaming_content).decode()
+    records = {r['id']: r for r in map(json.loads, content.splitlines())}
+    line = records[lines[0].pk]
+    assert line['next_line'] == lines[1].pk
+    assert line['hypo_text'] == [{'text': 'قال'}]
+    assert (line['min_x'], line['min_y'], line['max_x'], line['max_y']) == (5, 5, 105, 20)
+    assert records[lines[1].pk]['previous_line'] is None
+
+
+@pytest.mark.parametrize('format', ['arrow', 'parquet'])
+def test_download_columnar(client, manuscript, format, monkeypatch):
+    monkeypatch.setattr(export, 'BATCH_SIZE', 2)
+    add_annotations(manuscript, lines=3)
+    Annotation.objects.update(complete=True)
+
+    response = client.get('/api/annotations/download/', {'format': format})
+    content = pa.py_buffer(b''.join(response.streaming_content))
+    if format == 'arrow':
+        table = pa.ipc.open_stream(content).read_all()
+    else:
+        table = pq.read_table(pa.BufferReader(content))
+        assert pq.ParquetFile(pa.BufferReader(content)).num_row_groups == 3
+    assert table.num_rows == 5
+    assert table.column('max_x').to_pylist() == [10.0] * 5
+    assert sorted(table.column('annotation_type').to_pylist()) == \
+        ['annotated_line'] * 3 + ['aside', 'chapter']
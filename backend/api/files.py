@@ -0,0 +1,113 @@
+''' Responses that send scans and images derived from them.
+Files are sent with validators (a strong ETag and Last-Modified),
+so that browsers can revalidate them with a 304, and with support for
+a single byte range. Files whose path is derived from the hash of the
+scan never change, and may be cached for long.
+Optionally, the file is not sent by Django, but handed off to nginx
+with X-Accel-Redirect; see X_ACCEL_LOCATIONS in the settings.
+'''
+from hashlib import sha1
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+BLOCK_SIZE = 64 * 1024
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def byte_range(header, size):
+    ''' The first and last byte of the range in a Range header.
+    Returns None if there is no range, or several ranges, which are
+    answered with the whole file. Raises ValueError if the range
+    lies outside of the file.
+    '''
+    match = RANGE.match(header.strip()) if header else None
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        # the last bytes of the file
+        length = int(last)
+        if not length or not size:
+            raise ValueError('Empty range')
+        return max(size - length, 0), size - 1
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size or last < first:
+        raise ValueError('Range outside of the file')
+    return first, last
+
+
+def read_range(path, first, last):
+    with open(path, 'rb') as source:
+        source.seek(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            data = source.read(min(BLOCK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def accel_location(path):
+    ''' The internal location of nginx from which to send a file,
+    if X-Accel-Redirect is enabled for its directory.
+    '''
+    for directory, location in settings.X_ACCEL_LOCATIONS.items():
+        relative = os.path.relpath(path, directory)
+        if not relative.startswith(os.pardir):
+            return location.rstrip('/') + '/' + quote(relative.replace(os.sep, '/'))
+
+
+def serve(request, path, content_type, etag=None, immutable=False):
+    ''' Respond with the file at path, which is found by its etag if given,
+    or else by its size and modification time. Immutable files
+    may be cached for FILE_CACHE_MAX_AGE; others are revalidated.
+    '''
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise Http404
+    if etag is None:
+        etag = sha1('{}/{}/{}'.format(path, stat.st_size, stat.st_mtime_ns).encode()).hexdigest()
+    etag = quote_etag(etag)
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        response = send(request, path, content_type, stat.st_size, etag)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Accept-Ranges'] = 'bytes'
+    if immutable:
+        patch_cache_control(response, public=True, max_age=settings.FILE_CACHE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, no_cache=True)
+    return response
+
+
+def send(request, path, content_type, size, etag):
+    location = accel_location(path)
+    if location:
+        # nginx answers ranges itself
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = location
+        return response
+    if_range = request.META.get('HTTP_IF_RANGE')
+    try:
+        requested = byte_range(request.META.get('HTTP_RANGE'), size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */{}'.format(size)
+        return response
+    if requested is None or (if_range and if_range != etag):
+        return FileResponse(open(path, 'rb'), content_type=content_type)
+    first, last = requested
+    response = StreamingHttpResponse(read_range(path, first, last), status=206, content_type=content_type)
+    response['Content-Range'] = 'bytes {}-{}/{}'.format(first, last, size)
+    response['Content-Length'] = last - first + 1
+    return response
@@ -0,0 +1,78 @@
+import pytest
+
+from . import images
+from .files import byte_range
+
+
+@pytest.mark.parametrize('header, expected', [
+    (None, None),
+    ('bytes=0-99', (0, 99)),
+    ('bytes=100-', (100, 999)),
+    ('bytes=900-2000', (900, 999)),
+    ('bytes=-100', (900, 999)),
+    ('bytes=0-1,5-6', None),
+    ('items=0-1', None),
+])
+def test_byte_range(header, expected):
+    assert byte_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize('header', ['bytes=1000-', 'bytes=-0', 'bytes=5-4'])
+def test_byte_range_unsatisfiable(header):
+    with pytest.raises(ValueError):
+        byte_range(header, 1000)
+
+
+def scan_url(manuscript):
+    return '/api/manuscripts/{}/scan/1/'.format(manuscript.pk)
+
+
+def test_scan_validators(client, scanned):
+    response = client.get(scan_url(scanned))
+    assert response.status_code == 200
+    assert response['Accept-Ranges'] == 'bytes'
+    assert response['Cache-Control'] == 'no-cache'
+    etag = response['ETag']
+
+    response = client.get(scan_url(scanned), HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    assert response['ETag'] == etag
+
+    scanned.sha256 = 'a' * 64
+    scanned.save()
+    response = client.get(scan_url(scanned))
+    assert response['ETag'] == '"{}"'.format('a' * 64)
+    assert 'immutable' in response['Cache-Control']
+    assert client.get(scan_url(scanned), HTTP_IF_NONE_MATCH=response['ETag']).status_code == 304
+
+
+def test_scan_range(client, scanned):
+    content = scanned.filepath.read()
+    size = len(content)
+    response = client.get(scan_url(scanned), HTTP_RANGE='bytes=10-19')
+    assert response.status_code == 206
+    assert response['Content-Range'] == 'bytes 10-19/{}'.format(size)
+    assert b''.join(response.streaming_content) == content[10:20]
+
+    etag = response['ETag']
+    response = client.get(scan_url(scanned), HTTP_RANGE='bytes=-5', HTTP_IF_RANGE=etag)
+    assert b''.join(response.streaming_content) == content[-5:]
+    response = client.get(scan_url(scanned), HTTP_RANGE='bytes=-5', HTTP_IF_RANGE='"other"')
+    assert response.status_code == 200
+
+    response = client.get(scan_url(scanned), HTTP_RANGE='bytes={}-'.format(size))
+    assert response.status_code == 416
+    assert response['Content-Range'] == 'bytes */{}'.format(size)
+
+
+def test_accel_redirect(client, scanned, settings, media):
+    settings.X_ACCEL_LOCATIONS = {str(media / 'media' / 'manuscript_derived'): '/internal/derived/'}
+    images.build_pyramid(scanned, 1)
+    response = client.get('/api/manuscripts/{}/tiles/1/0/0_0/'.format(scanned.pk))
+    assert response['X-Accel-Redirect'] == '/internal/derived/' + images.tile_path(scanned, 1, 0, 0, 0)[
+        len('manuscript_derived/'):]
+    assert response.content == b''
+    assert response['ETag']
+
+    # files elsewhere are sent by Django
+    assert 'X-Accel-Redirect' not in client.get(scan_url(scanned))
@@ -0,0 +1,132 @@
+''' Filtering of annotations and text fields by query parameters. '''
+import math
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from rest_framework.exceptions import ValidationError
+
+from .arabic import normalize
+
+
+def integer_param(params, name):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValidationError({name: 'Expected an integer.'})
+
+
+def boolean_param(params, name):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValidationError({name: 'Expected true or false.'})
+
+
+def datetime_param(params, name):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        raise ValidationError({name: 'Expected an ISO 8601 timestamp.'})
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def bbox_param(params, name):
+    ''' A region given as min_x,min_y,max_x,max_y. '''
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        bbox = [float(part) for part in value.split(',')]
+    except ValueError:
+        bbox = []
+    if len(bbox) != 4 or not all(map(math.isfinite, bbox)) or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+        raise ValidationError({name: 'Expected min_x,min_y,max_x,max_y.'})
+    return bbox
+
+
+def filter_region(queryset, params):
+    ''' Restrict a queryset of annotations or text fields to a page
+    of a manuscript (both required), and to those of which the
+    bounding box intersects a region, given as
+    bbox=min_x,min_y,max_x,max_y. A region of a single point
+    finds what lies under it.
+    '''
+    manuscript = integer_param(params, 'manuscript')
+    page = integer_param(params, 'page')
+    if manuscript is None or page is None:
+        raise ValidationError({'manuscript': 'A manuscript and a page are required.'})
+    queryset = queryset.filter(manuscript=manuscript, page=page)
+    bbox = bbox_param(params, 'bbox')
+    if bbox is not None:
+        min_x, min_y, max_x, max_y = bbox
+        queryset = queryset.filter(
+            min_x__lte=max_x, max_x__gte=min_x,
+            min_y__lte=max_y, max_y__gte=min_y,
+        )
+    return queryset
+
+
+def filter_pages(queryset, params, prefix=''):
+    ''' Restrict a queryset of annotations or text fields according to
+    - book: id of the book
+    - manuscript: id of the manuscript
+    - page, or a page range from page_from to page_to (inclusive)
+    The prefix leads from the model of the queryset to these fields.
+    '''
+    book = integer_param(params, 'book')
+    if book is not None:
+        queryset = queryset.filter(**{prefix + 'manuscript__book': book})
+    manuscript = integer_param(params, 'manuscript')
+    if manuscript is not None:
+        queryset = queryset.filter(**{prefix + 'manuscript': manuscript})
+    page = integer_param(params, 'page')
+    if page is not None:
+        queryset = queryset.filter(**{prefix + 'page': page})
+    page_from = integer_param(params, 'page_from')
+    if page_from is not None:
+        queryset = queryset.filter(**{prefix + 'page__gte': page_from})
+    page_to = integer_param(params, 'page_to')
+    if page_to is not None:
+        queryset = queryset.filter(**{prefix + 'page__lte': page_to})
+    return queryset
+
+
+def filter_annotations(queryset, params, prefix=''):
+    ''' Restrict a queryset of annotations (or of models extending them,
+    with the prefix 'annotation__') according to the filters of
+    filter_pages, and
+    - complete: true or false
+    - annotation_type
+    - label
+    - text: the start of the text, compared in normalized form
+    - since: only annotations modified after this timestamp
+    '''
+    queryset = filter_pages(queryset, params, prefix)
+    complete = boolean_param(params, 'complete')
+    if complete is not None:
+        queryset = queryset.filter(**{prefix + 'complete': complete})
+    annotation_type = params.get('annotation_type')
+    if annotation_type:
+        queryset = queryset.filter(**{prefix + 'annotation_type': annotation_type})
+    label = params.get('label')
+    if label:
+        queryset = queryset.filter(**{prefix + 'label': label})
+    text = normalize(params.get('text', ''))
+    if text:
+        queryset = queryset.filter(**{prefix + 'normalized_text__startswith': text})
+    since = datetime_param(params, 'since')
+    if since is not None:
+        queryset = queryset.filter(**{prefix + 'modified__gt': since})
+    return queryset
@@ -0,0 +1,44 @@
+''' Helpers for the bounding boxes of annotations and text fields.
+A bounding box is saved as JSON, which may be
+- a rectangle, with x, y, width and height
+- a polygon, with a list of marks (points with x and y)
+- GeoJSON geometry (or a feature), with nested coordinates
+'''
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def points(box):
+    ''' Generate the (x, y) points which span a bounding box. '''
+    if isinstance(box, dict):
+        if 'geometry' in box:
+            yield from points(box['geometry'])
+        elif 'coordinates' in box:
+            yield from points(box['coordinates'])
+        elif 'marks' in box:
+            yield from points(box['marks'])
+        elif is_number(box.get('x')) and is_number(box.get('y')):
+            x, y = box['x'], box['y']
+            yield x, y
+            if is_number(box.get('width')) and is_number(box.get('height')):
+                yield x + box['width'], y + box['height']
+    elif isinstance(box, (list, tuple)):
+        if len(box) >= 2 and is_number(box[0]) and is_number(box[1]):
+            yield box[0], box[1]
+        else:
+            for item in box:
+                yield from points(item)
+
+
+def extent(box):
+    ''' The extent of a bounding box as (min_x, min_y, max_x, max_y),
+    or four Nones if the box does not describe any point.
+    '''
+    xs, ys = [], []
+    for x, y in points(box):
+        xs.append(x)
+        ys.append(y)
+    if not xs:
+        return None, None, None, None
+    return min(xs), min(ys), max(xs), max(ys)
@@ -0,0 +1,189 @@
+''' An IIIF Image API (version 3) service over manuscript scans.
+Images are identified by manuscript and page, so that
+/api/iiif/<manuscript>/<page>/<region>/<size>/<rotation>/<quality>.<format>
+returns (part of) the scan of a page, for example the strip of a line.
+Generated images are kept in a bounded cache on disk.
+'''
+from hashlib import sha1
+from io import BytesIO
+
+from django.conf import settings
+from django.http import Http404, HttpResponseBadRequest, HttpResponseRedirect, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.views.decorators.http import require_GET
+
+from PIL import Image
+
+from . import files, images
+from .cache import DiskCache
+from .models import Manuscript
+from .scans import content_key
+
+CONTEXT = 'http://iiif.io/api/image/3/context.json'
+
+# largest number of pixels of a generated image
+MAX_AREA = 50 * 1000 * 1000
+
+# extension: Pillow format, content type
+FORMATS = {
+    'jpg': ('JPEG', 'image/jpeg'),
+    'png': ('PNG', 'image/png'),
+    'webp': ('WEBP', 'image/webp'),
+    'gif': ('GIF', 'image/gif'),
+    'tif': ('TIFF', 'image/tiff'),
+}
+
+# quality: Pillow mode
+QUALITIES = {
+    'default': 'RGB',
+    'color': 'RGB',
+    'gray': 'L',
+    'bitonal': '1',
+}
+
+
+def cache():
+    return DiskCache(settings.IIIF_CACHE_DIR, settings.IIIF_CACHE_MAX_BYTES)
+
+
+def parse_region(region, width, height):
+    ''' The region of an image as x, y, width and height in pixels.
+    Raises ValueError if the region is invalid or outside the image.
+    '''
+    if region == 'full':
+        return 0, 0, width, height
+    if region == 'square':
+        side = min(width, height)
+        return (width - side) // 2, (height - side) // 2, side, side
+    if region.startswith('pct:'):
+        x, y, w, h = [float(value) for value in region[4:].split(',')]
+        x, y, w, h = round(x * width / 100), round(y * height / 100), \
+            round(w * width / 100), round(h * height / 100)
+    else:
+        x, y, w, h = [int(value) for value in region.split(',')]
+    if x < 0 or y < 0 or w <= 0 or h <= 0 or x >= width or y >= height:
+        raise ValueError('Invalid region')
+    return x, y, min(w, width - x), min(h, height - y)
+
+
+def parse_size(size, width, height):
+    ''' The size to scale a region of width by height to.
+    Scaling up is only allowed when the size starts with ^.
+    Raises ValueError if the size is invalid.
+    '''
+    upscale = size.startswith('^')
+    if upscale:
+        size = size[1:]
+    if size in ('max', 'full'):
+        w, h = width, height
+    elif size.startswith('pct:'):
+        scale = float(size[4:]) / 100
+        w, h = round(width * scale), round(height * scale)
+    elif size.startswith('!'):
+        w, h = [int(value) for value in size[1:].split(',')]
+        scale = min(w / width, h / height)
+        w, h = round(width * scale), round(height * scale)
+    else:
+        w, h = size.split(',')
+        if w and h:
+            w, h = int(w), int(h)
+        elif w:
+            w = int(w)
+            h = round(height * w / width)
+        else:
+            h = int(h)
+            w = round(width * h / height)
+    if w < 1 or h < 1 or w * h > MAX_AREA:
+        raise ValueError('Invalid size')
+    if not upscale and (w > width or h > height):
+        raise ValueError('Scaling up requires ^')
+    return w, h
+
+
+def parse_rotation(rotation):
+    ''' Whether to mirror, and the clockwise rotation in degrees. '''
+    mirror = rotation.startswith('!')
+    degrees = float(rotation[1:] if mirror else rotation)
+    if not 0 <= degrees <= 360:
+        raise ValueError('Invalid rotation')
+    return mirror, degrees
+
+
+def render(image, region, size, rotation, quality, format):
+    ''' Apply an IIIF image request to an image. Returns the encoded result. '''
+    x, y, w, h = parse_region(region, *image.size)
+    width, height = parse_size(size, w, h)
+    mirror, degrees = parse_rotation(rotation)
+    if quality not in QUALITIES or format not in FORMATS:
+        raise ValueError('Unsupported quality or format')
+
+    result = image.crop((x, y, x + w, y + h))
+    if (width, height) != (w, h):
+        result = result.resize((width, height), Image.LANCZOS)
+    if mirror:
+        result = result.transpose(Image.FLIP_LEFT_RIGHT)
+    if degrees % 360:
+        result = result.convert('RGB').rotate(-degrees, expand=True, fillcolor=(255, 255, 255))
+    result = result.convert(QUALITIES[quality])
+    output = BytesIO()
+    result.save(output, FORMATS[format][0])
+    return output.getvalue()
+
+
+def with_cors(response):
+    response['Access-Control-Allow-Origin'] = '*'
+    return response
+
+
+@require_GET
+def base(request, manuscript, page):
+    return HttpResponseRedirect(reverse('iiif-info', args=[manuscript, page]), status=303)
+
+
+@require_GET
+def info(request, manuscript, page):
+    ''' The IIIF information document of the image of a page. '''
+    manuscript = get_object_or_404(Manuscript, pk=manuscript)
+    try:
+        width, height = images.page_size(manuscript, page)
+    except (LookupError, OSError):
+        raise Http404
+    identifier = request.build_absolute_uri(reverse('iiif-base', args=[manuscript.pk, page]))
+    return with_cors(JsonResponse({
+        '@context': CONTEXT,
+        'id': identifier,
+        'type': 'ImageService3',
+        'protocol': 'http://iiif.io/api/image',
+        'profile': 'level2',
+        'width': width,
+        'height': height,
+        'extraQualities': ['color', 'gray', 'bitonal'],
+        'extraFormats': ['png', 'webp', 'gif', 'tif'],
+        'extraFeatures': ['mirroring', 'rotationArbitrary', 'sizeUpscaling'],
+    }, content_type='application/ld+json;profile="{}"'.format(CONTEXT)))
+
+
+@require_GET
+def image(request, manuscript, page, region, size, rotation, quality, format):
+    ''' An image derived from a page according to the IIIF Image API. '''
+    manuscript = get_object_or_404(Manuscript, pk=manuscript)
+    page = int(page)
+    if format not in FORMATS:
+        return HttpResponseBadRequest('Unsupported format')
+    request_key = '/'.join([content_key(manuscript), str(page), region, size, rotation, quality])
+    digest = sha1(request_key.encode()).hexdigest()
+    key = '{}.{}'.format(digest, format)
+    path = cache().get(key)
+    if path is None:
+        try:
+            source = images.page_image(manuscript, page)
+        except (LookupError, OSError):
+            raise Http404
+        try:
+            data = render(source, region, size, rotation, quality, format)
+        except ValueError as error:
+            return HttpResponseBadRequest(str(error))
+        path = cache().put(key, data)
+    return with_cors(files.serve(request, path, FORMATS[format][1],
+        etag='{}-{}'.format(digest, format), immutable=bool(manuscript.sha256)))
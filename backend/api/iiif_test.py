@@ -0,0 +1,81 @@
+from io import BytesIO
+import os
+
+from PIL import Image
+import pytest
+
+from . import iiif
+from .cache import DiskCache
+
+
+@pytest.fixture
+def iiif_cache(settings, tmp_path):
+    settings.IIIF_CACHE_DIR = str(tmp_path / 'iiif')
+    settings.IIIF_CACHE_MAX_BYTES = 10 ** 6
+    return settings.IIIF_CACHE_DIR
+
+
+def test_parse_region():
+    assert iiif.parse_region('full', 600, 400) == (0, 0, 600, 400)
+    assert iiif.parse_region('square', 600, 400) == (100, 0, 400, 400)
+    assert iiif.parse_region('10,20,700,30', 600, 400) == (10, 20, 590, 30)
+    assert iiif.parse_region('pct:50,50,10,10', 600, 400) == (300, 200, 60, 40)
+    for region in ['600,0,10,10', '0,0,0,10', 'left', '1,2,3']:
+        with pytest.raises(ValueError):
+            iiif.parse_region(region, 600, 400)
+
+
+def test_parse_size():
+    assert iiif.parse_size('max', 600, 400) == (600, 400)
+    assert iiif.parse_size('300,', 600, 400) == (300, 200)
+    assert iiif.parse_size(',100', 600, 400) == (150, 100)
+    assert iiif.parse_size('!100,100', 600, 400) == (100, 67)
+    assert iiif.parse_size('pct:25', 600, 400) == (150, 100)
+    assert iiif.parse_size('^1200,', 600, 400) == (1200, 800)
+    for size in ['1200,', '0,', 'big']:
+        with pytest.raises(ValueError):
+            iiif.parse_size(size, 600, 400)
+
+
+def test_line_crop(client, scanned, iiif_cache):
+    url = '/api/iiif/{}/1/10,150,500,100/250,/!90/gray.png'.format(scanned.pk)
+    response = client.get(url)
+    assert response['Content-Type'] == 'image/png'
+    image = Image.open(BytesIO(b''.join(response.streaming_content)))
+    assert (image.size, image.mode) == ((50, 250), 'L')
+    assert len(os.listdir(iiif_cache)) == 1
+
+    # served from the cache, even if the scan can no longer be decoded
+    scanned.filepath.storage.delete(scanned.filepath.name)
+    assert client.get(url).status_code == 200
+    assert client.get(url.replace('gray', 'color')).status_code == 404
+
+
+def test_info_and_errors(client, scanned, iiif_cache):
+    info = client.get('/api/iiif/{}/1/info.json'.format(scanned.pk)).json()
+    assert (info['width'], info['height']) == (600, 400)
+    assert info['id'].endswith('/api/iiif/{}/1'.format(scanned.pk))
+    base = '/api/iiif/{}/'.format(scanned.pk)
+    assert client.get(base + '1/full/max/0/default.bmp').status_code == 400
+    assert client.get(base + '1/full/1200,/0/default.jpg').status_code == 400
+    assert client.get(base + '2/full/max/0/default.jpg').status_code == 404
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(str(tmp_path), 250)
+    first = cache.put('aa1', b'x' * 100)
+    cache.put('aa2', b'x' * 100)
+    os.utime(first, (0, 0))
+    cache.put('bb3', b'x' * 100)
+    assert cache.get('aa1') is None
+    assert cache.get('aa2') and cache.get('bb3')
+
+
+def test_cache_counts_entries_once(tmp_path, monkeypatch):
+    cache = DiskCache(str(tmp_path), 1000)
+    cache.put('aa1', b'x' * 100)
+    listed = []
+    monkeypatch.setattr(DiskCache, 'entries', lambda self: listed.append(1) or iter(()))
+    for key in ['aa2', 'bb3', 'aa1']:
+        cache.put(key, b'x' * 100)
+    assert not listed
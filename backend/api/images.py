@@ -0,0 +1,279 @@
+''' Images derived from manuscript scans.
+A scan is either a single image, or a multi-page PDF or TIFF document
+of which pages are rendered one at a time, when they are requested,
+into a bounded cache on disk.
+Other derived images are kept in the default storage, next to the
+scans, under a directory per scan, which manuscripts with the same
+scan share.
+'''
+from contextlib import contextmanager
+from hashlib import sha1
+import json
+import math
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from PIL import Image
+import pypdfium2 as pdfium
+
+from .cache import DiskCache
+from .scans import content_key
+
+IMAGE = 'image'
+PDF = 'pdf'
+TIFF = 'tiff'
+SCAN_FORMATS = {
+    '.pdf': PDF,
+    '.tif': TIFF,
+    '.tiff': TIFF,
+}
+PAGE_QUALITY = 90
+
+# thumbnails fit in a square of this size
+THUMBNAIL_SIZE = 256
+THUMBNAIL_QUALITY = 80
+
+# tiles of the image pyramids, following the Deep Zoom layout
+TILE_SIZE = 256
+TILE_OVERLAP = 0
+TILE_FORMAT = 'jpg'
+TILE_QUALITY = 85
+
+
+def derived_path(manuscript, *parts):
+    ''' Path in the storage of an image derived from a manuscript scan. '''
+    return '/'.join(['manuscript_derived', content_key(manuscript)] + [str(part) for part in parts])
+
+
+def scan_format(manuscript):
+    ''' Whether the scan of a manuscript is a single image, a PDF or a TIFF. '''
+    extension = os.path.splitext(manuscript.filepath.name)[1].lower()
+    return SCAN_FORMATS.get(extension, IMAGE)
+
+
+@contextmanager
+def open_pdf(scan):
+    ''' Open a PDF document, which only reads the pages that are used. '''
+    try:
+        pdf = pdfium.PdfDocument(scan)
+    except pdfium.PdfiumError as error:
+        raise OSError(str(error))
+    try:
+        yield pdf
+    finally:
+        pdf.close()
+
+
+def page_count(manuscript):
+    ''' The number of pages of a manuscript scan. '''
+    kind = scan_format(manuscript)
+    if kind == IMAGE:
+        return 1
+    with manuscript.filepath.open('rb') as scan:
+        if kind == PDF:
+            with open_pdf(scan) as pdf:
+                return len(pdf)
+        return Image.open(scan).n_frames
+
+
+def page_cache():
+    return DiskCache(settings.PAGE_CACHE_DIR, settings.PAGE_CACHE_MAX_BYTES)
+
+
+def rendered_page(manuscript, page):
+    ''' The path of a JPEG rendering of a page of a PDF or TIFF scan.
+    Only the requested page is rendered, if it is not in the cache yet.
+    Raises LookupError if the scan has no such page.
+    '''
+    if page < 1:
+        raise LookupError('Pages are counted from 1')
+    key = sha1('{}/{}'.format(content_key(manuscript), page).encode()).hexdigest() + '.jpg'
+    path = page_cache().get(key)
+    if path:
+        return path
+    with manuscript.filepath.open('rb') as scan:
+        if scan_format(manuscript) == PDF:
+            with open_pdf(scan) as pdf:
+                if page > len(pdf):
+                    raise LookupError('No such page')
+                image = pdf[page - 1].render(scale=settings.PDF_RENDER_DPI / 72).to_pil()
+        else:
+            image = Image.open(scan)
+            try:
+                image.seek(page - 1)
+            except EOFError:
+                raise LookupError('No such page')
+            image.load()
+    output = BytesIO()
+    image.convert('RGB').save(output, 'JPEG', quality=PAGE_QUALITY)
+    return page_cache().put(key, output.getvalue())
+
+
+def page_image(manuscript, page, size=None):
+    ''' Open the image of a page of a manuscript scan.
+    If a size is given, JPEG images are decoded at a reduced scale
+    that is at least that size, which is much faster.
+    Raises LookupError if the scan has no such page.
+    '''
+    if scan_format(manuscript) != IMAGE:
+        scan = open(rendered_page(manuscript, page), 'rb')
+    elif page != 1:
+        raise LookupError('Scan has a single page')
+    else:
+        scan = manuscript.filepath.open('rb')
+    with scan:
+        image = Image.open(scan)
+        if size:
+            image.draft('RGB', size)
+        image.load()
+    return image
+
+
+def page_size(manuscript, page):
+    ''' The width and height of the image of a page,
+    read without decoding the image.
+    '''
+    if scan_format(manuscript) != IMAGE:
+        with Image.open(rendered_page(manuscript, page)) as image:
+            return image.size
+    if page != 1:
+        raise LookupError('Scan has a single page')
+    with manuscript.filepath.open('rb') as scan, Image.open(scan) as image:
+        return image.size
+
+
+def save_image(image, path, quality=TILE_QUALITY):
+    output = BytesIO()
+    image.convert('RGB').save(output, 'JPEG', quality=quality)
+    if default_storage.exists(path):
+        default_storage.delete(path)
+    default_storage.save(path, ContentFile(output.getvalue()))
+
+
+def pyramid_levels(width, height):
+    ''' The dimensions of each level of an image pyramid,
+    from a single pixel (level 0) to the full image.
+    '''
+    top = math.ceil(math.log2(max(width, height, 1)))
+    return [
+        (math.ceil(width / 2 ** (top - level)), math.ceil(height / 2 ** (top - level)))
+        for level in range(top + 1)
+    ]
+
+
+def descriptor_path(manuscript, page):
+    return derived_path(manuscript, 'tiles', page, 'descriptor.json')
+
+
+def tile_path(manuscript, page, level, column, row):
+    return derived_path(manuscript, 'tiles', page, level, '{}_{}.{}'.format(column, row, TILE_FORMAT))
+
+
+def tile_box(width, height, column, row):
+    ''' The region of a tile in a level of the given size. '''
+    left, top = column * TILE_SIZE, row * TILE_SIZE
+    return (
+        max(left - TILE_OVERLAP, 0),
+        max(top - TILE_OVERLAP, 0),
+        min(left + TILE_SIZE + TILE_OVERLAP, width),
+        min(top + TILE_SIZE + TILE_OVERLAP, height),
+    )
+
+
+def save_descriptor(manuscript, page, width, height):
+    descriptor = {
+        'width': width,
+        'height': height,
+        'tile_size': TILE_SIZE,
+        'overlap': TILE_OVERLAP,
+        'format': TILE_FORMAT,
+        'max_level': len(pyramid_levels(width, height)) - 1,
+    }
+    path = descriptor_path(manuscript, page)
+    if default_storage.exists(path):
+        default_storage.delete(path)
+    default_storage.save(path, ContentFile(json.dumps(descriptor).encode()))
+    return descriptor
+
+
+def build_pyramid(manuscript, page):
+    ''' Cut the image of a page into tiles at every zoom level,
+    and save a descriptor of the pyramid. Returns the descriptor.
+    '''
+    image = page_image(manuscript, page)
+    levels = pyramid_levels(*image.size)
+    for level in reversed(range(len(levels))):
+        width, height = levels[level]
+        if image.size != (width, height):
+            image = image.resize((width, height), Image.LANCZOS)
+        for column in range(math.ceil(width / TILE_SIZE)):
+            for row in range(math.ceil(height / TILE_SIZE)):
+                tile = image.crop(tile_box(width, height, column, row))
+                save_image(tile, tile_path(manuscript, page, level, column, row))
+    return save_descriptor(manuscript, page, *levels[-1])
+
+
+def pyramid(manuscript, page):
+    ''' The descriptor of the image pyramid of a page,
+    building the pyramid if that has not been done yet.
+    '''
+    path = descriptor_path(manuscript, page)
+    if not default_storage.exists(path):
+        return build_pyramid(manuscript, page)
+    with default_storage.open(path) as descriptor:
+        return json.load(descriptor)
+
+
+def descriptor(manuscript, page):
+    ''' The descriptor of the image pyramid of a page, which only
+    needs the size of the page; the tiles are cut by the job that
+    processes the page, or one at a time when they are requested.
+    '''
+    path = descriptor_path(manuscript, page)
+    if not default_storage.exists(path):
+        return save_descriptor(manuscript, page, *page_size(manuscript, page))
+    with default_storage.open(path) as saved:
+        return json.load(saved)
+
+
+def tile(manuscript, page, level, column, row):
+    ''' The path in the storage of a tile of the image pyramid of a page,
+    which is cut if that has not been done yet.
+    Raises LookupError if the pyramid has no such tile.
+    '''
+    path = tile_path(manuscript, page, level, column, row)
+    if default_storage.exists(path):
+        return path
+    described = descriptor(manuscript, page)
+    levels = pyramid_levels(described['width'], described['height'])
+    if level >= len(levels):
+        raise LookupError('No such level')
+    width, height = levels[level]
+    if column * TILE_SIZE >= width or row * TILE_SIZE >= height:
+        raise LookupError('No such tile')
+    image = page_image(manuscript, page, (width, height))
+    if image.size != (width, height):
+        image = image.resize((width, height), Image.LANCZOS)
+    save_image(image.crop(tile_box(width, height, column, row)), path)
+    return path
+
+
+def thumbnail_path(manuscript, page):
+    return derived_path(manuscript, 'thumbnails', '{}.jpg'.format(page))
+
+
+def thumbnail(manuscript, page):
+    ''' The path in the storage of a thumbnail of a page,
+    which is made if that has not been done yet.
+    '''
+    path = thumbnail_path(manuscript, page)
+    if not default_storage.exists(path):
+        size = (THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+        image = page_image(manuscript, page, size)
+        image.thumbnail(size, Image.LANCZOS)
+        save_image(image, path, THUMBNAIL_QUALITY)
+    return path
@@ -0,0 +1,81 @@
+from io import BytesIO
+
+from PIL import Image
+import pytest
+
+from . import images
+from .conftest import scan_file
+
+
+def test_pyramid_levels():
+    assert images.pyramid_levels(600, 400) == [
+        (1, 1), (2, 1), (3, 2), (5, 4), (10, 7), (19, 13),
+        (38, 25), (75, 50), (150, 100), (300, 200), (600, 400),
+    ]
+
+
+def test_build_pyramid(scanned):
+    descriptor = images.build_pyramid(scanned, 1)
+    assert descriptor['max_level'] == 10
+    assert (descriptor['width'], descriptor['height']) == (600, 400)
+    with scanned.filepath.storage.open(images.tile_path(scanned, 1, 10, 2, 1)) as tile:
+        assert Image.open(tile).size == (600 - 512, 400 - 256)
+    with scanned.filepath.storage.open(images.tile_path(scanned, 1, 8, 0, 0)) as tile:
+        assert Image.open(tile).size == (150, 100)
+
+
+def test_tile_endpoints(client, scanned):
+    url = '/api/manuscripts/{}/tiles/'.format(scanned.pk)
+    assert client.get(url + '1/').json()['max_level'] == 10
+    response = client.get(url + '1/9/1_0/')
+    assert response['Content-Type'] == 'image/jpeg'
+    assert Image.open(BytesIO(b''.join(response.streaming_content))).size == (300 - 256, 200)
+    assert client.get(url + '1/9/2_0/').status_code == 404
+    assert client.get(url + '2/').status_code == 404
+
+
+def test_tiles_are_cut_on_request(client, scanned):
+    url = '/api/manuscripts/{}/tiles/1/'.format(scanned.pk)
+    response = client.get(url + '10/2_1/')
+    assert Image.open(BytesIO(b''.join(response.streaming_content))).size == (600 - 512, 400 - 256)
+    assert client.get(url + '11/0_0/').status_code == 404
+    storage = scanned.filepath.storage
+    assert storage.exists(images.tile_path(scanned, 1, 10, 2, 1))
+    assert not storage.exists(images.tile_path(scanned, 1, 10, 0, 0))
+    assert client.get(url).json()['max_level'] == 10
+
+
+@pytest.mark.parametrize('format,extension', [('PDF', 'pdf'), ('TIFF', 'tif')])
+def test_multipage_scan(client, manuscript, media, settings, format, extension):
+    settings.PDF_RENDER_DPI = 72
+    manuscript.filepath.save('scan.' + extension, scan_file(format=format, pages=3))
+    assert images.page_count(manuscript) == 3
+
+    url = '/api/manuscripts/{}/scan/'.format(manuscript.pk)
+    response = client.get(url + '2/')
+    assert response['Content-Type'] == 'image/jpeg'
+    assert Image.open(BytesIO(b''.join(response.streaming_content))).size == (610, 400)
+    assert len(list(images.page_cache().entries())) == 1
+    assert client.get(url + '4/').status_code == 404
+    assert client.get(url + '0/').status_code == 404
+    assert images.pyramid(manuscript, 3)['width'] == 620
+
+
+def test_scan_single_image(client, scanned):
+    url = '/api/manuscripts/{}/scan/'.format(scanned.pk)
+    response = client.get(url + '1/')
+    assert response['Content-Type'] == 'image/jpeg'
+    assert client.get(url + '2/').status_code == 404
+    assert client.get('/api/manuscripts/{}/'.format(scanned.pk)).json()['page_count'] is None
+
+
+def test_thumbnail(client, scanned):
+    url = '/api/manuscripts/{}/thumbnail/'.format(scanned.pk)
+    response = client.get(url + '1/')
+    assert response['Content-Type'] == 'image/jpeg'
+    assert Image.open(BytesIO(b''.join(response.streaming_content))).size == (256, 171)
+    assert scanned.filepath.storage.exists(images.thumbnail_path(scanned, 1))
+    assert client.get(url + '2/').status_code == 404
+
+    listed = client.get('/api/manuscripts/{}/'.format(scanned.pk)).json()
+    assert listed['thumbnail'] == 'http://testserver' + url + '1/'
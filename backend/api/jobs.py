@@ -0,0 +1,154 @@
+''' A queue of background jobs, kept in the database, so that no
+other service is needed to process uploads outside of the request.
+Jobs are run by the processes of the run_jobs command. Each job names
+a task, registered here with @task, which is called with the
+manuscript of the job and its arguments.
+Changes to the lines and chapters of a manuscript queue the collation
+of its book.
+'''
+from datetime import timedelta
+import time
+import traceback
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import collation, images
+from .models import (
+    ANNOTATED_LINE, CHAPTER, DONE, FAILED, PENDING, RUNNING, Annotation, AnnotatedLine, Chapter, Job, Manuscript,
+)
+
+TASKS = {}
+
+
+def task(function):
+    TASKS[function.__name__] = function
+    return function
+
+
+def enqueue(kind, manuscript, **arguments):
+    if kind not in TASKS:
+        raise ValueError('Unknown task: {}'.format(kind))
+    return Job.objects.create(kind=kind, manuscript=manuscript, arguments=arguments)
+
+
+def requeue_stale():
+    ''' Queue jobs again that have been running for longer than
+    JOB_TIMEOUT, as their worker has probably stopped; those that were
+    started JOB_MAX_ATTEMPTS times already fail instead.
+    '''
+    now = timezone.now()
+    stale = Job.objects.filter(status=RUNNING, started__lt=now - timedelta(seconds=settings.JOB_TIMEOUT))
+    stale.filter(attempts__gte=settings.JOB_MAX_ATTEMPTS).update(
+        status=FAILED, error='Timed out after {} attempts'.format(settings.JOB_MAX_ATTEMPTS), finished=now)
+    stale.update(status=PENDING)
+
+
+def claim():
+    ''' Take the oldest pending job, marking it as running.
+    Returns None if no job is pending.
+    Workers may select the same job at once, but only one of them
+    changes its status; the others move on to the next job.
+    The collation of a book waits while another one of it is running.
+    '''
+    requeue_stale()
+    collating = Job.objects.filter(kind='collate', status=RUNNING).values('manuscript__book')
+    pending = Job.objects.filter(status=PENDING).exclude(
+        kind='collate', manuscript__book__in=collating,
+    ).order_by('pk').values_list('pk', flat=True)
+    while True:
+        pk = pending.first()
+        if pk is None:
+            return None
+        if Job.objects.filter(pk=pk, status=PENDING).update(
+                status=RUNNING, started=timezone.now(), attempts=F('attempts') + 1):
+            return Job.objects.select_related('manuscript').get(pk=pk)
+
+
+def run(job):
+    ''' Run a claimed job, recording whether it succeeded, unless it
+    timed out and was claimed again in the meantime.
+    '''
+    try:
+        TASKS[job.kind](job.manuscript, **job.arguments)
+    except Exception:
+        job.status = FAILED
+        job.error = traceback.format_exc()
+    else:
+        job.status = DONE
+    job.finished = timezone.now()
+    Job.objects.filter(pk=job.pk, status=RUNNING, started=job.started).update(
+        status=job.status, error=job.error, finished=job.finished)
+
+
+def work(once=False, poll=1.0):
+    ''' Run jobs as they are queued, checking for new jobs every
+    poll seconds. With once, return when no job is pending.
+    '''
+    while True:
+        job = claim()
+        if job:
+            run(job)
+        elif once:
+            return
+        else:
+            time.sleep(poll)
+
+
+@task
+def ingest(manuscript):
+    ''' Read the number of pages of an uploaded scan,
+    and queue the processing of each page, to be run in parallel.
+    '''
+    manuscript.page_count = images.page_count(manuscript)
+    manuscript.save(update_fields=['page_count'])
+    for page in range(1, manuscript.page_count + 1):
+        enqueue('process_page', manuscript, page=page)
+
+
+@task
+def process_page(manuscript, page):
+    ''' Render a page of a scan, make its thumbnail and cut it into
+    tiles, unless that was done for an identical scan.
+    '''
+    images.thumbnail(manuscript, page)
+    images.pyramid(manuscript, page)
+
+
+@task
+def collate(manuscript):
+    ''' Align the lines of the manuscripts of a book again,
+    where they changed; see collation.py.
+    '''
+    collation.collate(manuscript.book_id)
+
+
+def schedule_collation(manuscript_id):
+    ''' Queue the collation of the book of a manuscript, once the
+    current transaction is committed, unless it is queued already.
+    '''
+    def queue():
+        manuscript = Manuscript.objects.filter(pk=manuscript_id).first()
+        if manuscript and not Job.objects.filter(
+                kind='collate', status=PENDING, manuscript__book=manuscript.book_id).exists():
+            enqueue('collate', manuscript)
+    transaction.on_commit(queue)
+
+
+@receiver([post_save, post_delete], sender=Annotation)
+def annotation_changed(sender, instance, **kwargs):
+    if instance.annotation_type in (ANNOTATED_LINE, CHAPTER):
+        schedule_collation(instance.manuscript_id)
+
+
+@receiver([post_save, post_delete], sender=AnnotatedLine)
+@receiver([post_save, post_delete], sender=Chapter)
+def line_or_chapter_changed(sender, instance, **kwargs):
+    ''' Lines are linked, and chapters matched, without saving their annotation. '''
+    manuscript_id = Annotation.objects.filter(pk=instance.pk).values_list('manuscript', flat=True).first()
+    if manuscript_id:
+        schedule_collation(manuscript_id)
@@ -0,0 +1,127 @@
+from datetime import timedelta
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.files.storage import default_storage
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.utils import timezone
+
+from . import images, jobs
+from .conftest import scan_file
+from .models import Job, Manuscript
+
+
+def upload(client, name='scan.pdf', scan=None, title='Cairo'):
+    scan = scan or scan_file(format='PDF', pages=3)
+    scan.seek(0)
+    return client.post('/api/manuscripts/', {
+        'book': 'Muqaddimah',
+        'title': title,
+        'date': '1900',
+        'editor': 'Wafi',
+        'filepath': SimpleUploadedFile(name, scan.read()),
+    })
+
+
+def test_upload_queues_ingestion(client, book, media):
+    response = upload(client)
+    assert response.status_code == 202
+    manuscript = Manuscript.objects.get(pk=response.json()['id'])
+    assert manuscript.page_count is None
+    status = client.get('/api/jobs/{}/'.format(response.json()['job'])).json()
+    assert (status['kind'], status['status']) == ('ingest', 'pending')
+
+    jobs.work(once=True)
+    manuscript.refresh_from_db()
+    assert manuscript.page_count == 3
+    assert list(Job.objects.values_list('kind', 'status', 'arguments')) == [
+        ('ingest', 'done', {}),
+    ] + [('process_page', 'done', {'page': page}) for page in (1, 2, 3)]
+    for page in (1, 2, 3):
+        assert default_storage.exists(images.descriptor_path(manuscript, page))
+
+    listed = client.get('/api/jobs/', {'manuscript': manuscript.pk, 'status': 'done'}).json()
+    assert len(listed['results']) == 4
+
+
+def test_identical_scans_share_storage(client, book, media):
+    scan = scan_file(format='PDF', pages=3)
+    first = Manuscript.objects.get(pk=upload(client, scan=scan).json()['id'])
+    jobs.work(once=True)
+    second = Manuscript.objects.get(pk=upload(client, 'copy.pdf', scan, title='Copy').json()['id'])
+    assert len(first.sha256) == 64
+    assert (second.filepath.name, second.sha256) == (first.filepath.name, first.sha256)
+    assert first.filepath.name == 'manuscript_images/{}/{}.pdf'.format(first.sha256[:2], first.sha256)
+    assert len(list((media / 'media' / 'manuscript_images').glob('*/*'))) == 1
+
+    # the tiles of the first upload are reused
+    descriptor = media / 'media' / images.descriptor_path(first, 1)
+    built = descriptor.stat().st_mtime_ns
+    assert images.descriptor_path(second, 1) == images.descriptor_path(first, 1)
+    jobs.work(once=True)
+    assert descriptor.stat().st_mtime_ns == built
+    assert set(Job.objects.values_list('status', flat=True)) == {'done'}
+
+
+def test_failed_job(client, book, media):
+    # an image has a single page
+    response = upload(client, name='scan.jpg')
+    job = Job.objects.get(pk=response.json()['job'])
+    job.kind = 'process_page'
+    job.arguments = {'page': 2}
+    job.save()
+
+    call_command('run_jobs', '--once', '--processes', '1')
+    job.refresh_from_db()
+    assert job.status == 'failed'
+    assert 'LookupError' in job.error
+    assert job.finished is not None
+
+
+def test_claim_once(manuscript):
+    job = jobs.enqueue('ingest', manuscript)
+    assert jobs.claim() == job
+    assert jobs.claim() is None
+
+
+def test_update_keeps_scan(client, book, media):
+    manuscript = Manuscript.objects.get(pk=upload(client).json()['id'])
+    other = scan_file(format='PDF', pages=5)
+    response = client.patch(
+        '/api/manuscripts/{}/'.format(manuscript.pk),
+        encode_multipart(BOUNDARY, {'title': 'Renamed', 'filepath': SimpleUploadedFile('other.pdf', other.read())}),
+        content_type=MULTIPART_CONTENT,
+    )
+    assert response.status_code == 200
+    updated = Manuscript.objects.get(pk=manuscript.pk)
+    assert updated.title == 'Renamed'
+    assert (updated.filepath.name, updated.sha256) == (manuscript.filepath.name, manuscript.sha256)
+
+
+def test_stale_jobs_are_requeued(manuscript, settings):
+    settings.JOB_MAX_ATTEMPTS = 2
+    job = jobs.enqueue('ingest', manuscript)
+    assert jobs.claim() == job
+    # the worker stopped without finishing the job
+    assert jobs.claim() is None
+    Job.objects.filter(pk=job.pk).update(started=timezone.now() - timedelta(seconds=settings.JOB_TIMEOUT + 1))
+    claimed = jobs.claim()
+    assert (claimed, claimed.attempts) == (job, 2)
+
+    Job.objects.filter(pk=job.pk).update(started=timezone.now() - timedelta(seconds=settings.JOB_TIMEOUT + 1))
+    assert jobs.claim() is None
+    job.refresh_from_db()
+    assert (job.status, job.error) == ('failed', 'Timed out after 2 attempts')
+
+
+def test_requeued_job_finishes_once(manuscript, media, monkeypatch):
+    monkeypatch.setitem(jobs.TASKS, 'ingest', lambda manuscript: None)
+    jobs.enqueue('ingest', manuscript)
+    first = jobs.claim()
+    Job.objects.filter(pk=first.pk).update(started=timezone.now() - timedelta(days=1))
+    second = jobs.claim()
+    # the first worker was only slow, and finishes after all
+    jobs.run(first)
+    assert Job.objects.get(pk=first.pk).status == 'running'
+    jobs.run(second)
+    assert Job.objects.get(pk=first.pk).status == 'done'
@@ -0,0 +1,187 @@
+''' The reading order of annotated lines.
+It is stored as a doubly linked list (previous_line and next_line),
+and mirrored by the sequence of the line's annotation, an integer
+increasing along the list. Sequence numbers leave gaps, so that lines
+can be inserted between others without renumbering the manuscript;
+only when a gap runs out, all lines of the manuscript are renumbered.
+Sequences are unique within a manuscript; lines are placed and
+renumbered with the manuscript locked, so that concurrent edits of
+a manuscript do not read the same free numbers.
+Lines are placed when they are saved, and the bulk creation of lines
+places them at once.
+'''
+from django.db import connection, transaction
+from django.db.models import Case, Max, Min, When
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Annotation, AnnotatedLine, Manuscript
+
+MAX_WINDOW = 100
+GAP = 1024
+BATCH_SIZE = 1000
+
+WINDOW_QUERY = '''
+WITH RECURSIVE window_lines(id, depth) AS (
+    SELECT {pk}, 0 FROM {table} WHERE {pk} = %s
+    UNION ALL
+    SELECT line.{link}, window_lines.depth + 1
+    FROM {table} line JOIN window_lines ON line.{pk} = window_lines.id
+    WHERE line.{link} IS NOT NULL AND window_lines.depth + 1 < %s
+)
+SELECT id FROM window_lines ORDER BY depth
+'''
+
+
+def window_ids(start, count, forward=True):
+    ''' The ids of (at most) count consecutive lines, starting with
+    the line with id start and following the next (or previous) lines.
+    '''
+    link = AnnotatedLine._meta.get_field('next_line' if forward else 'previous_line')
+    if connection.vendor in ('postgresql', 'sqlite'):
+        query = WINDOW_QUERY.format(
+            table=connection.ops.quote_name(AnnotatedLine._meta.db_table),
+            pk=connection.ops.quote_name(AnnotatedLine._meta.pk.column),
+            link=connection.ops.quote_name(link.column),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(query, [start, count])
+            return [row[0] for row in cursor.fetchall()]
+    # hop from line to line on databases without recursive queries
+    ids = []
+    current = start
+    while current is not None and len(ids) < count:
+        links = list(AnnotatedLine.objects.filter(pk=current).values_list(link.attname, flat=True))
+        if not links:
+            break
+        ids.append(current)
+        current = links[0]
+    return ids
+
+
+def window(start, count, forward=True):
+    ''' The lines of a window, with their annotations, in reading order. '''
+    ids = window_ids(start, count, forward)
+    lines = AnnotatedLine.objects.select_related('annotation').in_bulk(ids)
+    if not forward:
+        ids.reverse()
+    return [lines[pk] for pk in ids]
+
+
+def lock(manuscript_id):
+    ''' Lock a manuscript until the end of the current transaction. '''
+    Manuscript.objects.select_for_update().filter(pk=manuscript_id).exists()
+
+
+def renumber(manuscript_id):
+    ''' Number all lines of a manuscript along their chains.
+    Chains are ordered by the page and id of their first line.
+    '''
+    with transaction.atomic():
+        lock(manuscript_id)
+        _renumber(manuscript_id)
+
+
+def _renumber(manuscript_id):
+    rows = AnnotatedLine.objects.filter(annotation__manuscript=manuscript_id).values_list(
+        'pk', 'previous_line', 'next_line', 'annotation__page')
+    following = {}
+    heads = []
+    for pk, previous_id, next_id, page in rows:
+        following[pk] = next_id
+        if previous_id is None:
+            heads.append((page, pk))
+    order = []
+    seen = set()
+    # lines in a cycle have no head; start them from their lowest id
+    for _, pk in sorted(heads) + [(None, pk) for pk in sorted(following)]:
+        while pk in following and pk not in seen:
+            seen.add(pk)
+            order.append(pk)
+            pk = following[pk]
+    # cleared first, as the new numbers may be taken by other lines yet
+    Annotation.objects.filter(manuscript=manuscript_id, sequence__isnull=False).update(sequence=None)
+    for start in range(0, len(order), BATCH_SIZE):
+        batch = order[start:start + BATCH_SIZE]
+        set_sequence(batch, [(start + index + 1) * GAP for index in range(len(batch))])
+
+
+def set_sequence(ids, sequences):
+    Annotation.objects.filter(pk__in=ids).update(modified=timezone.now(), sequence=Case(
+        *[When(pk=pk, then=sequence) for pk, sequence in zip(ids, sequences)]))
+
+
+def touch(ids):
+    ''' Mark the annotations of lines as modified, when their links
+    change without saving them, so that exports since then include them.
+    '''
+    Annotation.objects.filter(pk__in=[pk for pk in ids if pk]).update(modified=timezone.now())
+
+
+def place(manuscript_id, ids, previous_id=None, following_id=None):
+    ''' Number consecutive lines (by id, in reading order) of a
+    manuscript, between the lines before and after them in the chain.
+    '''
+    with transaction.atomic():
+        lock(manuscript_id)
+        _place(manuscript_id, ids, previous_id, following_id)
+
+
+def _place(manuscript_id, ids, previous_id, following_id):
+    numbered = Annotation.objects.filter(
+        manuscript=manuscript_id, sequence__isnull=False).exclude(pk__in=ids)
+    neighbours = dict(numbered.filter(
+        pk__in=[previous_id, following_id]).values_list('pk', 'sequence'))
+    if (previous_id and previous_id not in neighbours) or \
+            (following_id and following_id not in neighbours):
+        # the chain around these lines is not numbered yet
+        return _renumber(manuscript_id)
+    before = neighbours.get(previous_id)
+    after = neighbours.get(following_id)
+    if before is None and after is None:
+        before = numbered.aggregate(last=Max('sequence'))['last'] or 0
+    elif after is None:
+        after = numbered.filter(sequence__gt=before).aggregate(next=Min('sequence'))['next']
+    elif before is None:
+        before = numbered.filter(sequence__lt=after).aggregate(previous=Max('sequence'))['previous']
+    elif numbered.filter(sequence__gt=before, sequence__lt=after).exists():
+        # other lines are numbered between the neighbours in the chain
+        return _renumber(manuscript_id)
+
+    if after is None:
+        start, step = before, GAP
+    elif before is None:
+        start, step = after - GAP * (len(ids) + 1), GAP
+    else:
+        start, step = before, min(GAP, (after - before) // (len(ids) + 1))
+    if step < 1:
+        return _renumber(manuscript_id)
+    set_sequence(ids, [start + step * (index + 1) for index in range(len(ids))])
+
+
+def place_line(line):
+    ''' Keep the sequence of a line consistent with its neighbours,
+    after it has been created or linked to other lines.
+    '''
+    annotation = line.annotation
+    sequences = dict(Annotation.objects.filter(
+        pk__in=[line.previous_line_id, line.next_line_id]).values_list('pk', 'sequence'))
+    before = sequences.get(line.previous_line_id)
+    after = sequences.get(line.next_line_id)
+    current = Annotation.objects.filter(pk=annotation.pk).values_list('sequence', flat=True).get()
+    if current is not None and \
+            (line.previous_line_id is None or (before is not None and before < current)) and \
+            (line.next_line_id is None or (after is not None and current < after)):
+        return
+    place(annotation.manuscript_id, [annotation.pk], line.previous_line_id, line.next_line_id)
+
+
+@receiver(post_save, sender=AnnotatedLine)
+def line_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    ''' Place lines that are created or linked outside of the API,
+    such as in the admin.
+    '''
+    if raw or (update_fields is not None and not {'previous_line', 'next_line'} & set(update_fields)):
+        return
+    place_line(instance)
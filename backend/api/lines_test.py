@@ -0,0 +1,131 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+import pytest
+
+from . import lines
+from .conftest import add_annotations, bulk_lines
+from .models import Annotation, AnnotatedLine
+
+
+@pytest.fixture
+def chain(manuscript):
+    chain = add_annotations(manuscript, lines=5)
+    for previous, line in zip(chain, chain[1:]):
+        line.previous_line = previous
+        line.save()
+    for line, following in zip(chain, chain[1:]):
+        line.next_line = following
+        line.save()
+    return [line.pk for line in chain]
+
+
+def test_window_ids(chain, django_assert_num_queries):
+    with django_assert_num_queries(1):
+        assert lines.window_ids(chain[1], 3) == chain[1:4]
+    assert lines.window_ids(chain[3], 10, forward=False) == chain[3::-1]
+    assert lines.window_ids(chain[4], 10) == chain[4:]
+    assert lines.window_ids(-1, 10) == []
+
+
+def test_window_ids_without_recursion(chain, monkeypatch):
+    monkeypatch.setattr(connection, 'vendor', 'other')
+    assert lines.window_ids(chain[1], 3) == chain[1:4]
+    assert lines.window_ids(chain[3], 10, forward=False) == chain[3::-1]
+    assert lines.window_ids(-1, 10) == []
+
+
+def test_window_endpoint(client, chain):
+    response = client.get('/api/annotated_lines/{}/window/'.format(chain[3]), {'direction': 'previous', 'count': 2})
+    assert [line['annotation']['id'] for line in response.json()] == chain[2:4]
+    response = client.get('/api/annotated_lines/{}/window/'.format(chain[0]))
+    assert [line['annotation']['id'] for line in response.json()] == chain
+    response = client.get('/api/annotated_lines/{}/window/'.format(chain[0]), {'direction': 'up'})
+    assert response.status_code == 400
+
+
+def sequence_order(manuscript):
+    return list(Annotation.objects.filter(
+        manuscript=manuscript, sequence__isnull=False).order_by('sequence').values_list('pk', flat=True))
+
+
+def test_renumber(manuscript, chain):
+    second = add_annotations(manuscript, page=2, lines=2)
+    second[0].next_line = second[1]
+    second[0].save()
+    Annotation.objects.update(sequence=None)
+    lines.renumber(manuscript.pk)
+    assert sequence_order(manuscript) == chain + [line.pk for line in second]
+    assert Annotation.objects.get(pk=chain[1]).sequence == 2 * lines.GAP
+
+
+def test_bulk_insert_places_lines(client, manuscript):
+    created = bulk_lines(client, manuscript, 3).json()['created']
+    assert sequence_order(manuscript) == created
+    inserted = bulk_lines(client, manuscript, 2, previous_line=created[0]).json()['created']
+    assert sequence_order(manuscript) == [created[0]] + inserted + created[1:]
+
+
+def test_renumber_when_gap_runs_out(client, manuscript, monkeypatch):
+    monkeypatch.setattr(lines, 'GAP', 2)
+    created = bulk_lines(client, manuscript, 2).json()['created']
+    inserted = bulk_lines(client, manuscript, 3, previous_line=created[0]).json()['created']
+    assert sequence_order(manuscript) == [created[0]] + inserted + [created[1]]
+    assert Annotation.objects.get(pk=created[1]).sequence == 5 * 2
+
+
+def test_patch_links_place_lines(client, manuscript):
+    ids = [
+        client.post('/api/annotated_lines/', {
+            'annotation': {'manuscript': manuscript.pk, 'bounding_box': {}},
+        }, content_type='application/json').json()['created']
+        for _ in range(3)
+    ]
+    assert sequence_order(manuscript) == ids
+    # move the last line to the front
+    client.patch('/api/annotated_lines/{}/'.format(ids[1]), {'next_line': None}, content_type='application/json')
+    client.patch('/api/annotated_lines/{}/'.format(ids[2]), {'next_line': ids[0]}, content_type='application/json')
+    client.patch('/api/annotated_lines/{}/'.format(ids[0]), {'previous_line': ids[2], 'next_line': ids[1]}, content_type='application/json')
+    assert sequence_order(manuscript) == [ids[2], ids[0], ids[1]]
+
+    response = client.get('/api/manuscripts/{}/lines/2/'.format(manuscript.pk))
+    assert response.json()['annotation']['id'] == ids[0]
+    assert client.get('/api/manuscripts/{}/lines/4/'.format(manuscript.pk)).status_code == 404
+
+
+def test_rebuild_command(manuscript, chain):
+    Annotation.objects.update(sequence=None)
+    call_command('rebuild_line_sequence', stdout=StringIO())
+    assert sequence_order(manuscript) == chain
+
+
+def test_relinking_marks_lines_modified(client, manuscript):
+    created = bulk_lines(client, manuscript, 3).json()['created']
+    since = Annotation.objects.order_by('modified').last().modified
+    inserted = bulk_lines(client, manuscript, 1, previous_line=created[0]).json()['created']
+    changed = Annotation.objects.filter(modified__gt=since).values_list('pk', flat=True)
+    assert set(changed) == {created[0], created[1]} | set(inserted)
+
+    since = Annotation.objects.order_by('modified').last().modified
+    client.patch('/api/annotated_lines/{}/'.format(created[2]), {'next_line': None}, content_type='application/json')
+    assert list(Annotation.objects.filter(modified__gt=since).values_list('pk', flat=True)) == [created[2]]
+
+
+def test_saved_lines_are_placed(manuscript, chain):
+    # lines created and linked outside of the API, such as in the admin
+    assert sequence_order(manuscript) == chain
+    [line] = add_annotations(manuscript, page=2, lines=1)
+    assert sequence_order(manuscript) == chain + [line.pk]
+    first = AnnotatedLine.objects.get(pk=chain[0])
+    first.previous_line = line
+    first.save()
+    line.next_line = first
+    line.save()
+    assert sequence_order(manuscript) == [line.pk] + chain
+
+
+def test_sequences_are_unique(manuscript, chain):
+    with pytest.raises(IntegrityError), transaction.atomic():
+        Annotation.objects.filter(pk=chain[1]).update(
+            sequence=Annotation.objects.get(pk=chain[0]).sequence)
@@ -0,0 +1,96 @@
+from statistics import median
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import ANNOTATED_LINE, Annotation, Author, Book, Editor, Manuscript, TextField
+
+BATCH_SIZE = 10000
+LINES_PER_PAGE = 25
+PAGES_PER_MANUSCRIPT = 400
+TITLE = 'Benchmark'
+
+
+def seed(count):
+    ''' Add a book with manuscripts that have count annotations
+    in total, of which half are complete, and a text field per page.
+    '''
+    author, _ = Author.objects.get_or_create(name=TITLE)
+    editor, _ = Editor.objects.get_or_create(name=TITLE)
+    book = Book.objects.create(title=TITLE, author=author)
+    per_manuscript = LINES_PER_PAGE * PAGES_PER_MANUSCRIPT
+    annotations = []
+    for number in range(0, count, per_manuscript):
+        manuscript = Manuscript.objects.create(
+            filepath='manuscript_images/benchmark.jpg', editor=editor, book=book,
+            title='{} {}'.format(TITLE, number // per_manuscript), date='')
+        TextField.objects.bulk_create([
+            TextField(manuscript=manuscript, page=page, bounding_box={'x': 50, 'y': 50, 'width': 900, 'height': 1300})
+            for page in range(1, PAGES_PER_MANUSCRIPT + 1)
+        ])
+        for index in range(min(per_manuscript, count - number)):
+            page, line = divmod(index, LINES_PER_PAGE)
+            annotation = Annotation(
+                manuscript=manuscript,
+                page=page + 1,
+                bounding_box={'x': 60, 'y': 60 + 50 * line, 'width': 880, 'height': 40},
+                complete=random.random() < 0.5,
+                annotation_type=ANNOTATED_LINE,
+                sequence=(index + 1) * 1024,
+            )
+            annotations.append(annotation)
+            if len(annotations) == BATCH_SIZE:
+                Annotation.objects.bulk_create(annotations)
+                annotations = []
+    Annotation.objects.bulk_create(annotations)
+
+
+def hot_queries():
+    ''' The queries of the API that run most often, by name. '''
+    manuscript = Manuscript.objects.filter(book__title=TITLE).order_by('pk').first()
+    complete = Annotation.objects.filter(complete=True)
+    since = complete.order_by('modified').values_list('modified', flat=True)[complete.count() // 2]
+    return {
+        'annotations on a page': Annotation.objects.filter(manuscript=manuscript, page=200),
+        'text fields on a page': TextField.objects.filter(manuscript=manuscript, page=200),
+        'region of a page': Annotation.objects.filter(
+            manuscript=manuscript, page=200, min_x__lte=500, max_x__gte=400, min_y__lte=500, max_y__gte=400),
+        'line by number': Annotation.objects.filter(
+            manuscript=manuscript, sequence__isnull=False).order_by('sequence')[5000:5001],
+        'export': Annotation.objects.filter(complete=True).order_by('modified', 'id')[:2000],
+        'export since': Annotation.objects.filter(
+            complete=True, modified__gt=since).order_by('modified', 'id')[:2000],
+        'book by title': Book.objects.filter(title=TITLE),
+        'author by name': Author.objects.filter(name=TITLE),
+        'editor by name': Editor.objects.filter(name=TITLE),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Show the query plans and timings of the most frequent queries.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0,
+            help='first add a benchmark book with this many annotations')
+        parser.add_argument('--repeat', type=int, default=20,
+            help='number of times each query is run')
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            with transaction.atomic():
+                seed(options['seed'])
+            self.stdout.write('Added {} annotations'.format(options['seed']))
+        if not Book.objects.filter(title=TITLE).exists():
+            self.stderr.write('No benchmark data; run with --seed first')
+            return
+        for name, queryset in hot_queries().items():
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                list(queryset.all())
+                timings.append(time.perf_counter() - start)
+            self.stdout.write('{}: {:.2f} ms'.format(name, median(timings) * 1000))
+            self.stdout.write(queryset.explain())
+            self.stdout.write('')
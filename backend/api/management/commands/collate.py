@@ -0,0 +1,22 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from api.collation import collate
+from api.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Align the lines of the manuscripts of books, where they changed since the last collation.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('books', nargs='*', type=int,
+            help='ids of the books to collate (default: all)')
+        parser.add_argument('--processes', type=int, default=os.cpu_count(),
+            help='number of processes that align blocks (default: one per core)')
+
+    def handle(self, *args, **options):
+        books = options['books'] or Book.objects.order_by('pk').values_list('pk', flat=True)
+        for book in books:
+            aligned = collate(book, processes=max(1, options['processes'] or 1))
+            self.stdout.write('Book {}: aligned {} blocks'.format(book, len(aligned)))
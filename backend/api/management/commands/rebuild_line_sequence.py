@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api.lines import renumber
+from api.models import Manuscript
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the sequence numbers of lines from their previous/next links.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('manuscripts', nargs='*', type=int,
+            help='ids of the manuscripts to renumber (default: all)')
+
+    def handle(self, *args, **options):
+        manuscripts = Manuscript.objects.order_by('pk')
+        if options['manuscripts']:
+            manuscripts = manuscripts.filter(pk__in=options['manuscripts'])
+        for pk in manuscripts.values_list('pk', flat=True):
+            renumber(pk)
+            self.stdout.write('Renumbered manuscript {}'.format(pk))
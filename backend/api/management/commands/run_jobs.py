@@ -0,0 +1,30 @@
+import multiprocessing
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from api.jobs import work
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs in a pool of worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count(),
+            help='number of worker processes (default: one per core)')
+        parser.add_argument('--poll', type=float, default=1.0,
+            help='seconds to wait before checking for new jobs')
+        parser.add_argument('--once', action='store_true',
+            help='stop when no job is pending')
+
+    def handle(self, *args, **options):
+        processes = max(1, options['processes'] or 1)
+        arguments = (options['once'], options['poll'])
+        if processes == 1:
+            work(*arguments)
+            return
+        # every process opens its own database connection
+        connections.close_all()
+        with multiprocessing.Pool(processes) as pool:
+            pool.starmap(work, [arguments] * processes)
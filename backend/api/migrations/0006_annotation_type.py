@@ -0,0 +1,42 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:15
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def backfill_annotation_type(apps, schema_editor):
+    ''' Derive the type of existing annotations from the
+    chapter, aside or line extending them, in batches.
+    '''
+    Annotation = apps.get_model('api', 'Annotation')
+    for annotation_type, relation in [
+        ('chapter', 'chapter'),
+        ('aside', 'aside'),
+        ('annotated_line', 'annotated_line'),
+    ]:
+        pending = Annotation.objects.filter(
+            annotation_type__isnull=True,
+            **{relation + '__isnull': False}
+        ).values_list('pk', flat=True)
+        while True:
+            batch = list(pending[:BATCH_SIZE])
+            if not batch:
+                break
+            Annotation.objects.filter(pk__in=batch).update(annotation_type=annotation_type)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_auto_20200806_1024'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='annotation',
+            name='annotation_type',
+            field=models.CharField(blank=True, choices=[('chapter', 'Chapter'), ('aside', 'Aside'), ('annotated_line', 'Annotated line')], db_index=True, max_length=20, null=True),
+        ),
+        migrations.RunPython(backfill_annotation_type, migrations.RunPython.noop),
+    ]
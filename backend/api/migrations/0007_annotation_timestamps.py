@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:16
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_annotation_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='annotation',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='annotation',
+            name='modified',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='annotation',
+            index=models.Index(fields=['modified', 'id'], name='annotation_modified_idx'),
+        ),
+    ]
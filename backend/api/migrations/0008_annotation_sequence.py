@@ -0,0 +1,58 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:20
+
+from django.db import migrations, models
+
+GAP = 1024
+BATCH_SIZE = 1000
+
+
+def number_lines(apps, schema_editor):
+    ''' Number the existing lines of each manuscript along their chains
+    of next lines, in batches. Chains are ordered by the page and id of
+    their first line; lines in a cycle start from their lowest id.
+    '''
+    Annotation = apps.get_model('api', 'Annotation')
+    AnnotatedLine = apps.get_model('api', 'AnnotatedLine')
+    manuscripts = AnnotatedLine.objects.order_by().values_list('annotation__manuscript', flat=True).distinct()
+    for manuscript in list(manuscripts):
+        rows = AnnotatedLine.objects.filter(annotation__manuscript=manuscript).values_list(
+            'pk', 'previous_line', 'next_line', 'annotation__page')
+        following = {}
+        heads = []
+        for pk, previous_id, next_id, page in rows:
+            following[pk] = next_id
+            if previous_id is None:
+                heads.append((page, pk))
+        order = []
+        seen = set()
+        for _, pk in sorted(heads) + [(None, pk) for pk in sorted(following)]:
+            while pk in following and pk not in seen:
+                seen.add(pk)
+                order.append(pk)
+                pk = following[pk]
+        for start in range(0, len(order), BATCH_SIZE):
+            batch = [
+                Annotation(pk=pk, sequence=(start + index + 1) * GAP)
+                for index, pk in enumerate(order[start:start + BATCH_SIZE])
+            ]
+            Annotation.objects.bulk_update(batch, ['sequence'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_annotation_timestamps'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='annotation',
+            name='sequence',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='annotation',
+            index=models.Index(fields=['manuscript', 'sequence'], name='annotation_sequence_idx'),
+        ),
+        migrations.RunPython(number_lines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:24
+
+import os
+
+from django.db import migrations, models
+
+from PIL import Image
+import pypdfium2 as pdfium
+
+
+def page_count(manuscript):
+    ''' The number of pages of a scan, as api.images counted them when
+    this migration was written: single images have one page.
+    '''
+    extension = os.path.splitext(manuscript.filepath.name)[1].lower()
+    if extension not in ('.pdf', '.tif', '.tiff'):
+        return 1
+    with manuscript.filepath.open('rb') as scan:
+        if extension == '.pdf':
+            try:
+                pdf = pdfium.PdfDocument(scan)
+            except pdfium.PdfiumError as error:
+                raise OSError(str(error))
+            try:
+                return len(pdf)
+            finally:
+                pdf.close()
+        return Image.open(scan).n_frames
+
+
+def count_pages(apps, schema_editor):
+    Manuscript = apps.get_model('api', 'Manuscript')
+    for manuscript in Manuscript.objects.filter(page_count__isnull=True).iterator():
+        try:
+            manuscript.page_count = page_count(manuscript)
+        except (OSError, ValueError):
+            # missing or unreadable scan
+            continue
+        manuscript.save(update_fields=['page_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_annotation_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='manuscript',
+            name='page_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(count_pages, migrations.RunPython.noop),
+    ]
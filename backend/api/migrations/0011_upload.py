@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:27
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Upload',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('filename', models.CharField(max_length=255)),
+                ('length', models.BigIntegerField()),
+                ('offset', models.BigIntegerField(default=0)),
+                ('checksum', models.CharField(blank=True, default='', max_length=64)),
+                ('metadata', django.contrib.postgres.fields.jsonb.JSONField(default=dict)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('manuscript', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='upload', to='api.manuscript')),
+            ],
+        ),
+    ]
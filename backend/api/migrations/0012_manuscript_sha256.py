@@ -0,0 +1,60 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:29
+
+from hashlib import sha256
+import os
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+
+def store(scan):
+    ''' Save a scan under the hash of its content, as api.scans stored
+    them when this migration was written. Returns its path and hash.
+    '''
+    digest = sha256()
+    scan.seek(0)
+    for chunk in scan.chunks():
+        digest.update(chunk)
+    digest = digest.hexdigest()
+    extension = os.path.splitext(scan.name)[1].lower()
+    path = 'manuscript_images/{}/{}{}'.format(digest[:2], digest, extension)
+    if not default_storage.exists(path):
+        scan.seek(0)
+        path = default_storage.save(path, scan)
+    return path, digest
+
+
+def store_by_content(apps, schema_editor):
+    ''' Move existing scans to the path of their content,
+    keeping a single copy of identical scans.
+    '''
+    Manuscript = apps.get_model('api', 'Manuscript')
+    for manuscript in Manuscript.objects.exclude(filepath='').filter(sha256='').iterator():
+        previous = manuscript.filepath.name
+        try:
+            with manuscript.filepath.open('rb') as scan:
+                path, digest = store(scan)
+        except OSError:
+            # missing scan
+            continue
+        manuscript.filepath = path
+        manuscript.sha256 = digest
+        manuscript.save(update_fields=['filepath', 'sha256'])
+        if path != previous and not Manuscript.objects.filter(filepath=previous).exists():
+            default_storage.delete(previous)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_upload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='manuscript',
+            name='sha256',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+        migrations.RunPython(store_by_content, migrations.RunPython.noop),
+    ]
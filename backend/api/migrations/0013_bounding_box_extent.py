@@ -0,0 +1,116 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:32
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def points(box):
+    ''' The points of a bounding box, as api.geometry found them when
+    this migration was written.
+    '''
+    if isinstance(box, dict):
+        if 'geometry' in box:
+            yield from points(box['geometry'])
+        elif 'coordinates' in box:
+            yield from points(box['coordinates'])
+        elif 'marks' in box:
+            yield from points(box['marks'])
+        elif is_number(box.get('x')) and is_number(box.get('y')):
+            x, y = box['x'], box['y']
+            yield x, y
+            if is_number(box.get('width')) and is_number(box.get('height')):
+                yield x + box['width'], y + box['height']
+    elif isinstance(box, (list, tuple)):
+        if len(box) >= 2 and is_number(box[0]) and is_number(box[1]):
+            yield box[0], box[1]
+        else:
+            for item in box:
+                yield from points(item)
+
+
+def extent(box):
+    found = list(points(box))
+    if not found:
+        return None, None, None, None
+    xs, ys = zip(*found)
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def backfill_extent(apps, schema_editor):
+    ''' Derive the extent of existing bounding boxes, in batches. '''
+    for model in ['Annotation', 'TextField']:
+        Model = apps.get_model('api', model)
+        pending = Model.objects.order_by('pk').only('pk', 'bounding_box')
+        last = 0
+        while True:
+            batch = list(pending.filter(pk__gt=last)[:BATCH_SIZE])
+            if not batch:
+                break
+            for item in batch:
+                item.min_x, item.min_y, item.max_x, item.max_y = extent(item.bounding_box)
+            Model.objects.bulk_update(batch, ['min_x', 'min_y', 'max_x', 'max_y'])
+            last = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_manuscript_sha256'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='annotation',
+            name='max_x',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='annotation',
+            name='max_y',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='annotation',
+            name='min_x',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='annotation',
+            name='min_y',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='textfield',
+            name='max_x',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='textfield',
+            name='max_y',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='textfield',
+            name='min_x',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='textfield',
+            name='min_y',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='annotation',
+            index=models.Index(fields=['manuscript', 'page', 'min_x', 'min_y', 'max_x', 'max_y'], name='annotation_extent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='textfield',
+            index=models.Index(fields=['manuscript', 'page', 'min_x', 'min_y', 'max_x', 'max_y'], name='textfield_extent_idx'),
+        ),
+        migrations.RunPython(backfill_extent, migrations.RunPython.noop),
+    ]
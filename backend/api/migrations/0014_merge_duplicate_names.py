@@ -0,0 +1,35 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:34
+
+from django.db import migrations
+
+
+def merge_duplicates(apps, schema_editor):
+    ''' Merge authors and editors with the same name into the first
+    of them, so that names can be unique.
+    '''
+    for model, referring, field in [('Author', 'Book', 'author'), ('Editor', 'Manuscript', 'editor')]:
+        Model = apps.get_model('api', model)
+        Referring = apps.get_model('api', referring)
+        kept = {}
+        for pk, name in Model.objects.order_by('pk').values_list('pk', 'name'):
+            if name in kept:
+                Referring.objects.filter(**{field: pk}).update(**{field: kept[name]})
+                Model.objects.filter(pk=pk).delete()
+            else:
+                kept[name] = pk
+
+
+class Migration(migrations.Migration):
+    ''' The merge runs apart from the unique constraints of 0015:
+    on PostgreSQL, the foreign keys that it changes are checked when
+    its transaction commits, and a table with such pending checks
+    cannot be altered in the same transaction.
+    '''
+
+    dependencies = [
+        ('api', '0013_bounding_box_extent'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_merge_duplicate_names'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='author',
+            name='name',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='book',
+            name='title',
+            field=models.CharField(db_index=True, max_length=400),
+        ),
+        migrations.AlterField(
+            model_name='editor',
+            name='name',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+        # exports read complete annotations by modification; other reads
+        # since a time keep using annotation_modified_idx
+        migrations.AddIndex(
+            model_name='annotation',
+            index=models.Index(condition=models.Q(('complete', True)), fields=['modified', 'id'], name='annotation_complete_idx'),
+        ),
+    ]
@@ -0,0 +1,85 @@
+from django.db import migrations
+
+# the index as it was first defined; see api/search.py for the current one
+POSTGRES_VECTOR = '''(
+    setweight(to_tsvector('khatt', {table}.text), 'A') ||
+    setweight(to_tsvector('khatt', {table}.label), 'B') ||
+    setweight(to_tsvector('khatt', {table}.research_note), 'C')
+)'''
+
+POSTGRES_INDEX = [
+    '''DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'khatt') THEN
+            IF EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'arabic') THEN
+                CREATE TEXT SEARCH CONFIGURATION khatt (COPY = arabic);
+            ELSE
+                CREATE TEXT SEARCH CONFIGURATION khatt (COPY = simple);
+            END IF;
+        END IF;
+    END $$''',
+    'CREATE INDEX IF NOT EXISTS annotation_search_idx ON api_annotation USING gin ({})'.format(
+        POSTGRES_VECTOR.format(table='api_annotation')),
+]
+
+POSTGRES_DROP = [
+    'DROP INDEX IF EXISTS annotation_search_idx',
+    'DROP TEXT SEARCH CONFIGURATION IF EXISTS khatt',
+]
+
+SQLITE_TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS api_annotation_search_insert AFTER INSERT ON api_annotation BEGIN
+        INSERT INTO api_annotation_search (rowid, text, label, research_note)
+        VALUES (new.id, new.text, new.label, new.research_note);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS api_annotation_search_delete AFTER DELETE ON api_annotation BEGIN
+        INSERT INTO api_annotation_search (api_annotation_search, rowid, text, label, research_note)
+        VALUES ('delete', old.id, old.text, old.label, old.research_note);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS api_annotation_search_update
+    AFTER UPDATE OF text, label, research_note ON api_annotation BEGIN
+        INSERT INTO api_annotation_search (api_annotation_search, rowid, text, label, research_note)
+        VALUES ('delete', old.id, old.text, old.label, old.research_note);
+        INSERT INTO api_annotation_search (rowid, text, label, research_note)
+        VALUES (new.id, new.text, new.label, new.research_note);
+    END''',
+]
+
+SQLITE_INDEX = [
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS api_annotation_search USING fts5 (
+        text, label, research_note,
+        content='api_annotation', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )''',
+    "INSERT INTO api_annotation_search (api_annotation_search) VALUES ('rebuild')",
+] + SQLITE_TRIGGERS
+
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS api_annotation_search_insert',
+    'DROP TRIGGER IF EXISTS api_annotation_search_delete',
+    'DROP TRIGGER IF EXISTS api_annotation_search_update',
+    'DROP TABLE IF EXISTS api_annotation_search',
+]
+
+INDEX = {'postgresql': POSTGRES_INDEX, 'sqlite': SQLITE_INDEX}
+DROP = {'postgresql': POSTGRES_DROP, 'sqlite': SQLITE_DROP}
+
+
+def add_search_index(apps, schema_editor):
+    for statement in INDEX.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def remove_search_index(apps, schema_editor):
+    for statement in DROP.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_search_index, remove_search_index),
+    ]
@@ -0,0 +1,189 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:45
+
+import unicodedata
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+# the normalization of api/arabic.py as it was when this migration was written
+REMOVED = [
+    (0x0610, 0x061A), (0x064B, 0x065F), (0x0670, 0x0670), (0x06D6, 0x06ED),
+    (0x0640, 0x0640), (0x200B, 0x200F), (0x202A, 0x202E), (0xFEFF, 0xFEFF),
+]
+
+REPLACED = {
+    'آ': 'ا', 'أ': 'ا', 'إ': 'ا', 'ٱ': 'ا', 'ٲ': 'ا', 'ٳ': 'ا',
+    'ؤ': 'و',
+    'ئ': 'ي', 'ى': 'ي', 'ی': 'ي', 'ې': 'ي', 'ۍ': 'ي',
+    'ة': 'ه', 'ۀ': 'ه', 'ہ': 'ه', 'ە': 'ه',
+    'ک': 'ك', 'ڪ': 'ك',
+    '٠': '0', '١': '1', '٢': '2', '٣': '3', '٤': '4',
+    '٥': '5', '٦': '6', '٧': '7', '٨': '8', '٩': '9',
+    '۰': '0', '۱': '1', '۲': '2', '۳': '3', '۴': '4',
+    '۵': '5', '۶': '6', '۷': '7', '۸': '8', '۹': '9',
+}
+
+PRESENTATION_FORMS = [(0xFB50, 0xFDFF), (0xFE70, 0xFEFC)]
+
+
+def build_table():
+    table = {}
+    for first, last in REMOVED:
+        for code in range(first, last + 1):
+            table[code] = None
+    for letter, replacement in REPLACED.items():
+        table[ord(letter)] = replacement
+    for first, last in PRESENTATION_FORMS:
+        for code in range(first, last + 1):
+            decomposed = unicodedata.normalize('NFKC', chr(code))
+            if decomposed != chr(code):
+                table[code] = decomposed.translate(table)
+    return table
+
+
+def normalize(text, table=build_table()):
+    return ' '.join(text.translate(table).lower().split())
+
+
+def strings(value):
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, list):
+        for item in value:
+            yield from strings(item)
+    elif isinstance(value, dict):
+        yield from strings(value.get('text'))
+
+
+# the search index of 0016 is on the text; this one is on the normalized text
+POSTGRES_VECTOR = '''(
+    setweight(to_tsvector('khatt', api_annotation.{column}), 'A') ||
+    setweight(to_tsvector('khatt', api_annotation.label), 'B') ||
+    setweight(to_tsvector('khatt', api_annotation.research_note), 'C')
+)'''
+
+POSTGRES_INDEX = [
+    '''DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'khatt') THEN
+            IF EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'arabic') THEN
+                CREATE TEXT SEARCH CONFIGURATION khatt (COPY = arabic);
+            ELSE
+                CREATE TEXT SEARCH CONFIGURATION khatt (COPY = simple);
+            END IF;
+        END IF;
+    END $$''',
+    'CREATE INDEX IF NOT EXISTS annotation_search_idx ON api_annotation USING gin {}'.format(POSTGRES_VECTOR),
+]
+
+POSTGRES_DROP = [
+    'DROP INDEX IF EXISTS annotation_search_idx',
+    'DROP TEXT SEARCH CONFIGURATION IF EXISTS khatt',
+]
+
+SQLITE_INDEX = [
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS api_annotation_search USING fts5 (
+        {column}, label, research_note,
+        content='api_annotation', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )''',
+    "INSERT INTO api_annotation_search (api_annotation_search) VALUES ('rebuild')",
+    '''CREATE TRIGGER IF NOT EXISTS api_annotation_search_insert AFTER INSERT ON api_annotation BEGIN
+        INSERT INTO api_annotation_search (rowid, {column}, label, research_note)
+        VALUES (new.id, new.{column}, new.label, new.research_note);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS api_annotation_search_delete AFTER DELETE ON api_annotation BEGIN
+        INSERT INTO api_annotation_search (api_annotation_search, rowid, {column}, label, research_note)
+        VALUES ('delete', old.id, old.{column}, old.label, old.research_note);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS api_annotation_search_update
+    AFTER UPDATE OF {column}, label, research_note ON api_annotation BEGIN
+        INSERT INTO api_annotation_search (api_annotation_search, rowid, {column}, label, research_note)
+        VALUES ('delete', old.id, old.{column}, old.label, old.research_note);
+        INSERT INTO api_annotation_search (rowid, {column}, label, research_note)
+        VALUES (new.id, new.{column}, new.label, new.research_note);
+    END''',
+]
+
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS api_annotation_search_insert',
+    'DROP TRIGGER IF EXISTS api_annotation_search_delete',
+    'DROP TRIGGER IF EXISTS api_annotation_search_update',
+    'DROP TABLE IF EXISTS api_annotation_search',
+]
+
+INDEX = {'postgresql': POSTGRES_INDEX, 'sqlite': SQLITE_INDEX}
+DROP = {'postgresql': POSTGRES_DROP, 'sqlite': SQLITE_DROP}
+
+
+def create_index(schema_editor, column):
+    for statement in INDEX.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement.format(column=column))
+
+
+def drop_index(schema_editor):
+    for statement in DROP.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    drop_index(schema_editor)
+
+
+def add_text_index(apps, schema_editor):
+    create_index(schema_editor, 'text')
+
+
+def add_normalized_index(apps, schema_editor):
+    create_index(schema_editor, 'normalized_text')
+
+
+def backfill_normalized(apps, schema_editor):
+    ''' Normalize the text of existing annotations and lines, in batches. '''
+    for model, field, normalized in [
+            ('Annotation', 'text', lambda text: normalize(text)[:800]),
+            ('AnnotatedLine', 'hypo_text', lambda hypo_text: normalize(' '.join(strings(hypo_text)))[:800])]:
+        Model = apps.get_model('api', model)
+        target = 'normalized_' + field
+        pending = Model.objects.order_by('pk').only('pk', field)
+        last = 0
+        while True:
+            batch = list(pending.filter(pk__gt=last)[:BATCH_SIZE])
+            if not batch:
+                break
+            for item in batch:
+                setattr(item, target, normalized(getattr(item, field)))
+            Model.objects.bulk_update(batch, [target])
+            last = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_annotation_search'),
+    ]
+
+    operations = [
+        # the search index moves from the text to the normalized text
+        migrations.RunPython(drop_search_index, add_text_index),
+        migrations.AddField(
+            model_name='annotatedline',
+            name='normalized_hypo_text',
+            field=models.CharField(blank=True, default='', editable=False, max_length=800),
+        ),
+        migrations.AddField(
+            model_name='annotation',
+            name='normalized_text',
+            field=models.CharField(blank=True, default='', editable=False, max_length=800),
+        ),
+        migrations.AddIndex(
+            model_name='annotatedline',
+            index=models.Index(fields=['normalized_hypo_text'], name='line_normalized_hypo_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='annotation',
+            index=models.Index(fields=['normalized_text'], name='annotation_normalized_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.RunPython(backfill_normalized, migrations.RunPython.noop),
+        migrations.RunPython(add_normalized_index, drop_search_index),
+    ]
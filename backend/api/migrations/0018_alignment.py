@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:48
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_normalized_text'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Alignment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=50)),
+                ('position', models.IntegerField(default=0)),
+                ('digest', models.CharField(max_length=40)),
+                ('rows', django.contrib.postgres.fields.jsonb.JSONField(default=list)),
+                ('modified', models.DateTimeField(auto_now=True)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alignments', to='api.book')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='alignment',
+            constraint=models.UniqueConstraint(fields=('book', 'key'), name='alignment_block_unique'),
+        ),
+    ]
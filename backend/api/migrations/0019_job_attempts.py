@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_alignment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+    ]
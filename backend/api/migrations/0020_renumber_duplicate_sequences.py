@@ -0,0 +1,59 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:11
+
+from django.db import migrations
+from django.db.models import Count
+
+GAP = 1024
+BATCH_SIZE = 1000
+
+
+def renumber(Annotation, AnnotatedLine, manuscript):
+    ''' Number the lines of a manuscript along their chains of next
+    lines, as 0008 does. Chains are ordered by the page and id of their
+    first line; lines in a cycle start from their lowest id.
+    '''
+    rows = AnnotatedLine.objects.filter(annotation__manuscript=manuscript).values_list(
+        'pk', 'previous_line', 'next_line', 'annotation__page')
+    following = {}
+    heads = []
+    for pk, previous_id, next_id, page in rows:
+        following[pk] = next_id
+        if previous_id is None:
+            heads.append((page, pk))
+    order = []
+    seen = set()
+    for _, pk in sorted(heads) + [(None, pk) for pk in sorted(following)]:
+        while pk in following and pk not in seen:
+            seen.add(pk)
+            order.append(pk)
+            pk = following[pk]
+    Annotation.objects.filter(manuscript=manuscript).update(sequence=None)
+    for start in range(0, len(order), BATCH_SIZE):
+        batch = [
+            Annotation(pk=pk, sequence=(start + index + 1) * GAP)
+            for index, pk in enumerate(order[start:start + BATCH_SIZE])
+        ]
+        Annotation.objects.bulk_update(batch, ['sequence'])
+
+
+def renumber_duplicates(apps, schema_editor):
+    ''' Renumber the manuscripts in which lines share a sequence,
+    so that sequences can be unique.
+    '''
+    Annotation = apps.get_model('api', 'Annotation')
+    AnnotatedLine = apps.get_model('api', 'AnnotatedLine')
+    duplicated = Annotation.objects.filter(sequence__isnull=False).order_by().values(
+        'manuscript', 'sequence').annotate(count=Count('pk')).filter(count__gt=1).values_list('manuscript', flat=True)
+    for manuscript in sorted(set(duplicated)):
+        renumber(Annotation, AnnotatedLine, manuscript)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_job_attempts'),
+    ]
+
+    operations = [
+        migrations.RunPython(renumber_duplicates, migrations.RunPython.noop),
+    ]
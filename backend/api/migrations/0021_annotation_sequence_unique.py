@@ -0,0 +1,22 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_renumber_duplicate_sequences'),
+    ]
+
+    operations = [
+        # the unique index takes the place of the plain one
+        migrations.AddConstraint(
+            model_name='annotation',
+            constraint=models.UniqueConstraint(fields=('manuscript', 'sequence'), name='annotation_sequence_unique'),
+        ),
+        migrations.RemoveIndex(
+            model_name='annotation',
+            name='annotation_sequence_idx',
+        ),
+    ]
@@ -1,6 +1,14 @@
-from django.db import models
+import time
+
+from django.db import connections, models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.contrib.postgres.fields import JSONField
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from .arabic import normalize, strings
+from .geometry import extent
 
 ''' The models associated wiht the khatt application.
 Most models define a "bounding box", i.e. the location (in pixels)
@@ -16,11 +24,20 @@ DIRECTION_CHOICES = [
     (RIGHT_TO_LEFT, 'Right-to-left'),
 ]
 
+CHAPTER = 'chapter'
+ASIDE = 'aside'
+ANNOTATED_LINE = 'annotated_line'
+ANNOTATION_TYPE_CHOICES = [
+    (CHAPTER, 'Chapter'),
+    (ASIDE, 'Aside'),
+    (ANNOTATED_LINE, 'Annotated line'),
+]
+
 class Book(models.Model):
     ''' A book is the virtual text, of which
     multiple manuscripts may exist.
     '''
-    title = models.CharField(max_length=400)
+    title = models.CharField(max_length=400, db_index=True)
     author = models.ForeignKey('Author', on_delete=models.PROTECT)
 
 
@@ -37,6 +54,8 @@ class Manuscript(models.Model):
     - date of the manuscript
     - text_direction
     - page_direction
+    - number of pages of the scan
+    - SHA-256 hash of the scan, by which it is stored (see scans.py)
     '''
     filepath = models.FileField(upload_to='manuscript_images/')
     editor = models.ForeignKey('Editor', on_delete=models.PROTECT, blank=True, null=True)
@@ -55,9 +74,94 @@ class Manuscript(models.Model):
         choices=DIRECTION_CHOICES,
         default=RIGHT_TO_LEFT,
     )
+    page_count = models.IntegerField(blank=True, null=True)
+    sha256 = models.CharField(max_length=64, blank=True, default='', db_index=True)
+
+
+# rows updated with an expression are derived again in batches
+BATCH_SIZE = 1000
+
+
+class DerivedQuerySet(models.QuerySet):
+    ''' Queryset of a model with fields derived from another field, which
+    save() keeps, and this queryset too, on bulk creates, bulk updates and
+    queryset updates. The model lists them in DERIVED, as tuples of the
+    field, the derived fields and the name of the method that sets them.
+    '''
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            for _, _, method in self.model.DERIVED:
+                getattr(obj, method)()
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs, fields = list(objs), list(fields)
+        for field, derived, method in self.model.DERIVED:
+            if field in fields and not set(derived) & set(fields):
+                for obj in objs:
+                    getattr(obj, method)()
+                fields += derived
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+    def update(self, **kwargs):
+        later = []
+        for field, derived, method in self.model.DERIVED:
+            if field not in kwargs or set(derived) & set(kwargs):
+                continue
+            if hasattr(kwargs[field], 'resolve_expression'):
+                later.append((field, derived, method))
+            else:
+                instance = self.model(**{field: kwargs[field]})
+                getattr(instance, method)()
+                kwargs.update((name, getattr(instance, name)) for name in derived)
+        if not later:
+            return super().update(**kwargs)
+        # the values of expressions are only known after the update
+        with transaction.atomic(using=self.db):
+            pks = list(self.values_list('pk', flat=True))
+            count = super().update(**kwargs)
+            fields = [field for field, _, _ in later]
+            for start in range(0, len(pks), BATCH_SIZE):
+                batch = list(self.model._base_manager.using(self.db).filter(
+                    pk__in=pks[start:start + BATCH_SIZE]).only('pk', *fields))
+                for obj in batch:
+                    for _, _, method in later:
+                        getattr(obj, method)()
+                self.model.objects.using(self.db).bulk_update(
+                    batch, [name for _, derived, _ in later for name in derived])
+        return count
+
+
+class Located(models.Model):
+    ''' Base of the models with a bounding box on a page.
+    The extent of the bounding box is kept in numeric fields, on every
+    write, so that what lies in a region of a page can be queried.
+    '''
+    min_x = models.FloatField(blank=True, null=True, editable=False)
+    min_y = models.FloatField(blank=True, null=True, editable=False)
+    max_x = models.FloatField(blank=True, null=True, editable=False)
+    max_y = models.FloatField(blank=True, null=True, editable=False)
 
+    objects = DerivedQuerySet.as_manager()
+    EXTENT = ['min_x', 'min_y', 'max_x', 'max_y']
+    DERIVED = [('bounding_box', EXTENT, 'update_extent')]
 
-class TextField(models.Model):
+    class Meta:
+        abstract = True
+
+    def update_extent(self):
+        self.min_x, self.min_y, self.max_x, self.max_y = extent(self.bounding_box)
+
+    def save(self, *args, **kwargs):
+        self.update_extent()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'bounding_box' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | set(self.EXTENT)
+        super().save(*args, **kwargs)
+
+
+class TextField(Located):
     ''' A text field occurs on a given page in a manuscript.
     It may be assigned to a given chapter.
     Within the text field, lines are marked.
@@ -66,8 +170,14 @@ class TextField(models.Model):
     page = models.IntegerField()
     bounding_box = JSONField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['manuscript', 'page', 'min_x', 'min_y', 'max_x', 'max_y'],
+                name='textfield_extent_idx'),
+        ]
 
-class Annotation(models.Model):
+
+class Annotation(Located):
     '''
     An annotation, which tracks
     - the page number in the file on which the annotation is marked
@@ -77,6 +187,12 @@ class Annotation(models.Model):
     - optional labels
     - the previous and next lines
     - optional research notes
+    - whether it is a chapter, aside or annotated line
+    - when it was created and last modified
+    - for lines, the position in the reading order of the manuscript
+    - the extent of the bounding box
+    - the normalized text, for search and comparison (see arabic.py),
+      up to the length of the text, which follows every write
     '''
     manuscript = models.ForeignKey('Manuscript', on_delete=models.PROTECT, related_name='annotations')
     page = models.IntegerField(default=1)
@@ -86,6 +202,59 @@ class Annotation(models.Model):
     research_note = models.CharField(max_length=800, default='')
     bounding_box = JSONField()
     complete = models.BooleanField(default=False)
+    annotation_type = models.CharField(
+        max_length=20,
+        choices=ANNOTATION_TYPE_CHOICES,
+        blank=True,
+        null=True,
+        db_index=True,
+    )
+    created = models.DateTimeField(auto_now_add=True)
+    modified = models.DateTimeField(auto_now=True)
+    # gapped, so that lines can be inserted without renumbering; see lines.py
+    sequence = models.BigIntegerField(blank=True, null=True)
+    normalized_text = models.CharField(max_length=800, blank=True, default='', editable=False)
+
+    DERIVED = Located.DERIVED + [('text', ['normalized_text'], 'update_normalized')]
+
+    class Meta:
+        indexes = [
+            # equal and prefix matches of the normalized text
+            models.Index(fields=['normalized_text'], name='annotation_normalized_idx',
+                opclasses=['varchar_pattern_ops']),
+            # annotations modified since a time, such as ?since= on the API
+            models.Index(fields=['modified', 'id'], name='annotation_modified_idx'),
+            # exports read complete annotations by modification
+            models.Index(fields=['modified', 'id'], name='annotation_complete_idx', condition=models.Q(complete=True)),
+            models.Index(fields=['manuscript', 'page', 'min_x', 'min_y', 'max_x', 'max_y'],
+                name='annotation_extent_idx'),
+        ]
+        constraints = [
+            # also the index of lines in reading order
+            models.UniqueConstraint(fields=['manuscript', 'sequence'], name='annotation_sequence_unique'),
+        ]
+
+    @staticmethod
+    def normalized(text):
+        # normalizing may lengthen the text, such as ligatures
+        return normalize(text)[:800]
+
+    def update_normalized(self):
+        self.normalized_text = self.normalized(self.text)
+
+    def save(self, *args, **kwargs):
+        self.update_normalized()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'text' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'normalized_text'}
+        super().save(*args, **kwargs)
+
+    def mark_as(self, annotation_type):
+        ''' Record which kind of annotation extends this one. '''
+        if self.annotation_type != annotation_type:
+            self.annotation_type = annotation_type
+            self.modified = timezone.now()
+            Annotation.objects.filter(pk=self.pk).update(annotation_type=annotation_type, modified=self.modified)
 
 
 class Chapter(models.Model):
@@ -98,12 +267,19 @@ class Chapter(models.Model):
     same_as = models.ForeignKey('self', related_name='corresponding', 
         on_delete=models.PROTECT, blank=True, null=True)
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if adding:
+            self.annotation.mark_as(CHAPTER)
+
 
 class AnnotatedLine(models.Model):
     ''' A line in a manuscript.
     It is an annotation within a text field,
     and also registers the previous and next lines,
-    as well as (optional) hypotext.
+    as well as (optional) hypotext, of which the text is
+    kept normalized (see arabic.py), up to the length of a line.
     '''
     annotation = models.OneToOneField('Annotation', on_delete=models.CASCADE, 
         primary_key=True, related_name = 'annotated_line')
@@ -112,6 +288,33 @@ class AnnotatedLine(models.Model):
     next_line = models.OneToOneField('self', related_name="next", on_delete=models.PROTECT,
         blank=True, null=True)
     hypo_text = JSONField(blank=True, null=True)
+    normalized_hypo_text = models.CharField(max_length=800, blank=True, default='', editable=False)
+
+    objects = DerivedQuerySet.as_manager()
+    DERIVED = [('hypo_text', ['normalized_hypo_text'], 'update_normalized')]
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['normalized_hypo_text'], name='line_normalized_hypo_idx',
+                opclasses=['varchar_pattern_ops']),
+        ]
+
+    @staticmethod
+    def normalized(hypo_text):
+        return normalize(' '.join(strings(hypo_text)))[:800]
+
+    def update_normalized(self):
+        self.normalized_hypo_text = self.normalized(self.hypo_text)
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        self.update_normalized()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'hypo_text' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'normalized_hypo_text'}
+        super().save(*args, **kwargs)
+        if adding:
+            self.annotation.mark_as(ANNOTATED_LINE)
 
 
 class Aside(models.Model):
@@ -122,14 +325,167 @@ class Aside(models.Model):
     annotation = models.OneToOneField('Annotation', 
         on_delete=models.CASCADE, primary_key=True)
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if adding:
+            self.annotation.mark_as(ASIDE)
+
+
+class NamedManager(models.Manager):
+    ''' Manager of a model that is identified by a unique name,
+    such as authors and editors, which are created when first named.
+    The ids of names are kept in memory, once they are committed, for
+    MAX_AGE seconds: names changed by this process are forgotten at once,
+    but those changed by other processes only when they expire.
+    '''
+    MAX_CACHED = 10000
+    MAX_AGE = 60
+
+    def __init__(self):
+        super().__init__()
+        self._ids = {}
+
+    def id_for(self, name):
+        ''' The id of the record with the given name, which is created
+        if there is none. Safe against concurrent creation of the same name.
+        '''
+        pk, expires = self._ids.get(name, (None, 0))
+        if time.monotonic() < expires:
+            return pk
+        pk = self._upsert(name)
+
+        def remember():
+            if len(self._ids) >= self.MAX_CACHED:
+                self._ids.clear()
+            self._ids[name] = pk, time.monotonic() + self.MAX_AGE
+        transaction.on_commit(remember, using=self.db)
+        return pk
+
+    def _upsert(self, name):
+        connection = connections[self.db]
+        if connection.vendor == 'postgresql' or (
+                connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 35)):
+            # existing rows are not written to; they are selected instead
+            table = connection.ops.quote_name(self.model._meta.db_table)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'INSERT INTO {0} (name) VALUES (%s) ON CONFLICT (name) DO NOTHING RETURNING id'.format(table),
+                    [name],
+                )
+                row = cursor.fetchone()
+                if row is None:
+                    cursor.execute('SELECT id FROM {0} WHERE name = %s'.format(table), [name])
+                    row = cursor.fetchone()
+                return row[0]
+        return self.get_or_create(name=name)[0].pk
+
+    def forget(self, pk):
+        for name, (known, _) in list(self._ids.items()):
+            if known == pk:
+                self._ids.pop(name, None)
+
+    def forget_all(self):
+        self._ids.clear()
+
 
 class Author(models.Model):
     ''' The author of the book.'''
-    name = models.CharField(max_length=100)
+    name = models.CharField(max_length=100, unique=True)
+
+    objects = NamedManager()
 
 
 class Editor(models.Model):
     ''' The editor of a manuscript. '''
-    name = models.CharField(max_length=100)
+    name = models.CharField(max_length=100, unique=True)
+
+    objects = NamedManager()
+
+
+@receiver([post_save, post_delete], sender=Author)
+@receiver([post_save, post_delete], sender=Editor)
+def forget_name(sender, instance, **kwargs):
+    ''' Names may be changed or deleted, for instance in the admin. '''
+    sender.objects.forget(instance.pk)
+
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+JOB_STATUS_CHOICES = [
+    (PENDING, 'Pending'),
+    (RUNNING, 'Running'),
+    (DONE, 'Done'),
+    (FAILED, 'Failed'),
+]
+
+
+class Job(models.Model):
+    ''' A unit of background work, such as processing an uploaded scan.
+    Jobs are queued in the database and run by the run_jobs command;
+    see jobs.py. Fields:
+    - the kind of job, naming the task to run
+    - the manuscript it applies to
+    - arguments of the task
+    - status, and the error if the job failed
+    - when it was created, started and finished
+    - how many times it was started
+    '''
+    kind = models.CharField(max_length=50)
+    manuscript = models.ForeignKey('Manuscript', on_delete=models.CASCADE, related_name='jobs')
+    arguments = JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=JOB_STATUS_CHOICES, default=PENDING)
+    error = models.TextField(blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+    attempts = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='job_queue_idx'),
+        ]
+
+
+class Upload(models.Model):
+    ''' A scan that is uploaded in chunks, which may be resumed
+    after an interruption; see uploads.py. Fields:
+    - the name and length (in bytes) of the file
+    - the number of bytes received so far
+    - the expected SHA-256 checksum (hex), if the client gave one
+    - the fields of the manuscript to create, once the file is complete
+    - the manuscript created from the upload
+    '''
+    filename = models.CharField(max_length=255)
+    length = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    checksum = models.CharField(max_length=64, blank=True, default='')
+    metadata = JSONField(default=dict)
+    manuscript = models.OneToOneField('Manuscript', on_delete=models.SET_NULL,
+        blank=True, null=True, related_name='upload')
+    created = models.DateTimeField(auto_now_add=True)
+
+
+class Alignment(models.Model):
+    ''' The collation of a block of the manuscripts of a book: the lines
+    between corresponding chapters, aligned across the manuscripts;
+    see collation.py. Fields:
+    - the book, and the key and position of the block in the book
+    - a digest of the lines that were aligned, by which blocks that
+      did not change are not aligned again
+    - the rows of the alignment, with the variant readings of each line
+    - when it was last aligned
+    '''
+    book = models.ForeignKey('Book', on_delete=models.CASCADE, related_name='alignments')
+    key = models.CharField(max_length=50)
+    position = models.IntegerField(default=0)
+    digest = models.CharField(max_length=40)
+    rows = JSONField(default=list)
+    modified = models.DateTimeField(auto_now=True)
 
-    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'key'], name='alignment_block_unique'),
+        ]
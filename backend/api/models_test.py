@@ -0,0 +1,133 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+from django.db import connection
+from django.db.models import F, Value
+from django.db.models.functions import Concat
+import pytest
+
+from .arabic import normalize
+from .models import Annotation, AnnotatedLine, Author, Editor, TextField
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_id_for():
+    threads = 16
+    barrier = threading.Barrier(threads)
+
+    def name_author(_):
+        try:
+            barrier.wait()
+            return Author.objects.id_for('Ibn Khaldun')
+        finally:
+            connection.close()
+
+    try:
+        with ThreadPoolExecutor(threads) as pool:
+            ids = set(pool.map(name_author, range(threads)))
+        assert len(ids) == 1
+        assert list(Author.objects.values_list('pk', 'name')) == [(ids.pop(), 'Ibn Khaldun')]
+    finally:
+        Author.objects.forget_all()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_id_for_cache(django_assert_num_queries):
+    try:
+        with django_assert_num_queries(1):
+            editor = Editor.objects.id_for('Quatremère')
+        with django_assert_num_queries(0):
+            assert Editor.objects.id_for('Quatremère') == editor
+
+        Editor.objects.filter(pk=editor).update(name='De Slane')
+        Editor.objects.get(pk=editor).save()
+        with django_assert_num_queries(1):
+            assert Editor.objects.id_for('Quatremère') != editor
+    finally:
+        Editor.objects.forget_all()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_id_for_cache_expires(django_assert_num_queries, monkeypatch):
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now)
+    try:
+        editor = Editor.objects.id_for('Quatremère')
+        # another process renames the editor, which this one does not see
+        Editor.objects.filter(pk=editor).update(name='De Slane')
+        with django_assert_num_queries(0):
+            assert Editor.objects.id_for('Quatremère') == editor
+
+        now += Editor.objects.MAX_AGE
+        with django_assert_num_queries(1):
+            assert Editor.objects.id_for('Quatremère') != editor
+    finally:
+        Editor.objects.forget_all()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_id_for_existing_name(django_assert_max_num_queries):
+    author = Author.objects.create(name='Ibn Battuta')
+    try:
+        with django_assert_max_num_queries(2):
+            assert Author.objects.id_for('Ibn Battuta') == author.pk
+        assert Author.objects.count() == 1
+    finally:
+        Author.objects.forget_all()
+
+
+def test_normalized_text(manuscript):
+    annotation = Annotation.objects.create(manuscript=manuscript, text='قَالَ  أبو', bounding_box={})
+    assert annotation.normalized_text == 'قال ابو'
+    annotation.text = 'إلى'
+    annotation.save(update_fields=['text'])
+    assert Annotation.objects.get(pk=annotation.pk).normalized_text == 'الي'
+
+    line = AnnotatedLine.objects.create(annotation=annotation, hypo_text=[{'text': 'مُقدّمة'}, 'الكتاب'])
+    assert AnnotatedLine.objects.get(pk=line.pk).normalized_hypo_text == 'مقدمه الكتاب'
+
+    # ligatures are longer once normalized, but are cut to the length of the text
+    annotation.text = 'ﷺ' * 800
+    annotation.save()
+    assert Annotation.objects.get(pk=annotation.pk).normalized_text == normalize('ﷺ' * 800)[:800]
+
+
+def test_normalized_text_follows_bulk_writes(manuscript):
+    Annotation.objects.bulk_create([
+        Annotation(manuscript=manuscript, text=text, bounding_box={}) for text in ['أبو', 'إلى']
+    ])
+    annotations = Annotation.objects.filter(manuscript=manuscript).order_by('pk')
+    created = list(annotations)
+    assert list(annotations.values_list('normalized_text', flat=True)) == ['ابو', 'الي']
+
+    annotations.filter(pk=created[0].pk).update(text='قَالَ')
+    assert list(annotations.values_list('normalized_text', flat=True)) == ['قال', 'الي']
+
+    annotations.update(text=Concat(F('text'), Value(' أبو')))
+    assert list(annotations.values_list('normalized_text', flat=True)) == ['قال ابو', 'الي ابو']
+
+    created[1].text = 'ﷺ' * 800
+    Annotation.objects.bulk_update(created[1:], ['text'])
+    assert annotations.last().normalized_text == normalize('ﷺ' * 800)[:800]
+
+    line = AnnotatedLine.objects.create(annotation=created[0])
+    AnnotatedLine.objects.filter(pk=line.pk).update(hypo_text=['مُقدّمة'])
+    assert AnnotatedLine.objects.get(pk=line.pk).normalized_hypo_text == 'مقدمه'
+
+
+def test_extent_follows_bulk_writes(manuscript):
+    box = {'x': 10, 'y': 20, 'width': 30, 'height': 40}
+    TextField.objects.bulk_create([TextField(manuscript=manuscript, page=1, bounding_box=box)])
+    Annotation.objects.bulk_create([Annotation(manuscript=manuscript, page=1, bounding_box=box)])
+    extent = ('min_x', 'min_y', 'max_x', 'max_y')
+    for model in [TextField, Annotation]:
+        assert list(model.objects.values_list(*extent)) == [(10, 20, 40, 60)]
+
+    Annotation.objects.update(bounding_box={'x': 0, 'y': 0, 'width': 5, 'height': 5})
+    assert list(Annotation.objects.values_list(*extent)) == [(0, 0, 5, 5)]
+
+    fields = list(TextField.objects.all())
+    fields[0].bounding_box = {'x': 1, 'y': 2, 'width': 3, 'height': 4}
+    TextField.objects.bulk_update(fields, ['bounding_box'])
+    assert list(TextField.objects.values_list(*extent)) == [(1, 2, 4, 6)]
@@ -0,0 +1,61 @@
+''' Pagination of the lists of the API, counts and sparse fieldsets.
+Lists are paginated with a cursor on the id, so that each page
+is an index range scan, however far into the list it is.
+'''
+from collections import OrderedDict
+
+from rest_framework.pagination import CursorPagination
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+from rest_framework.serializers import ListSerializer
+
+from .filters import boolean_param
+
+
+class IdCursorPagination(CursorPagination):
+    ordering = 'pk'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class CountMixin:
+    ''' Answer a list requested with ?count=1 with the number of items only. '''
+    def list(self, request, *args, **kwargs):
+        if boolean_param(request.query_params, 'count'):
+            return Response({'count': self.filter_queryset(self.get_queryset()).count()})
+        return super().list(request, *args, **kwargs)
+
+
+def requested_fields(request):
+    ''' The names of the fields requested with ?fields=id,complete,
+    or None if all fields are requested.
+    '''
+    if request is None or request.method not in SAFE_METHODS:
+        return None
+    fields = request.query_params.get('fields')
+    if not fields:
+        return None
+    return {name.strip() for name in fields.split(',')}
+
+
+class SparseFieldsMixin:
+    ''' Restrict the fields of the serializer of a view to those
+    requested with ?fields=. Nested serializers have all their fields.
+    '''
+    def requested_fields(self):
+        view = self.context.get('view')
+        if view is None or not isinstance(self, view.get_serializer_class()):
+            return None
+        parent = self.parent
+        if isinstance(parent, ListSerializer):
+            parent = parent.parent
+        if parent is not None:
+            return None
+        return requested_fields(self.context.get('request'))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested = self.requested_fields()
+        if requested is None:
+            return fields
+        return OrderedDict((name, field) for name, field in fields.items() if name in requested)
@@ -0,0 +1,38 @@
+''' Renderers for the formats of the annotation export.
+Exports are streamed by the view itself, so these renderers
+take part in content negotiation (?format= or Accept),
+and only render error responses, as JSON.
+'''
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+
+class ExportRenderer(BaseRenderer):
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data).encode()
+
+
+class CSVRenderer(ExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class JSONLinesRenderer(ExportRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'jsonl'
+
+
+class ArrowRenderer(ExportRenderer):
+    media_type = 'application/vnd.apache.arrow.stream'
+    format = 'arrow'
+
+
+class ParquetRenderer(ExportRenderer):
+    media_type = 'application/vnd.apache.parquet'
+    format = 'parquet'
+
+
+EXPORT_RENDERERS = [CSVRenderer, JSONLinesRenderer, ArrowRenderer, ParquetRenderer]
@@ -0,0 +1,45 @@
+''' Storage of manuscript scans, keyed by the SHA-256 hash of their
+content: a scan that is uploaded again, for another manuscript, is
+stored once, and so are the images derived from it (see images.py).
+'''
+from hashlib import sha256
+import os
+
+from django.core.files.storage import default_storage
+
+
+def content_path(digest, filename):
+    ''' Path in the storage of a scan with the given hash.
+    The extension of the uploaded file is kept, as it tells the format.
+    '''
+    extension = os.path.splitext(filename)[1].lower()
+    return 'manuscript_images/{}/{}{}'.format(digest[:2], digest, extension)
+
+
+def content_key(manuscript):
+    ''' Key of the scan of a manuscript, for derived images and caches.
+    Scans that could not be hashed fall back to the manuscript id.
+    '''
+    return manuscript.sha256 or 'manuscript-{}'.format(manuscript.pk)
+
+
+def file_hash(scan):
+    digest = sha256()
+    scan.seek(0)
+    for chunk in scan.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def store(scan, digest=None):
+    ''' Save an uploaded scan under the hash of its content, unless an
+    identical scan is stored already. The hash is computed if not given.
+    Returns the path of the scan in the storage, and its hash.
+    '''
+    digest = digest or file_hash(scan)
+    path = content_path(digest, scan.name)
+    if not default_storage.exists(path):
+        scan.seek(0)
+        # a concurrent upload of the same scan may just have taken the path
+        path = default_storage.save(path, scan)
+    return path, digest
@@ -0,0 +1,210 @@
+''' Full-text search of annotations: their text, label and research note.
+The text is indexed in its normalized form (see arabic.py), and each
+word is searched for both as written and normalized, so that spelling
+variants match in the text, and the label and note match as written.
+Snippets show the fields as written, with the matched words marked.
+The index is kept by the database itself, so that it follows every
+write, including bulk creates and queryset updates, which keep the
+normalized text as well (see models.DerivedQuerySet):
+- on PostgreSQL, a GIN index on the weighted tsvector of the three
+  fields, in the text search configuration 'khatt', which is a copy
+  of the Arabic configuration where the server has it
+- on SQLite, an FTS5 table over api_annotation, kept by triggers
+Both are created by migrations 0016 and 0017.
+Other databases fall back to a scan with icontains.
+'''
+from html import escape
+from itertools import chain
+import string
+
+from django.db import connection, connections
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from .arabic import normalize
+from .models import Annotation
+
+MAX_RESULTS = 100
+# the number of words in a snippet, and before the first match in it
+SNIPPET_WORDS = 16
+SNIPPET_CONTEXT = 4
+# stripped from words when they are compared to the search words
+PUNCTUATION = string.punctuation + '،؛؟«»…'
+
+POSTGRES_VECTOR = '''(
+    setweight(to_tsvector('khatt', {table}.normalized_text), 'A') ||
+    setweight(to_tsvector('khatt', {table}.label), 'B') ||
+    setweight(to_tsvector('khatt', {table}.research_note), 'C')
+)'''
+
+POSTGRES_QUERY = '''
+SELECT a.id, ts_rank({vector}, query) AS rank
+FROM api_annotation a, {tsquery} query
+WHERE {vector} @@ query {restrict}
+ORDER BY rank DESC, a.id
+LIMIT %s OFFSET %s
+'''
+
+SQLITE_TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS api_annotation_search_insert AFTER INSERT ON api_annotation BEGIN
+        INSERT INTO api_annotation_search (rowid, normalized_text, label, research_note)
+        VALUES (new.id, new.normalized_text, new.label, new.research_note);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS api_annotation_search_delete AFTER DELETE ON api_annotation BEGIN
+        INSERT INTO api_annotation_search (api_annotation_search, rowid, normalized_text, label, research_note)
+        VALUES ('delete', old.id, old.normalized_text, old.label, old.research_note);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS api_annotation_search_update
+    AFTER UPDATE OF normalized_text, label, research_note ON api_annotation BEGIN
+        INSERT INTO api_annotation_search (api_annotation_search, rowid, normalized_text, label, research_note)
+        VALUES ('delete', old.id, old.normalized_text, old.label, old.research_note);
+        INSERT INTO api_annotation_search (rowid, normalized_text, label, research_note)
+        VALUES (new.id, new.normalized_text, new.label, new.research_note);
+    END''',
+]
+
+# bm25 is lower for better matches; the weights follow those of PostgreSQL
+SQLITE_QUERY = '''
+SELECT a.id, -bm25(api_annotation_search, 10.0, 4.0, 1.0) AS rank
+FROM api_annotation_search JOIN api_annotation a ON a.id = api_annotation_search.rowid
+WHERE api_annotation_search MATCH %s {restrict}
+ORDER BY rank DESC, a.id
+LIMIT %s OFFSET %s
+'''
+
+
+def restore_triggers(using, **kwargs):
+    ''' SQLite migrations that alter api_annotation copy it to a new
+    table, which loses the triggers; add them back after migrating.
+    The rows keep their ids, so the index itself stays valid.
+    '''
+    target = connections[using]
+    if target.vendor != 'sqlite':
+        return
+    with target.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'api_annotation_search'")
+        if cursor.fetchone():
+            for statement in SQLITE_TRIGGERS:
+                cursor.execute(statement)
+
+
+def forms(terms):
+    ''' The forms of each word to search for: as written and normalized. '''
+    words = []
+    for word in terms.split():
+        alternatives = sorted({word, normalize(word)} - {''})
+        if alternatives:
+            words.append(alternatives)
+    return words
+
+
+def tsquery(words):
+    ''' A PostgreSQL query matching all of the words, in any of their forms. '''
+    return ' && '.join(
+        '({})'.format(' || '.join(["plainto_tsquery('khatt', %s)"] * len(alternatives)))
+        for alternatives in words
+    )
+
+
+def fts_query(words):
+    ''' An FTS5 query matching all of the words, in any of their forms,
+    which are quoted, so that the syntax of FTS5 queries is not interpreted.
+    '''
+    return ' AND '.join(
+        '({})'.format(' OR '.join('"{}"'.format(form.replace('"', '""')) for form in alternatives))
+        for alternatives in words
+    )
+
+
+def snippet(annotation, words):
+    ''' HTML of the words around the first match in the text, label or
+    research note of an annotation, as written, with the words that match
+    any form of the search words in <mark> tags.
+    '''
+    searched = {normalize(form) for alternatives in words for form in alternatives}
+    fields = [value.split() for value in (annotation.text, annotation.label, annotation.research_note) if value.strip()]
+    if not fields:
+        return ''
+    marked = [[normalize(word).strip(PUNCTUATION) in searched for word in field] for field in fields]
+    # the first field with a match, or else the first field
+    index = next((index for index, found in enumerate(marked) if any(found)), 0)
+    field, found = fields[index], marked[index]
+    first = found.index(True) if any(found) else 0
+    start = max(0, min(first - SNIPPET_CONTEXT, len(field) - SNIPPET_WORDS))
+    stop = start + SNIPPET_WORDS
+    html = ' '.join(
+        '<mark>{}</mark>'.format(escape(word)) if match else escape(word)
+        for word, match in zip(field[start:stop], found[start:stop])
+    )
+    return ('… ' if start else '') + html + (' …' if stop < len(field) else '')
+
+
+def matches(terms, queryset, limit, offset=0):
+    ''' The ids of the annotations in queryset that match terms,
+    best match first, with their rank.
+    '''
+    words = forms(terms)
+    if not words:
+        return []
+    restrict, restrict_params = '', []
+    if queryset.query.has_filters():
+        sql, restrict_params = queryset.values('pk').query.sql_with_params()
+        restrict = 'AND a.id IN ({})'.format(sql)
+        restrict_params = list(restrict_params)
+    if connection.vendor == 'postgresql':
+        query = POSTGRES_QUERY.format(
+            vector=POSTGRES_VECTOR.format(table='a'), tsquery=tsquery(words), restrict=restrict)
+        params = list(chain(*words)) + restrict_params + [limit, offset]
+    elif connection.vendor == 'sqlite':
+        query = SQLITE_QUERY.format(restrict=restrict)
+        params = [fts_query(words)] + restrict_params + [limit, offset]
+    else:
+        terms = normalize(terms)
+        found = queryset.filter(
+            Q(normalized_text__icontains=terms) | Q(label__icontains=terms) | Q(research_note__icontains=terms)
+        ).order_by('pk').values_list('pk', flat=True)[offset:offset + limit]
+        return [(pk, 0.0) for pk in found]
+    with connection.cursor() as cursor:
+        cursor.execute(query, params)
+        return cursor.fetchall()
+
+
+def search(terms, queryset=None, limit=20, offset=0):
+    ''' Search annotations (those of queryset, if given) for all words
+    of terms. Returns the matches, best first, in the context of their
+    manuscript and page, and for lines, their number in the reading
+    order of the manuscript. The snippets are HTML, with the matched
+    words in <mark> tags.
+    '''
+    if queryset is None:
+        queryset = Annotation.objects.all()
+    found = matches(terms, queryset, min(limit, MAX_RESULTS), offset)
+    words = forms(terms)
+    # the number of a line is one more than that of the lines before it,
+    # which are counted on the index of (manuscript, sequence)
+    lines_before = Annotation.objects.filter(
+        manuscript=OuterRef('manuscript'), sequence__lt=OuterRef('sequence'),
+    ).order_by().values('manuscript').annotate(count=Count('pk')).values('count')
+    annotations = Annotation.objects.select_related('manuscript').annotate(
+        lines_before=Coalesce(Subquery(lines_before), 0),
+    ).in_bulk([pk for pk, _ in found])
+    results = []
+    for pk, rank in found:
+        annotation = annotations.get(pk)
+        if annotation is None:
+            continue
+        results.append({
+            'id': pk,
+            'rank': rank,
+            'snippet': snippet(annotation, words),
+            'book': annotation.manuscript.book_id,
+            'manuscript': annotation.manuscript_id,
+            'manuscript_title': annotation.manuscript.title,
+            'page': annotation.page,
+            'line': annotation.lines_before + 1 if annotation.sequence is not None else None,
+            'annotation_type': annotation.annotation_type,
+            'text': annotation.text,
+            'label': annotation.label,
+            'research_note': annotation.research_note,
+        })
+    return results
@@ -0,0 +1,92 @@
+from django.db import connection
+
+from .conftest import add_annotations
+from .models import Annotation, Manuscript
+from .search import forms, fts_query, restore_triggers, search, snippet
+
+
+def test_fts_query():
+    assert forms('كتاب  "العبر" OR') == [['كتاب'], ['"العبر"'], ['OR', 'or']]
+    assert fts_query(forms('"أخبار"')) == '("""أخبار""" OR """اخبار""")'
+
+
+def test_search(manuscript):
+    lines = add_annotations(manuscript, lines=3)
+    first, second, third = [line.annotation for line in lines]
+    first.text = 'في أخبار العرب والعجم'
+    second.research_note = 'أخبار <b>'
+    third.text = 'والبربر'
+    for number, annotation in enumerate(lines, 1):
+        annotation = annotation.annotation
+        annotation.sequence = number * 1024
+        annotation.save()
+
+    results = search('أخبار')
+    # matches in the text rank above those in research notes
+    assert [result['id'] for result in results] == [first.pk, second.pk]
+    assert results[0]['line'] == 1 and results[1]['line'] == 2
+    assert results[0]['manuscript_title'] == 'Paris' and results[0]['page'] == 1
+    # snippets are of the text as written
+    assert results[0]['snippet'] == 'في <mark>أخبار</mark> العرب والعجم'
+    assert '&lt;b&gt;' in results[1]['snippet']
+
+    assert [result['id'] for result in search('أخبار العرب')] == [first.pk]
+    assert search('أخبار', Annotation.objects.filter(research_note='')) == [results[0]]
+    assert search('"') == []
+
+    # spelling variants match in the text, research notes as written
+    assert [result['id'] for result in search('اَخْبــار')] == [first.pk]
+    assert search('اَخْبــار')[0]['snippet'] == 'في <mark>أخبار</mark> العرب والعجم'
+
+
+def test_snippet(manuscript):
+    words = ['كلمة{}'.format(number) for number in range(30)]
+    annotation = Annotation(manuscript=manuscript, text=' '.join(words), label='كلمة20')
+    assert snippet(annotation, forms('كلمة10')) == '… {} <mark>كلمة10</mark> {} …'.format(
+        ' '.join(words[6:10]), ' '.join(words[11:22]))
+    assert snippet(annotation, forms('كلمة29')).endswith('كلمة28 <mark>كلمة29</mark>')
+    # no match in the text, but in the label
+    annotation.text = 'كلمة، أخرى'
+    assert snippet(annotation, forms('كلمة20')) == '<mark>كلمة20</mark>'
+    # punctuation is not part of the word
+    assert snippet(annotation, forms('كلمه')) == '<mark>كلمة،</mark> أخرى'
+
+
+def test_line_numbers(manuscript, django_assert_num_queries):
+    other = Manuscript.objects.create(
+        filepath='manuscript_images/other.jpg', editor=manuscript.editor, book=manuscript.book, title='Cairo')
+    for current in (manuscript, other):
+        for number in range(1, 4):
+            Annotation.objects.create(manuscript=current, text='سطر {}'.format(number),
+                sequence=number * 1024, bounding_box={})
+    Annotation.objects.create(manuscript=other, text='سطر', bounding_box={})
+    # the matches, and their annotations with the numbers of the lines
+    with django_assert_num_queries(2):
+        results = search('سطر', limit=10)
+    assert sorted((result['manuscript_title'], result['text'], result['line']) for result in results) == [
+        ('Cairo', 'سطر', None), ('Cairo', 'سطر 1', 1), ('Cairo', 'سطر 2', 2), ('Cairo', 'سطر 3', 3),
+        ('Paris', 'سطر 1', 1), ('Paris', 'سطر 2', 2), ('Paris', 'سطر 3', 3),
+    ]
+
+
+def test_index_follows_writes(manuscript):
+    Annotation.objects.bulk_create([Annotation(manuscript=manuscript, text='مقدمة', bounding_box={})])
+    annotation = Annotation.objects.get(text='مقدمة')
+    assert [result['id'] for result in search('مقدمة')] == [annotation.pk]
+
+    Annotation.objects.filter(pk=annotation.pk).update(text='خاتمة')
+    assert search('مقدمة') == []
+    assert [result['id'] for result in search('خاتمة')] == [annotation.pk]
+
+    annotation.delete()
+    assert search('خاتمة') == []
+
+
+def test_restore_triggers(manuscript):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DROP TRIGGER api_annotation_search_insert')
+    restore_triggers(using='default')
+    Annotation.objects.create(manuscript=manuscript, text='تاريخ', bounding_box={})
+    assert len(search('تاريخ')) == 1
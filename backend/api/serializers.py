@@ -1,19 +1,32 @@
 from itertools import chain
 
+from django.db import connection, transaction
+
 from rest_framework import serializers
-from .models import Annotation, AnnotatedLine, Aside, Author, Book, Chapter, Editor, Manuscript, TextField
+from rest_framework.reverse import reverse
+from . import scans
+from .lines import lock, place, place_line, touch
+from .pagination import SparseFieldsMixin
+from .models import (
+    ANNOTATED_LINE, Alignment, Annotation, AnnotatedLine, Aside, Author, Book, Chapter, Editor, Job, Manuscript,
+    TextField, Upload,
+)
 
 
 class AuthorSerializer(serializers.ModelSerializer):
     class Meta:
         model = Author
         fields = ['name']
+        # existing names are looked up on create
+        extra_kwargs = {'name': {'validators': []}}
 
 
 class EditorSerializer(serializers.ModelSerializer):
     class Meta:
         model = Editor
         fields = ['name']
+        # existing names are looked up on create
+        extra_kwargs = {'name': {'validators': []}}
     
     def to_representation(self, instance):
         return {
@@ -21,7 +34,7 @@ class EditorSerializer(serializers.ModelSerializer):
         }
         
 
-class BookSerializer(serializers.ModelSerializer):
+class BookSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     author = AuthorSerializer()
 
     class Meta:
@@ -29,74 +42,66 @@ class BookSerializer(serializers.ModelSerializer):
         fields = ['title', 'author']
     
     def to_representation(self, instance):
-        manuscripts = instance.manuscript_set
-        manuscripts_serialized = ManuscriptSerializer(manuscripts, many=True).data
-        return {
+        requested = self.requested_fields()
+        representation = {
             'id': instance.id,
             'title': instance.title,
             'author': instance.author.name,
-            'manuscripts': manuscripts_serialized
         }
+        if requested is None or 'manuscripts' in requested:
+            manuscripts = instance.manuscript_set
+            representation['manuscripts'] = ManuscriptSerializer(manuscripts, many=True, context=self.context).data
+        if requested is None:
+            return representation
+        return {name: value for name, value in representation.items() if name in requested}
     
     def create(self, validated_data):
-        author_data = validated_data.pop('author')
-        try:
-            author = Author.objects.get(name=author_data['name'])
-        except Exception:
-            author = Author.objects.create(**author_data)
-        return Book.objects.create(author=author, **validated_data)
+        author = Author.objects.id_for(validated_data.pop('author')['name'])
+        return Book.objects.create(author_id=author, **validated_data)
 
 
 class AnnotationSerializerShort(serializers.ModelSerializer):
     ''' Serialize the id of an annotation,
-    and whether it is complete.
+    whether it is complete, and its type.
     '''
     class Meta:
         model = Annotation
-        fields = ['id', 'complete']
-
-    def to_representation(self, instance):
-        try:
-            instance.chapter
-            annotation_type = 'chapter'
-        except:
-            try:
-                instance.aside
-                annotation_type = 'aside'
-            except:
-                try:
-                    instance.annotated_line
-                    annotation_type = 'annotated_line'
-                except:
-                    annotation_type = None
-        return {
-            'id': instance.id,
-            'complete': instance.complete,
-            'annotation_type': annotation_type
-        }
+        fields = ['id', 'complete', 'annotation_type']
 
 
-class ManuscriptSerializer(serializers.ModelSerializer):
+class ManuscriptSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     editor = EditorSerializer()
     book = serializers.SlugRelatedField(
         queryset=Book.objects.all(),
         slug_field="title")
     annotations = AnnotationSerializerShort(many=True, read_only=True)
+    thumbnail = serializers.SerializerMethodField()
 
     class Meta:
         model = Manuscript
         fields = '__all__'
-    
+        read_only_fields = ['page_count', 'sha256']
+
+    def get_thumbnail(self, instance):
+        ''' The URL of the thumbnail of the first page. '''
+        return reverse('manuscript-thumbnail', args=[instance.pk, 1], request=self.context.get('request'))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # the scan is stored by its hash on create, and its pages and
+        # images derived from it; it is not replaced afterwards
+        if self.instance is not None and 'filepath' in fields:
+            fields['filepath'].read_only = True
+        return fields
+
     def create(self, validated_data):
-        editor_data = validated_data.pop('editor')
-        try:
-            editor = Editor.objects.get(name=editor_data['name'])
-        except Exception:
-            editor = Editor.objects.create(**editor_data)
-        return Manuscript.objects.create(editor=editor, **validated_data)
+        validated_data['filepath'], validated_data['sha256'] = scans.store(
+            validated_data['filepath'], validated_data.get('sha256'))
+        editor = Editor.objects.id_for(validated_data.pop('editor')['name'])
+        return Manuscript.objects.create(editor_id=editor, **validated_data)
 
 
-class AnnotationSerializer(serializers.ModelSerializer):
+class AnnotationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     annotator = serializers.PrimaryKeyRelatedField(
         read_only=True
     )
@@ -107,9 +112,10 @@ class AnnotationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Annotation
         fields = '__all__'
+        read_only_fields = ['annotation_type', 'sequence']
 
 
-class AnnotatedLineSerializer(serializers.ModelSerializer):
+class AnnotatedLineSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     ''' Serialize an annotated line, extending the annotation model.
     '''
     previous_line = serializers.PrimaryKeyRelatedField(queryset=AnnotatedLine.objects.all(), required=False, allow_null=True)
@@ -124,11 +130,117 @@ class AnnotatedLineSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         annotation_data = validated_data.pop('annotation')
         manuscript = Manuscript.objects.get(pk=annotation_data.pop('manuscript'))
+        annotation_data['annotation_type'] = ANNOTATED_LINE
         annotation = Annotation.objects.create(manuscript=manuscript, **annotation_data)
+        # saving the line places it; see lines.py
         return AnnotatedLine.objects.create(annotation=annotation)
 
+    def update(self, instance, validated_data):
+        line = super().update(instance, validated_data)
+        if 'previous_line' in validated_data or 'next_line' in validated_data:
+            touch([line.pk])
+            for linked in [line, line.previous_line, line.next_line]:
+                if linked:
+                    place_line(linked)
+        return line
+
+
+class ChapterSerializer(serializers.ModelSerializer):
+    annotation = AnnotationSerializer(read_only=True)
 
-class TextFieldSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Chapter
+        fields = ['annotation', 'same_as']
+
+
+class AsideSerializer(serializers.ModelSerializer):
+    annotation = AnnotationSerializer(read_only=True)
+
+    class Meta:
+        model = Aside
+        fields = ['annotation']
+
+
+class LineSerializer(serializers.ModelSerializer):
+    ''' Serialize the annotation of a line created in bulk.
+    '''
+    class Meta:
+        model = Annotation
+        fields = ['bounding_box', 'text', 'label', 'research_note']
+
+
+class BulkAnnotatedLineSerializer(serializers.Serializer):
+    ''' Create consecutive lines on a page of a manuscript at once.
+    The lines are linked in the given order, and inserted after
+    previous_line if given.
+    '''
+    manuscript = serializers.PrimaryKeyRelatedField(queryset=Manuscript.objects.all())
+    page = serializers.IntegerField()
+    previous_line = serializers.PrimaryKeyRelatedField(
+        queryset=AnnotatedLine.objects.select_related('annotation'), required=False, allow_null=True)
+    lines = LineSerializer(many=True, allow_empty=False)
+
+    def validate(self, data):
+        previous = data.get('previous_line')
+        if previous and previous.annotation.manuscript_id != data['manuscript'].pk:
+            raise serializers.ValidationError(
+                {'previous_line': 'Line belongs to another manuscript.'})
+        return data
+
+    def create(self, validated_data):
+        ''' Create the lines in a single transaction.
+        Returns the ids of the created lines, in order.
+        '''
+        manuscript = validated_data['manuscript']
+        previous = validated_data.get('previous_line')
+        with transaction.atomic():
+            # concurrent insertions into a manuscript are numbered in turn
+            lock(manuscript.pk)
+            following_id = None
+            if previous:
+                following_id = AnnotatedLine.objects.select_for_update().filter(
+                    pk=previous.pk).values_list('next_line', flat=True).get()
+                # unlink first, as the new lines take their places in the chain
+                AnnotatedLine.objects.filter(pk=previous.pk).update(next_line=None)
+                AnnotatedLine.objects.filter(pk=following_id).update(previous_line=None)
+
+            annotations = [
+                Annotation(
+                    manuscript=manuscript,
+                    page=validated_data['page'],
+                    annotation_type=ANNOTATED_LINE,
+                    **line
+                )
+                for line in validated_data['lines']
+            ]
+            if connection.features.can_return_rows_from_bulk_insert:
+                Annotation.objects.bulk_create(annotations)
+            else:
+                for annotation in annotations:
+                    annotation.save()
+            ids = [annotation.pk for annotation in annotations]
+
+            chain = [previous.pk if previous else None] + ids + [following_id]
+            AnnotatedLine.objects.bulk_create([
+                AnnotatedLine(
+                    annotation=annotation,
+                    previous_line_id=chain[index],
+                    next_line_id=chain[index + 2],
+                )
+                for index, annotation in enumerate(annotations)
+            ])
+            if previous:
+                AnnotatedLine.objects.filter(pk=previous.pk).update(next_line=ids[0])
+            if following_id:
+                AnnotatedLine.objects.filter(pk=following_id).update(previous_line=ids[-1])
+            if previous:
+                touch([previous.pk, following_id])
+            place(manuscript.pk, ids, previous.pk if previous else None, following_id)
+            Manuscript.objects.filter(pk=manuscript.pk).update(currently_annotating=ids[0])
+        return ids
+
+
+class TextFieldSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     manuscript = serializers.PrimaryKeyRelatedField(queryset=Manuscript.objects.all())
     
     class Meta:
@@ -136,9 +248,57 @@ class TextFieldSerializer(serializers.ModelSerializer):
         fields = ['id', 'manuscript', 'page', 'bounding_box']
 
 
-class DownloadSerializer(serializers.ModelSerializer):
-    manuscript = serializers.SlugRelatedField(read_only=True, slug_field='title')
-    
+class JobSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
-        model = Annotation
-        fields = ['id', 'manuscript', 'page', 'text', 'label', 'research_note']
\ No newline at end of file
+        model = Job
+        fields = '__all__'
+
+
+def manuscript_fields(metadata, **fields):
+    ''' The data for a ManuscriptSerializer, from the fields
+    of an uploaded manuscript, as they are posted by the upload form.
+    '''
+    data = dict(metadata, **fields)
+    data['editor'] = {'name': data.get('editor')}
+    return data
+
+
+class UploadSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    ''' An upload in chunks. The metadata are the fields of the
+    manuscript to be created, which are validated up front.
+    '''
+    class Meta:
+        model = Upload
+        fields = ['id', 'filename', 'length', 'offset', 'checksum', 'metadata', 'manuscript', 'created']
+        read_only_fields = ['offset', 'manuscript', 'created']
+
+    def validate_length(self, length):
+        if length < 0:
+            raise serializers.ValidationError('Expected a positive length.')
+        return length
+
+    def validate_checksum(self, checksum):
+        checksum = checksum.lower()
+        if checksum and (len(checksum) != 64 or set(checksum) - set('0123456789abcdef')):
+            raise serializers.ValidationError('Expected a hexadecimal SHA-256 digest.')
+        return checksum
+
+    def validate_metadata(self, metadata):
+        if not isinstance(metadata, dict):
+            raise serializers.ValidationError('Expected the fields of a manuscript.')
+        manuscript = ManuscriptSerializer(data=manuscript_fields(metadata))
+        manuscript.is_valid()
+        errors = {name: error for name, error in manuscript.errors.items() if name != 'filepath'}
+        if errors:
+            raise serializers.ValidationError(errors)
+        return metadata
+
+
+class AlignmentSerializer(serializers.ModelSerializer):
+    ''' A block of the collation of a book. Its rows give the id of the
+    line of each manuscript (by manuscript id), and the words in which
+    it differs from the first line of the row.
+    '''
+    class Meta:
+        model = Alignment
+        fields = ['key', 'position', 'rows', 'modified']
@@ -0,0 +1,96 @@
+''' Uploads of scans in chunks, following the tus protocol
+(https://tus.io/protocols/resumable-upload.html): an upload is created
+with the length of the file, the client sends chunks with the offset at
+which they start, and the upload is finalized when all bytes arrived.
+Chunks are streamed to a staging file, so that memory use is bounded
+whatever the size of the scan. If a chunk is interrupted, the bytes
+that arrived are kept, and the client resumes from the current offset.
+'''
+import base64
+from hashlib import sha256
+import os
+
+from django.conf import settings
+from django.http import UnreadablePostError
+
+READ_SIZE = 64 * 1024
+
+
+class ChecksumMismatch(ValueError):
+    pass
+
+
+class TooLong(ValueError):
+    pass
+
+
+def staged_path(upload):
+    return os.path.join(settings.UPLOAD_DIR, str(upload.pk))
+
+
+def start(upload):
+    ''' Create the empty staging file of a new upload. '''
+    os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+    open(staged_path(upload), 'wb').close()
+
+
+def discard(upload):
+    try:
+        os.remove(staged_path(upload))
+    except FileNotFoundError:
+        pass
+
+
+def parse_checksum(header):
+    ''' The digest of an Upload-Checksum header, such as
+    "sha256 <base64 digest>". Only SHA-256 is supported.
+    '''
+    algorithm, _, value = header.partition(' ')
+    if algorithm != 'sha256':
+        raise ValueError('Unsupported checksum algorithm')
+    try:
+        return base64.b64decode(value, validate=True)
+    except ValueError:
+        raise ValueError('Invalid checksum')
+
+
+def append(upload, stream, checksum=None):
+    ''' Write a chunk, read from stream, at the offset of the upload.
+    If a checksum (a SHA-256 digest) is given, the chunk is only
+    kept if it matches. Otherwise, if the chunk is interrupted,
+    the bytes received are kept. Returns the number of bytes kept.
+    '''
+    digest = sha256()
+    received = 0
+    interrupted = False
+    with open(staged_path(upload), 'r+b') as staged:
+        staged.seek(upload.offset)
+        staged.truncate()
+        try:
+            while stream is not None:
+                data = stream.read(READ_SIZE)
+                if not data:
+                    break
+                received += len(data)
+                if upload.offset + received > upload.length:
+                    staged.truncate(upload.offset)
+                    raise TooLong('Chunk exceeds the length of the upload')
+                digest.update(data)
+                staged.write(data)
+        except UnreadablePostError:
+            interrupted = True
+        if checksum is not None and (interrupted or digest.digest() != checksum):
+            staged.truncate(upload.offset)
+            raise ChecksumMismatch('Chunk does not match its checksum')
+    upload.offset += received
+    upload.save(update_fields=['offset'])
+    return received
+
+
+def file_checksum(upload):
+    ''' The SHA-256 checksum (hex) of a complete upload. '''
+    digest = sha256()
+    with open(staged_path(upload), 'rb') as staged:
+        for data in iter(lambda: staged.read(READ_SIZE), b''):
+            digest.update(data)
+    return digest.hexdigest()
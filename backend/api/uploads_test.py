@@ -0,0 +1,82 @@
+import base64
+from hashlib import sha256
+
+from django.core.files.storage import default_storage
+
+from .conftest import scan_file
+from .models import Job, Manuscript, Upload
+
+METADATA = {'book': 'Muqaddimah', 'title': 'Cairo', 'date': '1900', 'editor': 'Wafi'}
+
+
+def create(client, content, **fields):
+    return client.post('/api/uploads/', dict({
+        'filename': 'scan.pdf',
+        'length': len(content),
+        'metadata': METADATA,
+    }, **fields), content_type='application/json')
+
+
+def send(client, upload, chunk, offset, checksum=None):
+    headers = {'HTTP_UPLOAD_OFFSET': str(offset)}
+    if checksum:
+        headers['HTTP_UPLOAD_CHECKSUM'] = 'sha256 ' + base64.b64encode(checksum).decode()
+    return client.patch('/api/uploads/{}/'.format(upload), chunk,
+        content_type='application/offset+octet-stream', **headers)
+
+
+def test_upload_in_chunks(client, book, media):
+    content = scan_file(format='PDF', pages=2).read()
+    response = create(client, content, checksum=sha256(content).hexdigest())
+    assert response.status_code == 201
+    upload = response.json()['id']
+
+    half = len(content) // 2
+    response = send(client, upload, content[:half], 0, checksum=sha256(content[:half]).digest())
+    assert response.status_code == 204
+    assert response['Upload-Offset'] == str(half)
+
+    # resuming from the wrong offset
+    response = send(client, upload, content[half:], 0)
+    assert response.status_code == 409
+    assert response.json() == {'offset': half}
+    assert client.post('/api/uploads/{}/finalize/'.format(upload)).status_code == 409
+
+    resumed = client.get('/api/uploads/{}/'.format(upload))['Upload-Offset']
+    assert send(client, upload, content[half:], int(resumed)).status_code == 204
+
+    response = client.post('/api/uploads/{}/finalize/'.format(upload))
+    assert response.status_code == 202
+    manuscript = Manuscript.objects.get(pk=response.json()['id'])
+    assert (manuscript.title, manuscript.editor.name) == ('Cairo', 'Wafi')
+    with default_storage.open(manuscript.filepath.name) as scan:
+        assert scan.read() == content
+    assert Job.objects.get(pk=response.json()['job']).kind == 'ingest'
+    assert not (media / 'uploads' / str(upload)).exists()
+
+
+def test_chunk_checksum_mismatch(client, book, media):
+    content = b'%PDF' + bytes(100)
+    upload = create(client, content).json()['id']
+    response = send(client, upload, content, 0, checksum=sha256(b'other').digest())
+    assert response.status_code == 400
+    assert Upload.objects.get(pk=upload).offset == 0
+    assert (media / 'uploads' / str(upload)).stat().st_size == 0
+
+    assert send(client, upload, content + b'more', 0).status_code == 413
+    assert Upload.objects.get(pk=upload).offset == 0
+
+
+def test_file_checksum_mismatch(client, book, media):
+    content = b'%PDF' + bytes(100)
+    upload = create(client, content, checksum=sha256(b'other').hexdigest()).json()['id']
+    send(client, upload, content, 0)
+    response = client.post('/api/uploads/{}/finalize/'.format(upload))
+    assert response.status_code == 400
+    assert not Manuscript.objects.exists()
+
+
+def test_invalid_metadata(client, book, media):
+    response = create(client, b'', metadata={'book': 'Unknown', 'date': '1900', 'editor': 'Wafi'})
+    assert response.status_code == 400
+    assert set(response.json()['metadata']) == {'book', 'title'}
@@ -1,28 +1,64 @@
-from io import BytesIO
-import csv
+from hashlib import sha1
+import json
+import mimetypes
+import os
 
+from django.core.files import File
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Prefetch
 from django.shortcuts import get_object_or_404
-from django.http import HttpResponse
+from django.core.files.storage import default_storage
+from django.http import Http404, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 
-from rest_framework import viewsets
+from rest_framework import mixins, viewsets
 from rest_framework.parsers import FormParser, MultiPartParser, JSONParser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 
-from wsgiref.util import FileWrapper
+from . import export, files, images, jobs, lines, search, uploads
+from .arabic import normalize
+from .filters import filter_annotations, filter_pages, filter_region, integer_param
+from .models import (
+    PENDING, Alignment, Annotation, AnnotatedLine, Aside, Book, Chapter, Editor, Job, Manuscript, TextField, Upload,
+)
+from .pagination import CountMixin, requested_fields
+from .renderers import EXPORT_RENDERERS
+from .serializers import (
+    AlignmentSerializer, AnnotationSerializer, AnnotatedLineSerializer, AsideSerializer, BookSerializer,
+    BulkAnnotatedLineSerializer, ChapterSerializer, JobSerializer, ManuscriptSerializer, TextFieldSerializer,
+    UploadSerializer, manuscript_fields,
+)
 
-from .models import Annotation, AnnotatedLine, Book, Editor, Manuscript, TextField
-from .serializers import AnnotationSerializer, AnnotatedLineSerializer, BookSerializer, DownloadSerializer, ManuscriptSerializer, TextFieldSerializer
+
+def manuscript_queryset():
+    ''' Manuscripts with everything ManuscriptSerializer reads
+    fetched up front, so that serializing any number of manuscripts
+    costs a constant number of queries.
+    '''
+    annotations = Annotation.objects.only('id', 'manuscript', 'complete', 'annotation_type')
+    return Manuscript.objects.select_related('editor', 'book').prefetch_related(
+        Prefetch('annotations', queryset=annotations))
 
 
 class BookViewSet(viewsets.ModelViewSet):
     '''
     This viewset provides standard CRUD actions.
     '''
-    queryset = Book.objects.all()
+    queryset = Book.objects.select_related('author').prefetch_related(
+        Prefetch('manuscript_set', queryset=manuscript_queryset()))
     serializer_class = BookSerializer
 
+    def get_queryset(self):
+        requested = requested_fields(self.request)
+        if requested is not None and 'manuscripts' not in requested:
+            return Book.objects.select_related('author')
+        return super().get_queryset()
+
     def create(self, request):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
@@ -31,62 +67,223 @@ class BookViewSet(viewsets.ModelViewSet):
         else:
             return Response(serializer.errors, status=400)
 
+    @action(detail=True, methods=['get'])
+    def collation(self, request, pk=None):
+        ''' The lines of the manuscripts of the book, aligned, in blocks
+        between corresponding chapters; see collation.py. Blocks are
+        aligned in the background after an edit; pending tells whether
+        that is still to be done.
+        '''
+        book = get_object_or_404(Book, pk=pk)
+        alignments = Alignment.objects.filter(book=book).order_by('position')
+        return Response({
+            'book': book.pk,
+            'pending': Job.objects.filter(kind='collate', status=PENDING, manuscript__book=book).exists(),
+            'blocks': AlignmentSerializer(alignments, many=True).data,
+        })
 
 
 class ManuscriptViewSet(viewsets.ModelViewSet):
     '''
     This viewset provides standard CRUD actions.
     '''
-    queryset = Manuscript.objects.all()
+    queryset = manuscript_queryset()
     serializer_class = ManuscriptSerializer
+
+    def get_queryset(self):
+        requested = requested_fields(self.request)
+        if self.action in ('list', 'retrieve') and (requested is None or 'annotations' in requested):
+            return super().get_queryset()
+        # other actions do not serialize the annotations
+        return Manuscript.objects.select_related('editor', 'book')
     
     def create(self, request):
+        ''' Save an uploaded scan, and queue a job to process it.
+        Responds with the ids of the manuscript and of the job.
+        '''
         request.data['editor.name'] = request.data['editor']
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
             self.perform_create(serializer)
-            return Response(status=201)
+            job = jobs.enqueue('ingest', serializer.instance)
+            return Response({'id': serializer.instance.pk, 'job': job.pk}, status=202)
         else:
             return Response(serializer.errors, status=400)
 
-    @action(detail=True, methods=['get'], url_path='scan/(?P<page_no>\d+)', url_name='scan')
+    @action(detail=True, methods=['get'], url_path=r'scan/(?P<page_no>\d+)', url_name='scan')
     def scan(self, request, page_no, pk=None):
-        # To do: adjust this function such that it retrieves
-        # page_no from a multiple-page pdf document
-        filepath = self.get_object().filepath
-        response = HttpResponse(FileWrapper(filepath), content_type='image/jpg')
-        return response
+        ''' The image of a page of the scan. Pages of PDF and TIFF
+        documents are rendered to JPEG, one at a time, when requested.
+        '''
+        manuscript = self.get_object()
+        page = int(page_no)
+        immutable = bool(manuscript.sha256)
+        if images.scan_format(manuscript) == images.IMAGE:
+            if page != 1:
+                raise Http404
+            content_type, _ = mimetypes.guess_type(manuscript.filepath.name)
+            return files.serve(request, manuscript.filepath.path, content_type or 'image/jpeg',
+                etag=manuscript.sha256 or None, immutable=immutable)
+        try:
+            path = images.rendered_page(manuscript, page)
+        except (LookupError, OSError):
+            raise Http404
+        return files.serve(request, path, 'image/jpeg', immutable=immutable)
     
-    @action(detail=True, methods=['get'])
-    def annotate_page(self, request, pk=None):
+    @action(detail=True, methods=['get'], url_path=r'tiles/(?P<page_no>\d+)', url_name='tiles')
+    def tiles(self, request, page_no, pk=None):
+        ''' Describe the image pyramid of a page: the size of the image,
+        the size and format of the tiles, and the number of zoom levels.
+        '''
+        try:
+            descriptor = images.descriptor(self.get_object(), int(page_no))
+        except (LookupError, OSError):
+            raise Http404
+        return Response(descriptor)
+
+    @action(detail=True, methods=['get'],
+        url_path=r'tiles/(?P<page_no>\d+)/(?P<level>\d+)/(?P<column>\d+)_(?P<row>\d+)', url_name='tile')
+    def tile(self, request, page_no, level, column, row, pk=None):
+        ''' A tile of the image pyramid of a page, which is cut when it
+        is first requested, if the pyramid was not built yet.
+        Level 0 is a single pixel, and each following level doubles in size.
+        '''
         manuscript = self.get_object()
-        lines = AnnotatedLineSerializer(manuscript.annotatedline_set.filter(page=pk), many=True)
-        chapters = manuscript.chapter_set.filter(page=pk)
-        asides = manuscript.aside_set.filter(page=pk)
-        return Response(data={'annotated_lines': lines})
+        try:
+            path = images.tile(manuscript, int(page_no), int(level), int(column), int(row))
+        except (LookupError, OSError):
+            raise Http404
+        return files.serve(request, default_storage.path(path), 'image/jpeg', immutable=bool(manuscript.sha256))
 
+    @action(detail=True, methods=['get'], url_path=r'thumbnail/(?P<page_no>\d+)', url_name='thumbnail')
+    def thumbnail(self, request, page_no, pk=None):
+        ''' A small image of a page, for listings of manuscripts. '''
+        manuscript = self.get_object()
+        try:
+            path = images.thumbnail(manuscript, int(page_no))
+        except (LookupError, OSError):
+            raise Http404
+        return files.serve(request, default_storage.path(path), 'image/jpeg', immutable=bool(manuscript.sha256))
 
-class AnnotationViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['get'], url_path=r'lines/(?P<number>\d+)', url_name='line')
+    def line(self, request, number, pk=None):
+        ''' The line at the given position (counting from 1)
+        in the reading order of the manuscript.
+        '''
+        numbered = AnnotatedLine.objects.select_related('annotation').filter(
+            annotation__manuscript=pk,
+            annotation__sequence__isnull=False,
+        ).order_by('annotation__sequence')
+        number = int(number)
+        found = list(numbered[number - 1:number]) if number > 0 else []
+        if not found:
+            raise Http404
+        return Response(AnnotatedLineSerializer(found[0]).data)
+
+    @action(detail=True, methods=['get'], url_path=r'pages/(?P<page_no>\d+)', url_name='page')
+    def page(self, request, page_no, pk=None):
+        ''' Everything marked on a page: its text fields, lines
+        (in reading order), chapters and asides, in a constant number
+        of queries. The ETag is a hash of the content, so that
+        a page that did not change is answered with a 304.
+        '''
+        manuscript = self.get_object()
+        on_page = {'annotation__manuscript': manuscript, 'annotation__page': int(page_no)}
+        text_fields = TextField.objects.filter(manuscript=manuscript, page=int(page_no))
+        lines = AnnotatedLine.objects.select_related('annotation').filter(**on_page)
+        chapters = Chapter.objects.select_related('annotation').filter(**on_page)
+        asides = Aside.objects.select_related('annotation').filter(**on_page)
+        data = {
+            'manuscript': manuscript.pk,
+            'page': int(page_no),
+            'text_fields': TextFieldSerializer(text_fields.order_by('min_y', 'pk'), many=True).data,
+            'lines': AnnotatedLineSerializer(
+                lines.order_by('annotation__sequence', 'pk'), many=True).data,
+            'chapters': ChapterSerializer(chapters.order_by('annotation__min_y', 'pk'), many=True).data,
+            'asides': AsideSerializer(asides.order_by('annotation__min_y', 'pk'), many=True).data,
+        }
+        content = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True)
+        etag = quote_etag(sha1(content.encode()).hexdigest())
+        response = get_conditional_response(request, etag=etag) or Response(data)
+        response['ETag'] = etag
+        patch_cache_control(response, no_cache=True)
+        return response
+
+
+class AnnotationViewSet(CountMixin, viewsets.ModelViewSet):
+    ''' Annotations, filtered as in filter_annotations. '''
     queryset = Annotation.objects.all()
     serializer_class = AnnotationSerializer
 
-    @action(detail=False, methods=['get'], url_path='download')
-    def download_annotations(self, request):
-        annotations = Annotation.objects.all().filter(complete=True)
-        serialized = DownloadSerializer(annotations, many=True).data
-        keys = serialized[0].keys()
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="annotations.csv"'
-        writer = csv.DictWriter(response, keys)
-        writer.writeheader()
-        writer.writerows(serialized)
+    def get_queryset(self):
+        return filter_annotations(super().get_queryset(), self.request.query_params)
+
+    @action(detail=False, methods=['get'])
+    def region(self, request):
+        ''' The annotations on a page of a manuscript that intersect
+        a region (?manuscript=&page=&bbox=min_x,min_y,max_x,max_y),
+        from top to bottom.
+        '''
+        annotations = filter_region(self.get_queryset(), request.query_params)
+        return Response(self.get_serializer(annotations.order_by('min_y', 'min_x', 'pk'), many=True).data)
+
+    @action(detail=False, methods=['get'], url_path='search', url_name='search')
+    def search_annotations(self, request):
+        ''' Annotations whose text, label or research note contain all
+        words of ?q=, best match first, with highlighted snippets.
+        Accepts the filters of filter_annotations, a limit and an offset.
+        '''
+        terms = request.query_params.get('q', '').strip()
+        if not terms:
+            raise ValidationError({'q': 'Expected words to search for.'})
+        limit = integer_param(request.query_params, 'limit') or 20
+        offset = integer_param(request.query_params, 'offset') or 0
+        if limit < 0 or offset < 0:
+            raise ValidationError({'limit': 'Expected a positive limit and offset.'})
+        return Response(search.search(terms, self.get_queryset(), limit, offset))
+
+    @action(detail=False, methods=['get'], url_path='download', renderer_classes=EXPORT_RENDERERS)
+    def download_annotations(self, request, format=None):
+        ''' Export complete annotations, oldest modification first,
+        as CSV (default), JSON Lines, Arrow or Parquet (?format=).
+        Accepts the filters of filter_annotations, and a limit on the
+        number of rows. If more rows remain, the response carries a
+        continuation token, to be passed as ?cursor= to resume.
+        '''
+        annotations = filter_annotations(
+            Annotation.objects.filter(complete=True), request.query_params)
+        annotations, token = export.paginate(
+            annotations,
+            cursor=request.query_params.get('cursor'),
+            limit=integer_param(request.query_params, 'limit'),
+        )
+        renderer = request.accepted_renderer
+        rows, filename = export.FORMATS[renderer.format]
+        response = StreamingHttpResponse(rows(annotations), content_type=renderer.media_type)
+        response['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
+        if token:
+            params = request.query_params.copy()
+            params['cursor'] = token
+            response['X-Continuation-Token'] = token
+            response['Link'] = '<{}?{}>; rel="next"'.format(
+                request.build_absolute_uri(request.path), params.urlencode())
         return response
 
 
-class AnnotatedLineViewSet(viewsets.ModelViewSet):
-    queryset = AnnotatedLine.objects.all()
+class AnnotatedLineViewSet(CountMixin, viewsets.ModelViewSet):
+    ''' Lines, filtered by their annotations as in filter_annotations,
+    and by the start of their hypotext (?hypo_text=), in normalized form.
+    '''
+    queryset = AnnotatedLine.objects.select_related('annotation')
     serializer_class = AnnotatedLineSerializer
 
+    def get_queryset(self):
+        queryset = filter_annotations(super().get_queryset(), self.request.query_params, prefix='annotation__')
+        hypo_text = normalize(self.request.query_params.get('hypo_text', ''))
+        if hypo_text:
+            queryset = queryset.filter(normalized_hypo_text__startswith=hypo_text)
+        return queryset
+
     def create(self, request):
         serializer = self.get_serializer(data=request.data)
         if not serializer.is_valid(raise_exception=False):
@@ -101,17 +298,154 @@ class AnnotatedLineViewSet(viewsets.ModelViewSet):
     def retrieve(self, request, pk=None):
         queryset = AnnotatedLine.objects.all()
         line = get_object_or_404(queryset, annotation__id=pk)
-        line_serialized = self.serializer_class(line).data
+        line_serialized = self.get_serializer(line).data
         return Response(line_serialized)
 
+    @action(detail=True, methods=['get'])
+    def window(self, request, pk=None):
+        ''' A window of consecutive lines in reading order,
+        starting at this line and following the next lines,
+        or the previous lines with ?direction=previous.
+        The number of lines is given by ?count= (default and maximum 100).
+        '''
+        count = integer_param(request.query_params, 'count') or lines.MAX_WINDOW
+        count = max(1, min(count, lines.MAX_WINDOW))
+        direction = request.query_params.get('direction', 'next')
+        if direction not in ('next', 'previous'):
+            return Response({'direction': 'Expected next or previous.'}, status=400)
+        window = lines.window(self.get_object().pk, count, forward=direction == 'next')
+        return Response(self.get_serializer(window, many=True).data)
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        ''' Create the lines marked on a page of a manuscript,
+        linked in the given order, in one transaction.
+        '''
+        serializer = BulkAnnotatedLineSerializer(data=request.data)
+        if not serializer.is_valid(raise_exception=False):
+            return Response(serializer.errors, status=400)
+        created = serializer.save()
+        jobs.schedule_collation(serializer.validated_data['manuscript'].pk)
+        return Response({'created': created}, status=201)
+
 
-class TextFieldViewSet(viewsets.ModelViewSet):
+class TextFieldViewSet(CountMixin, viewsets.ModelViewSet):
+    ''' Text fields, filtered as in filter_pages. '''
     queryset = TextField.objects.all()
     serializer_class = TextFieldSerializer
 
+    def get_queryset(self):
+        return filter_pages(super().get_queryset(), self.request.query_params)
+
+    @action(detail=False, methods=['get'])
+    def region(self, request):
+        ''' The text fields on a page of a manuscript that intersect
+        a region, as for annotations.
+        '''
+        text_fields = filter_region(self.get_queryset(), request.query_params)
+        return Response(self.get_serializer(text_fields.order_by('min_y', 'min_x', 'pk'), many=True).data)
+
     def create(self, request):
         serializer = self.get_serializer(data=request.data)
         if not serializer.is_valid(raise_exception=False):
             return Response({'Error': 'Object not valid'}, status=400)
         self.perform_create(serializer)
-        return Response({'created': serializer.data['id']})
\ No newline at end of file
+        return Response({'created': serializer.data['id']})
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    ''' The status of background jobs, filtered by ?manuscript= and ?status=. '''
+    queryset = Job.objects.order_by('pk')
+    serializer_class = JobSerializer
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        manuscript = integer_param(self.request.query_params, 'manuscript')
+        if manuscript is not None:
+            queryset = queryset.filter(manuscript=manuscript)
+        status = self.request.query_params.get('status')
+        if status:
+            queryset = queryset.filter(status=status)
+        return queryset
+
+
+class UploadViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+        mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    ''' Upload a scan in chunks, see uploads.py: create an upload,
+    send the chunks with PATCH, then finalize it to create the manuscript.
+    Retrieve an upload to find the offset from which to resume.
+    '''
+    queryset = Upload.objects.all()
+    serializer_class = UploadSerializer
+
+    def perform_create(self, serializer):
+        uploads.start(serializer.save())
+
+    def perform_destroy(self, instance):
+        uploads.discard(instance)
+        instance.delete()
+
+    def retrieve(self, request, pk=None):
+        response = super().retrieve(request, pk=pk)
+        response['Upload-Offset'] = response.data['offset']
+        response['Upload-Length'] = response.data['length']
+        response['Cache-Control'] = 'no-store'
+        return response
+
+    def partial_update(self, request, pk=None):
+        ''' Append a chunk, sent as application/offset+octet-stream.
+        The Upload-Offset header gives the offset at which the chunk starts,
+        which should be the current offset of the upload. The chunk is
+        verified if an Upload-Checksum header ("sha256 <base64 digest>") is given.
+        '''
+        if request.content_type.split(';')[0].strip() != 'application/offset+octet-stream':
+            return Response({'Content-Type': 'Expected application/offset+octet-stream.'}, status=415)
+        offset = integer_param(request.headers, 'Upload-Offset')
+        if offset is None:
+            return Response({'Upload-Offset': 'This header is required.'}, status=400)
+        checksum = request.headers.get('Upload-Checksum')
+        if checksum:
+            try:
+                checksum = uploads.parse_checksum(checksum)
+            except ValueError as error:
+                return Response({'Upload-Checksum': str(error)}, status=400)
+        with transaction.atomic():
+            upload = get_object_or_404(Upload.objects.select_for_update(), pk=pk)
+            if upload.manuscript_id or offset != upload.offset:
+                return Response({'offset': upload.offset}, status=409, headers={'Upload-Offset': upload.offset})
+            try:
+                uploads.append(upload, request.stream, checksum)
+            except uploads.TooLong as error:
+                return Response({'length': str(error)}, status=413)
+            except uploads.ChecksumMismatch as error:
+                return Response({'Upload-Checksum': str(error)}, status=400)
+        return Response(status=204, headers={'Upload-Offset': upload.offset})
+
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        ''' Verify a complete upload against its checksum, which may
+        also be given here, and create the manuscript. As with a manuscript
+        uploaded at once, a job is queued to process the scan.
+        '''
+        with transaction.atomic():
+            upload = get_object_or_404(Upload.objects.select_for_update(), pk=pk)
+            if upload.manuscript_id:
+                return Response({'manuscript': upload.manuscript_id}, status=409)
+            if upload.offset != upload.length:
+                return Response({'offset': upload.offset}, status=409, headers={'Upload-Offset': upload.offset})
+            checksum = uploads.file_checksum(upload)
+            expected = request.data.get('checksum') or upload.checksum
+            if expected and expected.lower() != checksum:
+                return Response({'checksum': 'Does not match the uploaded file.'}, status=400)
+            with open(uploads.staged_path(upload), 'rb') as staged:
+                scan = File(staged, name=os.path.basename(upload.filename))
+                serializer = ManuscriptSerializer(data=manuscript_fields(upload.metadata, filepath=scan))
+                if not serializer.is_valid():
+                    return Response(serializer.errors, status=400)
+                manuscript = serializer.save(sha256=checksum)
+            upload.manuscript = manuscript
+            upload.checksum = checksum
+            upload.save(update_fields=['manuscript', 'checksum'])
+            job = jobs.enqueue('ingest', manuscript)
+        uploads.discard(upload)
+        return Response({'id': manuscript.pk, 'job': job.pk}, status=202)
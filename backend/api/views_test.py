@@ -0,0 +1,234 @@
+from .conftest import add_annotations, bulk_lines
+from .models import Annotation, AnnotatedLine, Book, Manuscript, TextField
+
+
+def test_book_list_constant_queries(client, manuscript, django_assert_num_queries):
+    add_annotations(manuscript)
+    with django_assert_num_queries(3):
+        response = client.get('/api/books/')
+    assert response.status_code == 200
+
+    second = Manuscript.objects.create(
+        filepath='manuscript_images/other.jpg',
+        editor=manuscript.editor,
+        book=manuscript.book,
+        title='Istanbul',
+        date='1400',
+    )
+    add_annotations(manuscript, page=2, lines=10)
+    add_annotations(second, lines=10)
+    with django_assert_num_queries(3):
+        response = client.get('/api/books/')
+    book = response.json()['results'][0]
+    assert len(book['manuscripts']) == 2
+    types = [a['annotation_type'] for a in book['manuscripts'][0]['annotations']]
+    assert types.count('chapter') == 2
+    assert types.count('aside') == 2
+    assert types.count('annotated_line') == 13
+
+
+def test_manuscript_list_constant_queries(client, manuscript, django_assert_num_queries):
+    add_annotations(manuscript, lines=20)
+    with django_assert_num_queries(2):
+        response = client.get('/api/manuscripts/')
+    assert response.json()['results'][0]['book'] == 'Muqaddimah'
+
+    with django_assert_num_queries(2):
+        response = client.get('/api/manuscripts/{}/'.format(manuscript.pk))
+    assert len(response.json()['annotations']) == 22
+
+
+def test_annotation_type_filter(client, manuscript):
+    add_annotations(manuscript, lines=2)
+    response = client.get('/api/annotations/', {'annotation_type': 'annotated_line'})
+    assert [a['annotation_type'] for a in response.json()['results']] == ['annotated_line'] * 2
+
+
+def test_create_line_sets_type(client, manuscript):
+    response = client.post('/api/annotated_lines/', {
+        'annotation': {'manuscript': manuscript.pk, 'bounding_box': {}},
+    }, content_type='application/json')
+    created = Annotation.objects.get(pk=response.json()['created'])
+    assert created.annotation_type == 'annotated_line'
+
+
+def chain(line):
+    ids = []
+    while line:
+        ids.append(line.pk)
+        line = line.next_line
+    return ids
+
+
+def test_bulk_create_lines(client, manuscript):
+    response = bulk_lines(client, manuscript, 3)
+    assert response.status_code == 201
+    ids = response.json()['created']
+    first = AnnotatedLine.objects.get(pk=ids[0])
+    assert first.previous_line is None
+    assert chain(first) == ids
+    assert set(Annotation.objects.filter(pk__in=ids).values_list('page', 'annotation_type')) == \
+        {(4, 'annotated_line')}
+    manuscript.refresh_from_db()
+    assert manuscript.currently_annotating == ids[0]
+
+    inserted = bulk_lines(client, manuscript, 2, previous_line=ids[0]).json()['created']
+    first.refresh_from_db()
+    assert chain(first) == [ids[0]] + inserted + ids[1:]
+    assert AnnotatedLine.objects.get(pk=ids[1]).previous_line_id == inserted[-1]
+
+
+def test_bulk_create_invalid(client, manuscript):
+    assert bulk_lines(client, manuscript, 0).status_code == 400
+    other = add_annotations(manuscript)[0]
+    other.annotation.manuscript = Manuscript.objects.create(
+        filepath='x.jpg', book=manuscript.book, title='Cairo', date='1300')
+    other.annotation.save()
+    assert bulk_lines(client, manuscript, 1, previous_line=other.pk).status_code == 400
+    assert not Annotation.objects.filter(page=4).exists()
+
+
+def test_region(client, manuscript):
+    ids = bulk_lines(client, manuscript, 4).json()['created']
+    line = Annotation.objects.get(pk=ids[0])
+    assert (line.min_x, line.min_y, line.max_x, line.max_y) == (0, 0, 50, 10)
+
+    def region(**params):
+        response = client.get('/api/annotations/region/', dict(manuscript=manuscript.pk, page=4, **params))
+        return [annotation['id'] for annotation in response.json()]
+
+    assert region() == ids
+    assert region(bbox='0,15,10,25') == ids[1:3]
+    assert region(bbox='25,5,25,5') == ids[:1]
+    assert region(bbox='60,0,100,100') == []
+
+    line.bounding_box = {'type': 'Polygon', 'coordinates': [[[60, 0], [80, 5], [70, 9], [60, 0]]]}
+    line.save(update_fields=['bounding_box'])
+    assert region(bbox='60,0,100,100') == ids[:1]
+
+    assert client.get('/api/annotations/region/', {'manuscript': manuscript.pk}).status_code == 400
+    response = client.get('/api/annotations/region/', dict(manuscript=manuscript.pk, page=4, bbox='1,2,0,0'))
+    assert response.status_code == 400
+
+
+def test_text_field_region(client, manuscript):
+    field = TextField.objects.create(manuscript=manuscript, page=1,
+        bounding_box={'x': 100, 'y': 100, 'width': 300, 'height': 500})
+    response = client.get('/api/text_fields/region/', {'manuscript': manuscript.pk, 'page': 1, 'bbox': '50,50,150,150'})
+    assert [f['id'] for f in response.json()] == [field.pk]
+    response = client.get('/api/text_fields/region/', {'manuscript': manuscript.pk, 'page': 2})
+    assert response.json() == []
+
+
+def test_page_bundle(client, manuscript, django_assert_num_queries):
+    lines = add_annotations(manuscript, page=2)
+    add_annotations(manuscript, page=3)
+    TextField.objects.create(manuscript=manuscript, page=2, bounding_box={'x': 0, 'y': 0, 'width': 9, 'height': 9})
+    url = '/api/manuscripts/{}/pages/2/'.format(manuscript.pk)
+    with django_assert_num_queries(5):
+        response = client.get(url)
+    page = response.json()
+    assert (page['manuscript'], page['page']) == (manuscript.pk, 2)
+    assert len(page['text_fields']) == 1
+    assert [line['annotation']['id'] for line in page['lines']] == [line.pk for line in lines]
+    assert page['chapters'][0]['annotation']['annotation_type'] == 'chapter'
+    assert len(page['asides']) == 1
+
+    etag = response['ETag']
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+    lines[0].annotation.text = 'edited'
+    lines[0].annotation.save()
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+    assert client.get('/api/manuscripts/{}/pages/4/'.format(manuscript.pk)).json()['lines'] == []
+
+
+def test_existing_author(client, book):
+    response = client.post('/api/books/', {'title': 'Kitab al-Ibar', 'author': {'name': 'Ibn Khaldun'}},
+        content_type='application/json')
+    assert response.status_code == 201
+    assert Book.objects.get(title='Kitab al-Ibar').author == book.author
+
+
+def test_cursor_pagination(client, manuscript):
+    add_annotations(manuscript, lines=3)
+    ids, url = [], '/api/annotations/?page_size=2'
+    while url:
+        page = client.get(url).json()
+        assert len(page['results']) <= 2
+        ids += [annotation['id'] for annotation in page['results']]
+        url = page['next']
+    assert ids == sorted(Annotation.objects.values_list('pk', flat=True))
+
+
+def test_sparse_fields(client, manuscript, django_assert_num_queries):
+    add_annotations(manuscript)
+    response = client.get('/api/annotations/', {'fields': 'id,complete'})
+    assert [set(a) for a in response.json()['results']] == [{'id', 'complete'}] * 5
+
+    with django_assert_num_queries(1):
+        response = client.get('/api/manuscripts/', {'fields': 'id,title,editor'})
+    assert response.json()['results'] == [{'id': manuscript.pk, 'title': 'Paris', 'editor': ['Quatremère']}]
+
+    with django_assert_num_queries(1):
+        response = client.get('/api/books/', {'fields': 'id,title'})
+    assert response.json()['results'] == [{'id': manuscript.book.pk, 'title': 'Muqaddimah'}]
+
+    # nested serializers keep all their fields
+    line = client.get('/api/annotated_lines/', {'fields': 'annotation'}).json()['results'][0]
+    assert set(line) == {'annotation'}
+    assert 'bounding_box' in line['annotation']
+
+
+def test_filters(client, manuscript):
+    add_annotations(manuscript, page=1, lines=2)
+    lines = add_annotations(manuscript, page=3, lines=2)
+    Annotation.objects.filter(pk=lines[0].annotation.pk).update(complete=True, label='verse')
+    TextField.objects.create(manuscript=manuscript, page=3, bounding_box={})
+
+    def ids(url, **params):
+        return [item['id'] for item in client.get(url, params).json()['results']]
+
+    assert len(ids('/api/annotations/', page_from=2, page_to=3)) == 4
+    assert ids('/api/annotations/', manuscript=manuscript.pk, complete='true') == [lines[0].annotation.pk]
+    assert ids('/api/annotations/', label='verse', complete='false') == []
+    assert len(ids('/api/text_fields/', page=3)) == 1
+    assert ids('/api/text_fields/', book=manuscript.book.pk, page=1) == []
+    response = client.get('/api/annotated_lines/', {'page': 3, 'complete': 'yes'})
+    assert [line['annotation']['id'] for line in response.json()['results']] == [lines[0].annotation.pk]
+
+    assert client.get('/api/annotations/', {'complete': 'maybe'}).status_code == 400
+
+
+def test_count(client, manuscript, django_assert_num_queries):
+    add_annotations(manuscript, lines=4)
+    with django_assert_num_queries(1):
+        response = client.get('/api/annotations/', {
+            'book': manuscript.book.pk, 'annotation_type': 'annotated_line', 'count': 1})
+    assert response.json() == {'count': 4}
+    assert client.get('/api/annotated_lines/', {'complete': 'true', 'count': 'true'}).json() == {'count': 0}
+
+
+def test_search(client, manuscript):
+    lines = add_annotations(manuscript, page=2, lines=2)
+    annotation = lines[1].annotation
+    annotation.text = 'ديوان المبتدأ والخبر'
+    annotation.save()
+    response = client.get('/api/annotations/search/', {'q': 'المبتدأ', 'page': 2})
+    assert [result['id'] for result in response.json()] == [lines[1].annotation.pk]
+    assert client.get('/api/annotations/search/', {'q': 'المبتدأ', 'page': 1}).json() == []
+    assert client.get('/api/annotations/search/').status_code == 400
+
+
+def test_normalized_filters(client, manuscript):
+    lines = add_annotations(manuscript, lines=2)
+    annotation = lines[0].annotation
+    annotation.text = 'قالَ أبو زيد'
+    annotation.save()
+    lines[1].hypo_text = [{'text': 'إنّ التاريخ'}]
+    lines[1].save()
+    response = client.get('/api/annotations/', {'text': 'قال ابو'})
+    assert [a['id'] for a in response.json()['results']] == [annotation.pk]
+    response = client.get('/api/annotated_lines/', {'hypo_text': 'ان'})
+    assert [line['annotation']['id'] for line in response.json()['results']] == [lines[1].pk]
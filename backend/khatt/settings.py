@@ -53,6 +53,11 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'khatt.urls'
 
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.IdCursorPagination',
+    'PAGE_SIZE': 100,
+}
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -146,4 +151,33 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 STATICFILES_DIRS = []
+
+# Scans uploaded in chunks are staged here until they are complete
+UPLOAD_DIR = os.path.join(BASE_DIR, 'uploads')
+
+# Pages of PDF and TIFF scans are rendered on demand into a bounded cache
+PAGE_CACHE_DIR = os.path.join(BASE_DIR, 'image_cache', 'pages')
+PAGE_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+PDF_RENDER_DPI = 200
+
+# Jobs that have been running for longer than this (in seconds) are
+# taken to have lost their worker, and are queued again, up to
+# JOB_MAX_ATTEMPTS starts in all
+JOB_TIMEOUT = 60 * 60
+JOB_MAX_ATTEMPTS = 3
+
+# Scans and images derived from them are keyed by the hash of the scan,
+# and may be cached by browsers for this long (in seconds)
+FILE_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Optionally, nginx sends these files: a file in one of these directories
+# is handed off with X-Accel-Redirect to the matching internal location
+X_ACCEL_LOCATIONS = {
+    os.path.join(BASE_DIR, directory): '/internal/{}/'.format(directory)
+    for directory in ['manuscript_images', 'manuscript_derived', 'image_cache']
+} if os.environ.get('X_ACCEL_REDIRECT') == '1' else {}
+
+# Bounded on-disk cache of images generated by the IIIF endpoint
+IIIF_CACHE_DIR = os.path.join(BASE_DIR, 'image_cache', 'iiif')
+IIIF_CACHE_MAX_BYTES = 512 * 1024 * 1024
 PROXY_FRONTEND = None
@@ -23,7 +23,7 @@ from rest_framework import routers
 from .index import index
 from .proxy_frontend import proxy_frontend
 
-from api import views
+from api import iiif, views
 
 api_router = routers.DefaultRouter()  # register viewsets with this router
 api_router.register(r'books', views.BookViewSet)
@@ -31,6 +31,8 @@ api_router.register(r'manuscripts', views.ManuscriptViewSet)
 api_router.register(r'annotated_lines', views.AnnotatedLineViewSet)
 api_router.register(r'text_fields', views.TextFieldViewSet)
 api_router.register(r'annotations', views.AnnotationViewSet)
+api_router.register(r'jobs', views.JobViewSet)
+api_router.register(r'uploads', views.UploadViewSet)
 
 if settings.PROXY_FRONTEND:
     spa_url = re_path(r'^(?P<path>.*)$', proxy_frontend)
@@ -42,6 +44,14 @@ urlpatterns = [
     path('api', RedirectView.as_view(url='/api/', permanent=True)),
     path('api-auth', RedirectView.as_view(url='/api-auth/', permanent=True)),
     path('admin/', admin.site.urls),
+    path('api/iiif/<int:manuscript>/<int:page>', iiif.base, name='iiif-base'),
+    path('api/iiif/<int:manuscript>/<int:page>/info.json', iiif.info, name='iiif-info'),
+    re_path(
+        r'^api/iiif/(?P<manuscript>\d+)/(?P<page>\d+)/(?P<region>[^/]+)/(?P<size>[^/]+)/'
+        r'(?P<rotation>[^/]+)/(?P<quality>\w+)\.(?P<format>\w+)$',
+        iiif.image,
+        name='iiif-image',
+    ),
     path('api/', include(api_router.urls)),
     path('api-auth/', include(
         'rest_framework.urls',
@@ -4,6 +4,10 @@ import { faChevronLeft, faChevronRight, faPencilAlt } from '@fortawesome/free-so
 import { Shape } from '../models/shapes';
 import { Restangular } from 'ngx-restangular';
 
+/**
+ * Number of lines to prefetch when moving through a manuscript
+ */
+const WINDOW_SIZE = 20;
 
 @Component({
     selector: 'kht-annotate-grouped',
@@ -33,6 +37,11 @@ export class AnnotateGroupedComponent implements OnInit {
 
     book: any;
 
+    /**
+     * Prefetched lines for each shape, in reading order
+     */
+    windows: { [index: number]: any[] } = {};
+
     constructor(private restangular: Restangular,
                 private activatedRoute: ActivatedRoute) { }
 
@@ -71,7 +80,10 @@ export class AnnotateGroupedComponent implements OnInit {
         this.highlightShapes.forEach((shape, index) => {
             const lineID = this.getLineID(shape, forward);
             if (lineID) {
-                this.restangular.one('annotated_lines', lineID).get().subscribe( line => {
+                // the line being left may have been edited: fetch it anew when coming back
+                this.windows[index] = (this.windows[index] || []).filter(
+                    line => line.annotation.id !== shape.annotatedLine.annotation.id);
+                this.getLine(index, lineID, forward).then( line => {
                     const newShape = this.generateShape(line, shape.manuscript);
                     this.highlightShapes[index] = newShape;
                 });
@@ -79,6 +91,24 @@ export class AnnotateGroupedComponent implements OnInit {
         });
     }
 
+    /**
+     * Looks up the line in the prefetched window of this shape,
+     * or fetches the window of lines starting at it.
+     */
+    getLine(index: number, lineID: number, forward: boolean): Promise<any> {
+        const prefetched = (this.windows[index] || []).find(line => line.annotation.id === lineID);
+        if (prefetched) {
+            return Promise.resolve(prefetched);
+        }
+        return this.restangular.one('annotated_lines', lineID).customGETLIST('window', {
+            count: WINDOW_SIZE,
+            direction: forward ? 'next' : 'previous'
+        }).toPromise().then( lines => {
+            this.windows[index] = lines;
+            return lines.find(line => line.annotation.id === lineID);
+        });
+    }
+
     getLineID(shape, forward: boolean) {
         if (forward) {
             return shape.annotatedLine.next_line;
@@ -1,5 +1,7 @@
 import { Component, OnInit } from '@angular/core';
 import { Restangular } from 'ngx-restangular';
+import { forkJoin } from 'rxjs';
+import { getAll } from '../lib';
 
 @Component({
     selector: 'kht-annotate',
@@ -15,12 +17,17 @@ export class AnnotateComponent implements OnInit {
 
     ngOnInit() {
         const books = this.restangular.all('books');
-        books.getList().subscribe( bookList => {
+        getAll(books, {fields: 'id,title,author', page_size: 1000}).subscribe( bookList => {
             this.books = bookList;
-            this.books.forEach( (book, index) => {
-                const annotations =  book.manuscripts.map( man => man.annotations).flat(1);
-                const lines = annotations.filter( ann => ann.annotation_type === 'annotated_line');
-                this.books[index].lines = lines.filter(line => line.complete).length.toString() + '/' + lines.length.toString();
+            this.books.forEach( book => {
+                // count the lines on the server, rather than fetching every annotation
+                const lines = {book: book.id, annotation_type: 'annotated_line', count: 1};
+                forkJoin([
+                    this.restangular.one('annotations').get({...lines, complete: true}),
+                    this.restangular.one('annotations').get(lines),
+                ]).subscribe( ([complete, all]) => {
+                    book.lines = complete.count.toString() + '/' + all.count.toString();
+                });
             });
         });
     }
@@ -46,6 +46,16 @@ export function RestangularConfigFactory(RestangularProvider) {
             };
         }
     });
+    // lists are paginated: the items are in results, next links to the following page
+    RestangularProvider.addResponseInterceptor((data, operation) => {
+        if (operation === 'getList' && data && Array.isArray(data.results)) {
+            const list = data.results;
+            list.next = data.next;
+            list.previous = data.previous;
+            return list;
+        }
+        return data;
+    });
     RestangularProvider.setRequestSuffix('/');
     }
 
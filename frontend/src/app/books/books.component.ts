@@ -1,6 +1,6 @@
 import { Component, OnInit } from '@angular/core';
 import { Router } from '@angular/router';
-import { ListType } from '../lib';
+import { getAll, ListType } from '../lib';
 
 import { Restangular } from 'ngx-restangular';
 
@@ -16,7 +16,7 @@ export class BooksComponent implements OnInit {
 
     ngOnInit() {
         const books = this.restangular.all('books');
-        books.getList().subscribe(bookList => {
+        getAll(books).subscribe(bookList => {
             this.books = bookList;
         });
     }
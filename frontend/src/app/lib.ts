@@ -1 +1,17 @@
+import { EMPTY, Observable } from 'rxjs';
+import { expand, reduce } from 'rxjs/operators';
+
 export type ListType<T> = T extends (infer U)[] ? U : never;
+
+/**
+ * Gets every page of a paginated list, following the next links,
+ * as a single list.
+ */
+export function getAll(collection: any, params: { [name: string]: any } = {}): Observable<any[]> {
+    return collection.getList(params).pipe(
+        expand((page: any) => page.next ?
+            collection.getList({ ...params, cursor: new URL(page.next).searchParams.get('cursor') }) :
+            EMPTY),
+        reduce((list: any[], page: any[]) => list.concat(page), [])
+    );
+}
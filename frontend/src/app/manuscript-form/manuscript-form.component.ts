@@ -1,8 +1,14 @@
 import { Component, OnInit } from '@angular/core';
+import { HttpClient, HttpHeaders } from '@angular/common/http';
 import { FormGroup, FormBuilder, Validators } from '@angular/forms';
 
 import { Restangular } from 'ngx-restangular';
 import { Router } from '@angular/router';
+import { getAll } from '../lib';
+
+// scans are uploaded in chunks of this size (in bytes), which can be resumed
+const CHUNK_SIZE = 8 * 1024 * 1024;
+const RETRIES = 3;
 
 @Component({
     selector: 'kht-manuscript-form',
@@ -13,9 +19,9 @@ export class ManuscriptFormComponent implements OnInit {
     available: any[];
     results: string[];
     manuscriptForm: FormGroup;
-    manuscripts: Restangular;
 
     constructor(private fb: FormBuilder,
+        private http: HttpClient,
         private restangular: Restangular,
         private router: Router
     ) { }
@@ -23,10 +29,9 @@ export class ManuscriptFormComponent implements OnInit {
     ngOnInit() {
         // trailing slash is needed to make sure the route is understood by django
         const books = this.restangular.all('books');
-        books.getList().subscribe(bookList => {
+        getAll(books, { fields: 'title', page_size: 1000 }).subscribe(bookList => {
             this.available = bookList.map(book => book.title);
         });
-        this.manuscripts = this.restangular.all('manuscripts');
 
         this.manuscriptForm = this.fb.group({
             book: ['', Validators.required],
@@ -44,13 +49,44 @@ export class ManuscriptFormComponent implements OnInit {
         this.results = this.available.filter(t => t.toLowerCase().includes(search));
     }
 
-    uploadManuscript() {
-        // form data object will parse data, including the file
-        const myFormData = new FormData();
-        for ( const key of Object.keys(this.manuscriptForm.value)) {
-            myFormData.append(key, this.manuscriptForm.value[key]);
+    async uploadManuscript() {
+        const { filepath, ...metadata } = this.manuscriptForm.value;
+        const file: File = filepath;
+        const upload = await this.restangular.all('uploads').post({
+            filename: file.name,
+            length: file.size,
+            metadata
+        }).toPromise();
+        let offset = 0;
+        let retries = 0;
+        while (offset < file.size) {
+            const chunk = file.slice(offset, offset + CHUNK_SIZE);
+            try {
+                await this.sendChunk(upload.id, chunk, offset);
+                offset += chunk.size;
+                retries = 0;
+            } catch (error) {
+                if (++retries > RETRIES) {
+                    throw error;
+                }
+                // resume from the bytes that did arrive
+                const status = await this.restangular.one('uploads', upload.id).get().toPromise();
+                offset = status.offset;
+            }
         }
-        this.manuscripts.post(myFormData);
+        await this.restangular.one('uploads', upload.id).customPOST({}, 'finalize').toPromise();
         this.router.navigate(['/books']);
     }
+
+    private async sendChunk(upload: number, chunk: Blob, offset: number) {
+        const digest = await crypto.subtle.digest('SHA-256', await new Response(chunk).arrayBuffer());
+        const checksum = btoa(String.fromCharCode(...Array.from(new Uint8Array(digest))));
+        return this.http.patch(`/api/uploads/${upload}/`, chunk, {
+            headers: new HttpHeaders({
+                'Content-Type': 'application/offset+octet-stream',
+                'Upload-Offset': String(offset),
+                'Upload-Checksum': `sha256 ${checksum}`
+            })
+        }).toPromise();
+    }
 }
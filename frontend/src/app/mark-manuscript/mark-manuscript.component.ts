@@ -103,19 +103,19 @@ export class MarkManuscriptComponent implements OnInit {
 
     async saveShapes() {
         const lines = this.shapes.filter( shape => shape.type === 'text-line') as TextLine[];
-        if (lines) {
-            const newLines = await this.saveLines(lines);
-            this.updatePreviousNext(newLines);
+        if (lines.length) {
+            await this.saveLines(lines);
         }
     }
 
+    /**
+     * Saves the lines in a single request, which also links them
+     * in reading order and updates the line currently being annotated.
+     */
     async saveLines(lines) {
         const getRequest = () => {
             return {
-                annotation: {
-                    manuscript: this.manuscriptID,
-                    bounding_box: {}
-                }
+                bounding_box: {}
             };
         };
         let requests = [];
@@ -133,9 +133,9 @@ export class MarkManuscriptComponent implements OnInit {
             requests = lines.map((line, index) => {
                 const finalRequest = getRequest();
                 if (index === 0) {
-                    finalRequest.annotation.bounding_box = firstline;
+                    finalRequest.bounding_box = firstline;
                 } else {
-                    finalRequest.annotation.bounding_box = {
+                    finalRequest.bounding_box = {
                         x: line.x1,
                         y: line.y1,
                         width: line.x2 - line.x1,
@@ -157,9 +157,9 @@ export class MarkManuscriptComponent implements OnInit {
             requests = lines.map( (line, index) => {
                 const finalRequest = getRequest();
                 if (index === 0) {
-                    finalRequest.annotation.bounding_box = firstline;
+                    finalRequest.bounding_box = firstline;
                 } else {
-                    finalRequest.annotation.bounding_box = {
+                    finalRequest.bounding_box = {
                         x: line.x1,
                         y: line.y1,
                         width: line.x1 - lines[index - 1].x1,
@@ -169,41 +169,15 @@ export class MarkManuscriptComponent implements OnInit {
                 return finalRequest;
             });
         }
-        const getLinePromise = (req) => {
-            const annotatedLines = this.restangular.all('annotated_lines');
-            return annotatedLines.post(req).toPromise();
-        };
-        const linePromises = requests.map(req => getLinePromise(req));
-        return Promise.all(linePromises).then(response => response).catch( err => {
-            console.log(err);
-        });
-    }
-
-    updatePreviousNext(lines) {
-        // to do: logic to update wrt lines which weren't saved now but earlier
-        // i.e.: check correct manuscript and page
-        // check co-ordinates of annotation on the page
+        // to do: link wrt lines which weren't saved now but earlier,
+        // by passing the id of the line preceding these as previous_line
         // depending on left-to-right or right-to-left, determine order
-        this.restangular.one('manuscripts', this.manuscriptID).patch({currently_annotating: lines[0].created});
-        lines.forEach( (line, index) => {
-            if (index === 0) {
-                this.restangular.one('annotated_lines', Number(line.created)).patch({
-                    next_line: lines[index + 1].created
-                });
-                return;
-            }
-            if (index === lines.length - 1) {
-                this.restangular.one('annotated_lines', Number(line.created)).patch({
-                    previous_line: lines[index - 1].created
-                });
-                return;
-            } else {
-                this.restangular.one('annotated_lines', Number(line.created)).patch({
-                    previous_line: lines[index - 1].created,
-                    next_line: lines[index + 1].created
-                });
-                return;
-            }
+        return this.restangular.all('annotated_lines').customPOST({
+            manuscript: this.manuscriptID,
+            page: this.page,
+            lines: requests
+        }, 'bulk').toPromise().catch( err => {
+            console.log(err);
         });
     }
 }